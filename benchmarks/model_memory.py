@@ -0,0 +1,86 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Memory per instance of the high-volume models.
+
+Compares the generated dataclasses with their slotted and named tuple
+variants (see oralb.blesdk.compact). Run it as a module from the
+repository root, so the package is importable without installing it::
+
+    python -m benchmarks.model_memory --count 100000
+"""
+import argparse
+import dataclasses
+import gc
+import tracemalloc
+
+from caterpillar.shortcuts import unpack
+
+from oralb.blesdk.model import (
+    MotionData,
+    GyroMotionData,
+    Pressure,
+    DashboardData,
+)
+from oralb.blesdk.brush import BrushAdvertisement
+from oralb.blesdk.compact import to_compact
+
+SAMPLES = [
+    (MotionData, bytes(5)),
+    (GyroMotionData, bytes(9)),
+    (Pressure, bytes(10)),
+    (DashboardData, bytes(17)),
+    (BrushAdvertisement, bytes([6, 0x33, 1, 3, 0, 0, 5, 1, 10, 0, 0])),
+]
+
+
+def per_instance(factory, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # small integers are cached, only the instances themselves are counted
+    objects = [factory(index % 256) for index in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list itself holds one pointer per object
+    size = (after - before) / count - 8
+    del objects
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100_000)
+    argv = parser.parse_args()
+
+    print(f"{'Model':<20} {'dataclass':>10} {'slots':>10} {'tuple':>10}  (bytes)")
+    for model, data in SAMPLES:
+        obj = unpack(model, data)
+        first = dataclasses.fields(model)[0].name
+        values = dataclasses.asdict(obj)
+
+        def make(cls):
+            # all variants share the field values except the first one
+            return lambda index: cls(**{**values, first: index})
+
+        slotted = type(to_compact(obj, slots=True))
+        compact = type(to_compact(obj))
+        sizes = [
+            per_instance(make(cls), argv.count) for cls in (model, slotted, compact)
+        ]
+        print(f"{model.__name__:<20}" + "".join(f" {size:10.1f}" for size in sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Decoding throughput of sensor data frames.
+
+Decodes a mix of all frame types with the table-driven codec (tuples,
+named tuples and model instances) and with the generic caterpillar
+parser, which is measured on a smaller sample and extrapolated. Run it
+as a module from the repository root, so the package is importable
+without installing it::
+
+    python -m benchmarks.sensor_decode --frames 1000000
+"""
+import argparse
+import random
+import time
+
+from caterpillar.shortcuts import unpack, F
+
+from oralb.blesdk.model import (
+    SensorData,
+    MotionData,
+    GyroMotionData,
+    HighResolutionMotionData,
+    CalibrationData,
+    DashboardData,
+)
+from oralb.blesdk.sensor import sensor_codec, TUPLE, NAMEDTUPLE, MODEL, SPECIAL
+
+
+def make_frames(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    types = [
+        None,
+        SensorData.Data.COMINO,
+        SensorData.Data.HIGH_RESOLUTION,
+        SensorData.Data.CALIBRATION,
+        SensorData.Data.DASHBOARD,
+    ]
+    frames = []
+    for _ in range(count):
+        frame = bytearray(rng.randbytes(20))
+        kind = rng.choice(types)
+        if kind is None:
+            frame[-1] = 0
+        else:
+            frame[-2], frame[-1] = kind, SPECIAL
+        frames.append(bytes(frame))
+    return frames
+
+
+def caterpillar_decode(frame: bytes):
+    # the generic parser as used before the table-driven codec
+    if frame[-1] != SPECIAL:
+        return unpack(MotionData[4], frame)
+    match frame[-2]:
+        case SensorData.Data.COMINO:
+            return unpack(GyroMotionData[2], frame)
+        case SensorData.Data.HIGH_RESOLUTION:
+            return unpack(F(HighResolutionMotionData), frame)
+        case SensorData.Data.CALIBRATION:
+            return unpack(CalibrationData[3], frame)
+        case SensorData.Data.DASHBOARD:
+            return unpack(DashboardData[2], frame)
+
+
+def measure(name: str, decode, frames, total: int) -> None:
+    start = time.perf_counter()
+    for frame in frames:
+        decode(frame)
+    elapsed = (time.perf_counter() - start) * total / len(frames)
+    rate = total / elapsed
+    print(f"{name:<12} {elapsed:8.2f} s   {rate / 1000:10.1f} k frames/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=1_000_000)
+    parser.add_argument(
+        "--baseline", type=int, default=20_000, help="frames for caterpillar"
+    )
+    argv = parser.parse_args()
+
+    frames = make_frames(argv.frames)
+    print(f"Decoding {argv.frames} frames:")
+    for kind in (TUPLE, NAMEDTUPLE, MODEL):
+        measure(kind, sensor_codec(kind).decode, frames, argv.frames)
+
+    measure("caterpillar", caterpillar_decode, frames[: argv.baseline], argv.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -55,3 +55,27 @@ from .brush import (
     ToothbrushQuadrant,
 )
 from .client import OralBClient, OralBProperty
+from .control import ControlChannel
+from .harvest import harvest, HarvestCache, DeviceReport
+from .cache import DeviceCache, DeviceRecord
+from .scanner import parse_advertisement, find_brush, discover_brushes
+from .supervisor import ConnectionSupervisor, ConnectionState, Backoff
+from .metrics import MetricsSink, MultiSink, StatsSink, Histogram, to_prometheus
+from .trace import TraceSink
+from .session import SessionTracker, BrushingSession
+from .pressure import PressureSeries, PressureStore, Aggregate
+from .dashboard import download_dashboard, DashboardSession
+from .export import ArrowExporter, TableSpec, model_spec
+from .layout import Layout, compile_layout, is_fixed, arrow_field_types
+from .adapters import MultiAdapterScanner, FakeScanner, Sighting, list_adapters
+from .proximity import ProximityTracker, Proximity
+from .hub import NotificationHub, Subscription, Notification, DropPolicy
+from .push import ConfigPush, PushResult
+from .profile import Profile, ApplyReport, apply_profile, apply_fleet
+from .timesync import TimeSync, DeviceClock, SyncReport, SyncSample
+from .sensor import SensorCodec, SensorFrame, sensor_codec, decode_frame
+from .compact import compact_type, slotted_type, to_compact, expand, unpack_compact
+from .poller import Poller, Change
+from .gatt import GattScheduler, Priority, QueueStats, gatt_priority
+from .capture import Payload, Decoded, PayloadDecoder, HciParser, decode_capture
+from .serialize import to_json
@@ -0,0 +1,269 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import re
+import time
+import asyncio
+import collections
+import dataclasses
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from bleak import BleakScanner, BLEDevice, AdvertisementData
+
+#: location of all Bluetooth controllers on Linux
+SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+
+DetectionCallback = Callable[[BLEDevice, AdvertisementData], None]
+
+#: creates a scanner for an adapter (``None`` is the default adapter). The
+#: returned object must provide ``start()`` and ``stop()`` coroutines.
+ScannerFactory = Callable[[Optional[str], DetectionCallback], object]
+
+
+def list_adapters() -> List[str]:
+    """Returns the names of all Bluetooth adapters (``hci0`` ... ``hciN``).
+
+    Only Linux is supported, an empty list is returned on other systems.
+    """
+    try:
+        names = os.listdir(SYSFS_BLUETOOTH)
+    except OSError:
+        return []
+    adapters = [name for name in names if re.fullmatch(r"hci\d+", name)]
+    return sorted(adapters, key=lambda name: int(name[3:]))
+
+
+def bleak_scanner(adapter: Optional[str], callback: DetectionCallback):
+    """Default :data:`ScannerFactory` that uses :class:`bleak.BleakScanner`."""
+    if adapter is None:
+        return BleakScanner(detection_callback=callback)
+    return BleakScanner(detection_callback=callback, adapter=adapter)
+
+
+@dataclasses.dataclass
+class Sighting:
+    """The last advertisement of a device received by one adapter."""
+
+    device: BLEDevice
+    advertisement: AdvertisementData
+    adapter: Optional[str]
+    #: time of the advertisement (time.monotonic)
+    seen: float
+
+    @property
+    def rssi(self) -> int:
+        return self.advertisement.rssi
+
+
+class MultiAdapterScanner:
+    """Scans on several adapters at once and merges the results.
+
+    Every adapter runs its own scanner. Results are keyed by address and,
+    for each address, the adapter with the best RSSI is selected. The
+    scanner also keeps track of connections per adapter, so connections
+    can be spread over all radios (see :meth:`acquire`).
+
+    :param adapters: adapter names, all adapters of this system if omitted
+        (or the default adapter if none could be listed)
+    :param scanner_factory: creates the scanner of one adapter, e.g. a
+        :class:`FakeScanner` for tests
+    :param max_age: sightings older than this (in seconds) are ignored when
+        selecting the best adapter
+    """
+
+    def __init__(
+        self,
+        adapters: Optional[Sequence[Optional[str]]] = None,
+        scanner_factory: ScannerFactory = bleak_scanner,
+        max_age: float = 30.0,
+    ) -> None:
+        if adapters is None:
+            adapters = list_adapters() or [None]
+        self.adapters: Tuple[Optional[str], ...] = tuple(adapters)
+        self.scanner_factory = scanner_factory
+        self.max_age = max_age
+
+        #: address -> adapter -> last sighting
+        self.sightings: Dict[str, Dict[Optional[str], Sighting]] = {}
+
+        #: address -> adapter of connections handed out by acquire()
+        self.assignments: Dict[str, Optional[str]] = {}
+
+        #: additional callbacks invoked with every advertisement
+        self.callbacks: List[DetectionCallback] = []
+
+        self._scanners = []
+
+    async def __aenter__(self) -> "MultiAdapterScanner":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.stop()
+
+    @property
+    def scanning(self) -> bool:
+        return bool(self._scanners)
+
+    def _callback(self, adapter: Optional[str]) -> DetectionCallback:
+        def on_detection(device: BLEDevice, adv: AdvertisementData) -> None:
+            address = device.address.upper()
+            per_adapter = self.sightings.get(address)
+            if per_adapter is None:
+                per_adapter = self.sightings[address] = {}
+            per_adapter[adapter] = Sighting(device, adv, adapter, time.monotonic())
+            for callback in self.callbacks:
+                callback(device, adv)
+
+        return on_detection
+
+    async def start(self) -> None:
+        """Starts scanning on all adapters."""
+        if self._scanners:
+            return
+
+        scanners = [
+            self.scanner_factory(adapter, self._callback(adapter))
+            for adapter in self.adapters
+        ]
+        results = await asyncio.gather(
+            *(scanner.start() for scanner in scanners), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) == len(scanners):
+            # nothing to scan with, report the first error
+            raise errors[0]
+        self._scanners = [
+            scanner
+            for scanner, result in zip(scanners, results)
+            if not isinstance(result, BaseException)
+        ]
+
+    async def stop(self) -> None:
+        scanners, self._scanners = self._scanners, []
+        await asyncio.gather(
+            *(scanner.stop() for scanner in scanners), return_exceptions=True
+        )
+
+    async def discover(
+        self, timeout: float = 10.0
+    ) -> Dict[str, Tuple[BLEDevice, AdvertisementData]]:
+        """Scans on all adapters for *timeout* seconds.
+
+        The result has the same format as ``BleakScanner.discover(...,
+        return_adv=True)``, using the best sighting of every device.
+        """
+        async with self:
+            await asyncio.sleep(timeout)
+        return {
+            address: (sighting.device, sighting.advertisement)
+            for address, sighting in self.results().items()
+        }
+
+    def best(self, address: str) -> Optional[Sighting]:
+        """Returns the sighting with the best RSSI of a recent advertisement."""
+        per_adapter = self.sightings.get(address.upper())
+        if not per_adapter:
+            return None
+
+        now = time.monotonic()
+        recent = [s for s in per_adapter.values() if now - s.seen <= self.max_age]
+        return max(recent or per_adapter.values(), key=lambda s: s.rssi)
+
+    def results(self) -> Dict[str, Sighting]:
+        """Returns the best sighting of every device."""
+        return {address: self.best(address) for address in self.sightings}
+
+    def load(self) -> Dict[Optional[str], int]:
+        """Number of assigned connections per adapter."""
+        counts = collections.Counter(self.assignments.values())
+        return {adapter: counts[adapter] for adapter in self.adapters}
+
+    def adapter_for(self, address: str) -> Optional[str]:
+        """Selects the adapter for a new connection to the given device.
+
+        Only adapters that received the device recently are considered (all
+        adapters if it wasn't seen). The adapter with the fewest connections
+        is chosen, ties are broken by RSSI.
+        """
+        address = address.upper()
+        now = time.monotonic()
+        per_adapter = self.sightings.get(address, {})
+        candidates = {
+            adapter: sighting.rssi
+            for adapter, sighting in per_adapter.items()
+            if now - sighting.seen <= self.max_age and adapter in self.adapters
+        }
+        if not candidates:
+            candidates = dict.fromkeys(self.adapters, -128)
+
+        load = self.load()
+        return min(candidates, key=lambda name: (load[name], -candidates[name]))
+
+    def acquire(self, address: str) -> Optional[str]:
+        """Assigns an adapter to a connection, see :meth:`adapter_for`.
+
+        The device keeps its adapter until :meth:`release` is called.
+        """
+        address = address.upper()
+        if address not in self.assignments:
+            self.assignments[address] = self.adapter_for(address)
+        return self.assignments[address]
+
+    def release(self, address: str) -> None:
+        self.assignments.pop(address.upper(), None)
+
+    def device(
+        self, address: str, adapter: Optional[str] = None
+    ) -> Optional[BLEDevice]:
+        """Returns the BLE device as seen by the given (or best) adapter."""
+        per_adapter = self.sightings.get(address.upper(), {})
+        sighting = per_adapter.get(adapter) if adapter is not None else None
+        if sighting is None:
+            sighting = self.best(address)
+        return sighting.device if sighting is not None else None
+
+
+class FakeScanner:
+    """In-memory scanner backend for tests.
+
+    Use it with ``MultiAdapterScanner(scanner_factory=FakeScanner.factory(
+    registry))`` and emit advertisements through the scanners stored in
+    *registry* (keyed by adapter).
+    """
+
+    def __init__(self, adapter: Optional[str], callback: DetectionCallback) -> None:
+        self.adapter = adapter
+        self.callback = callback
+        self.running = False
+
+    @staticmethod
+    def factory(registry: Dict[Optional[str], "FakeScanner"]) -> ScannerFactory:
+        def create(adapter: Optional[str], callback: DetectionCallback):
+            scanner = registry[adapter] = FakeScanner(adapter, callback)
+            return scanner
+
+        return create
+
+    async def start(self) -> None:
+        self.running = True
+
+    async def stop(self) -> None:
+        self.running = False
+
+    def emit(self, device: BLEDevice, adv: AdvertisementData) -> None:
+        if self.running:
+            self.callback(device, adv)
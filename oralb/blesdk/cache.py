@@ -0,0 +1,246 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import json
+import pathlib
+import dataclasses
+
+from typing import Dict, Optional
+
+from .advertise import ProtocolVersion
+from .brush import BrushAdvertisement, BrushInfo, BrushID, BrushType
+from .model import DeviceName
+from .harvest import HarvestCache, ItemKey
+
+CACHE_VERSION = 1
+
+
+def default_cache_path() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return pathlib.Path(base) / "oralb" / "devices.json"
+
+
+@dataclasses.dataclass
+class DeviceRecord:
+    """Identity of a single brush as seen by previous connections."""
+
+    #: the Bluetooth address (upper case)
+    address: str
+
+    #: the value of ``BrushID``
+    device_id: Optional[int] = None
+
+    protocol: Optional[int] = None
+    brush_type: Optional[int] = None
+
+    #: the firmware version (as reported in ``BrushInfo`` and advertisements)
+    firmware: Optional[int] = None
+
+    name: Optional[str] = None
+
+    #: characteristic UUID to handle mapping. bleak always discovers the
+    #: services itself, so the handles are not used for connecting; they
+    #: resolve ATT handles of captured traffic (``oralbcli decode -c``)
+    handles: Dict[str, int] = dataclasses.field(default_factory=dict)
+
+    @property
+    def is_complete(self) -> bool:
+        return None not in (
+            self.device_id,
+            self.protocol,
+            self.brush_type,
+            self.firmware,
+        )
+
+    def apply(self, client) -> None:
+        """Configures the given client without any reads.
+
+        The protocol version is set and the identity characteristics are
+        pre-filled, so awaiting them will not touch the device. Values of a
+        captured advertisement and an explicit protocol are kept.
+        """
+        if self.protocol is not None and client.detects_protocol:
+            client.protocol = ProtocolVersion(self.protocol)
+
+        if self.is_complete and client.advertisement is None:
+            client.brush_info._value = BrushInfo(
+                BrushType(self.brush_type),
+                ProtocolVersion(self.protocol),
+                self.firmware,
+            )
+            client.brush_id._value = BrushID(self.device_id)
+        if self.name is not None:
+            client.name._value = DeviceName(self.name)
+
+
+def _encode_key(key: ItemKey) -> str:
+    return f"{key[0]}:{int(key[1])}"
+
+
+def _decode_key(text: str) -> ItemKey:
+    kind, value = text.split(":", 1)
+    return kind, int(value)
+
+
+class DeviceCache(HarvestCache):
+    """Persistent cache of device identities and immutable metadata.
+
+    Records are stored per address, immutable metadata responses per
+    ``BrushID``. Everything is written to a single JSON file.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        super().__init__()
+        self.path = pathlib.Path(path) if path else default_cache_path()
+        self.records: Dict[str, DeviceRecord] = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Optional[pathlib.Path] = None) -> "DeviceCache":
+        cache = cls(path)
+        try:
+            with open(cache.path, "r", encoding="utf-8") as fp:
+                document = json.load(fp)
+        except (OSError, ValueError):
+            # missing or corrupted files result in an empty cache
+            return cache
+
+        if document.get("version") != CACHE_VERSION:
+            return cache
+
+        # stale or hand-edited entries are skipped, the devices are learned
+        # again on the next connect
+        names = {field.name for field in dataclasses.fields(DeviceRecord)}
+        for address, values in document.get("devices", {}).items():
+            try:
+                values = {key: value for key, value in values.items() if key in names}
+                cache.records[address] = DeviceRecord(**values)
+            except (TypeError, AttributeError):
+                continue
+        for device_id, items in document.get("items", {}).items():
+            try:
+                cache._entries[int(device_id)] = {
+                    _decode_key(key): bytes.fromhex(data)
+                    for key, data in items.items()
+                }
+            except (TypeError, ValueError, AttributeError):
+                continue
+        return cache
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        document = {
+            "version": CACHE_VERSION,
+            "devices": {
+                address: dataclasses.asdict(record)
+                for address, record in self.records.items()
+            },
+            "items": {
+                str(device_id): {
+                    _encode_key(key): data.hex() for key, data in items.items()
+                }
+                for device_id, items in self._entries.items()
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(document, fp, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get_record(self, address: str) -> Optional[DeviceRecord]:
+        return self.records.get(address.upper())
+
+    def find(self, device_id: int) -> Optional[DeviceRecord]:
+        for record in self.records.values():
+            if record.device_id == device_id:
+                return record
+
+    def put(self, device_id: int, key: ItemKey, data: bytes) -> None:
+        super().put(device_id, key, data)
+        self.dirty = True
+
+    def invalidate(self, device_id: Optional[int] = None) -> None:
+        super().invalidate(device_id)
+        if device_id is None:
+            self.records.clear()
+        self.dirty = True
+
+    def forget(self, address: str) -> None:
+        record = self.records.pop(address.upper(), None)
+        if record is not None:
+            super().invalidate(record.device_id)
+            self.dirty = True
+
+    def observe(self, address: str, adv: BrushAdvertisement) -> bool:
+        """Checks a received advertisement against the cached record.
+
+        If the firmware version changed, all cached data of the device is
+        dropped, because handles and metadata may have changed as well.
+
+        :return: whether the cached record was invalidated
+        """
+        record = self.get_record(address)
+        if record is None:
+            return False
+
+        if record.firmware is None or record.firmware == adv.version:
+            return False
+
+        super().invalidate(record.device_id)
+        self.records[record.address] = DeviceRecord(
+            record.address,
+            device_id=record.device_id,
+            protocol=int(adv.protocol),
+            brush_type=int(adv.type),
+            firmware=adv.version,
+        )
+        self.dirty = True
+        return True
+
+    async def learn(self, client) -> DeviceRecord:
+        """Reads the identity of a connected client and stores it.
+
+        The client's protocol version is filled in unless it is known
+        already. Values that were pre-filled by :meth:`DeviceRecord.apply`
+        are not read again.
+        """
+        info: BrushInfo = await client.brush_info
+        if client.detects_protocol:
+            client.protocol = ProtocolVersion(info.protocol)
+        brush_id: BrushID = await client.brush_id
+        name: DeviceName = await client.name
+
+        handles = {}
+        if client.client is not None:
+            for char in client.client.services.characteristics.values():
+                handles[char.uuid.upper()] = char.handle
+
+        record = DeviceRecord(
+            client.address.upper(),
+            device_id=brush_id.id,
+            protocol=int(info.protocol),
+            brush_type=int(info.type),
+            firmware=info.version,
+            name=name.text,
+            handles=handles,
+        )
+        if self.records.get(record.address) != record:
+            self.records[record.address] = record
+            self.dirty = True
+        return record
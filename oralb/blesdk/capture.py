@@ -0,0 +1,533 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import re
+import struct
+import uuid as uuidlib
+import itertools
+import dataclasses
+
+from typing import BinaryIO, Dict, Iterable, Iterator, NamedTuple, Optional
+
+from caterpillar.shortcuts import unpack
+from caterpillar.exception import StructException
+
+from .advertise import ProtocolVersion, COMPANY_ID
+from .brush import BrushAdvertisement
+from .harvest import ItemKey, META, DATA, decode_item
+from .model import Control, CH_CONTROL, CH_SESSION_DATA, __characteristics__
+from .model import make_uuid
+
+#: pseudo characteristic of advertised manufacturer data
+ADVERTISEMENT = "advertisement"
+
+# payload kinds
+READ = "read"
+WRITE = "write"
+NOTIFY = "notify"
+ADVERTISE = "adv"
+#: a (uuid, hex) line without direction
+VALUE = "value"
+
+BTSNOOP_MAGIC = b"btsnoop\0"
+#: microseconds between 0000-01-01 and the UNIX epoch
+BTSNOOP_EPOCH = 0x00DCDDB30F2F8000
+
+# btsnoop datalink types
+DLT_HCI_UNENCAPSULATED = 1001
+DLT_HCI_UART = 1002
+
+# pcap link types
+LINKTYPE_BLUETOOTH_HCI_H4 = 187
+LINKTYPE_BLUETOOTH_HCI_H4_WITH_PHDR = 201
+
+# H4 packet indicators
+H4_COMMAND = 0x01
+H4_ACL = 0x02
+H4_EVENT = 0x04
+
+#: L2CAP channel of the attribute protocol
+ATT_CID = 0x0004
+
+# the Bluetooth SIG base UUID of 16-bit UUIDs
+_SIG_UUID = "0000{:04x}-0000-1000-8000-00805f9b34fb"
+_CHARACTERISTIC_DECLARATION = 0x2803
+
+_UUIDS = {uuid.upper(): uuid for uuid in __characteristics__}
+_NAMES = {model.__cname__: uuid for uuid, model in __characteristics__.items()}
+_NAMES.update(control=CH_CONTROL, session_data=CH_SESSION_DATA)
+_UUIDS.update((uuid.upper(), uuid) for uuid in (CH_CONTROL, CH_SESSION_DATA))
+
+
+class Payload(NamedTuple):
+    """A captured value of a characteristic (or an advertisement)."""
+
+    #: characteristic UUID, :data:`ADVERTISEMENT` or ``None`` if the
+    #: attribute handle could not be resolved
+    characteristic: Optional[str]
+    data: bytes
+    #: one of ``read``, ``write``, ``notify``, ``adv`` or ``value``
+    kind: str = VALUE
+    address: Optional[str] = None
+    #: capture time (UNIX seconds)
+    timestamp: Optional[float] = None
+    #: attribute handle of captured ATT packets
+    handle: Optional[int] = None
+    #: explicit metadata or data item of the payload
+    item: Optional[ItemKey] = None
+
+
+class Decoded(NamedTuple):
+    """A decoded payload."""
+
+    payload: Payload
+    #: characteristic name or item (e.g. ``meta:BLE_PROFILE``)
+    name: Optional[str]
+    #: the decoded model (raw bytes if no model is known)
+    value: object
+    error: Optional[str] = None
+
+
+def resolve_characteristic(name: str) -> str:
+    """Resolves a characteristic name (e.g. ``pressure``), short UUID
+    (``FF0B``) or full UUID."""
+    if name in _NAMES:
+        return _NAMES[name]
+    if len(name) == 4:
+        name = make_uuid(name.upper())
+    return _UUIDS.get(name.upper(), name)
+
+
+def _parse_item(kind: str, value: str) -> ItemKey:
+    enum_type = Control.METADATA if kind == META else Control.DataRead
+    if value.isdigit():
+        return kind, int(value)
+    try:
+        return kind, enum_type[value.upper()]
+    except KeyError:
+        raise ValueError(f"Unknown {kind} item: {value!r}") from None
+
+
+_LINE = re.compile(r"^\s*([^\s,]+)[\s,]+(.*)$")
+
+
+def parse_line(line: str) -> Optional[Payload]:
+    """Parses a ``<characteristic> <hex payload>`` line.
+
+    The characteristic is a name, short or full UUID, ``adv`` for
+    manufacturer data or ``meta:<item>`` / ``data:<item>`` for control
+    responses. The payload may contain whitespace and colons. Blank lines
+    and comments (``#``) return ``None``.
+
+    :raises ValueError: on malformed lines
+    """
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+
+    match = _LINE.match(line)
+    if match is None:
+        raise ValueError(f"Expected '<characteristic> <hex>' - got {line!r}")
+
+    key, text = match.groups()
+    text = re.sub(r"[\s:]", "", text)
+    if text[:2].lower() == "0x":
+        text = text[2:]
+    data = bytes.fromhex(text)
+
+    kind, _, value = key.partition(":")
+    if kind.lower() in (META, DATA) and value:
+        item = _parse_item(kind.lower(), value)
+        return Payload(CH_SESSION_DATA, data, item=item)
+    if key.lower() in (ADVERTISE, ADVERTISEMENT):
+        return Payload(ADVERTISEMENT, data, ADVERTISE)
+    return Payload(resolve_characteristic(key), data)
+
+
+def read_lines(lines: Iterable) -> Iterator[Payload]:
+    """Parses text lines (``str`` or ``bytes``) with :func:`parse_line`.
+
+    :raises ValueError: on the first malformed line
+    """
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        try:
+            payload = parse_line(line)
+        except ValueError as err:
+            raise ValueError(f"line {number}: {err}") from None
+        if payload is not None:
+            yield payload
+
+
+@dataclasses.dataclass
+class _Connection:
+    address: Optional[str] = None
+    #: attribute handle -> characteristic UUID
+    handles: Dict[int, str] = dataclasses.field(default_factory=dict)
+    #: incomplete L2CAP frame
+    fragment: bytes = b""
+    #: handle of the read request in flight
+    reading: Optional[int] = None
+    #: attribute type of the "read by type" request in flight
+    read_type: Optional[int] = None
+
+
+def _address(data: bytes) -> str:
+    return ":".join(f"{byte:02X}" for byte in reversed(data))
+
+
+def _uuid(data: bytes) -> str:
+    if len(data) == 2:
+        return _SIG_UUID.format(int.from_bytes(data, "little"))
+    value = str(uuidlib.UUID(bytes=bytes(reversed(data))))
+    return _UUIDS.get(value.upper(), value)
+
+
+class HciParser:
+    """Extracts characteristic values and advertisements from HCI packets.
+
+    ACL packets are reassembled into L2CAP frames; reads, writes,
+    notifications and indications of the attribute protocol become
+    :class:`Payload` objects. Attribute handles are resolved with the
+    characteristic discovery found in the capture, or with handles that
+    are known beforehand (e.g. from the :class:`DeviceCache`). Peer
+    addresses are taken from the LE connection complete events.
+
+    :param handles: attribute handle to UUID mapping of all connections
+    :param devices: handle mappings per device address
+    """
+
+    def __init__(
+        self,
+        handles: Optional[Dict[int, str]] = None,
+        devices: Optional[Dict[str, Dict[int, str]]] = None,
+    ) -> None:
+        self.handles = dict(handles or {})
+        self.devices = {
+            address.upper(): dict(mapping)
+            for address, mapping in (devices or {}).items()
+        }
+        self.connections: Dict[int, _Connection] = {}
+
+    def _connection(self, handle: int) -> _Connection:
+        connection = self.connections.get(handle)
+        if connection is None:
+            connection = self.connections[handle] = _Connection(
+                handles=dict(self.handles)
+            )
+        return connection
+
+    def feed(self, packet: bytes, timestamp: Optional[float] = None):
+        """Parses one H4 packet (starting with the packet indicator)."""
+        if len(packet) < 2:
+            return
+        if packet[0] == H4_ACL:
+            yield from self._acl(packet[1:], timestamp)
+        elif packet[0] == H4_EVENT:
+            yield from self._event(packet[1:], timestamp)
+
+    def _event(self, data: bytes, timestamp):
+        code = data[0]
+        if code == 0x05 and len(data) >= 6:
+            # disconnection complete
+            self.connections.pop(int.from_bytes(data[3:5], "little") & 0x0FFF, None)
+        elif code == 0x3E and len(data) >= 3:
+            subevent = data[2]
+            if subevent in (0x01, 0x0A) and len(data) >= 14:
+                # (enhanced) connection complete
+                if data[3] != 0:
+                    return
+                handle = int.from_bytes(data[4:6], "little") & 0x0FFF
+                address = _address(data[8:14])
+                handles = dict(self.handles)
+                handles.update(self.devices.get(address, {}))
+                self.connections[handle] = _Connection(address, handles)
+            elif subevent == 0x02:
+                yield from self._advertising_reports(data[3:], timestamp)
+
+    def _advertising_reports(self, data: bytes, timestamp):
+        # legacy advertising reports; the fields of all reports are stored
+        # one after another
+        count, offset = data[0], 1 + data[0] * 8
+        addresses = [
+            _address(data[start : start + 6])
+            for start in range(1 + count * 2, offset, 6)
+        ]
+        lengths = data[offset : offset + count]
+        offset += count
+        for address, length in zip(addresses, lengths):
+            report = data[offset : offset + length]
+            offset += length
+            while len(report) >= 2:
+                size, ad_type = report[0], report[1]
+                field, report = report[2 : 1 + size], report[1 + size :]
+                company = int.from_bytes(field[:2], "little")
+                if ad_type == 0xFF and company == COMPANY_ID:
+                    value = bytes(field[2:])
+                    yield Payload(ADVERTISEMENT, value, ADVERTISE, address, timestamp)
+
+    def _acl(self, data: bytes, timestamp):
+        if len(data) < 4:
+            return
+        header = int.from_bytes(data[:2], "little")
+        connection = self._connection(header & 0x0FFF)
+        if (header >> 12) & 0x3 == 0x1:
+            # continuing fragment
+            connection.fragment += data[4:]
+        else:
+            connection.fragment = data[4:]
+
+        frame = connection.fragment
+        if len(frame) < 4:
+            return
+        length, cid = struct.unpack_from("<HH", frame)
+        if len(frame) < 4 + length:
+            return
+        connection.fragment = b""
+        if cid == ATT_CID:
+            yield from self._att(connection, frame[4 : 4 + length], timestamp)
+
+    def _att(self, connection: _Connection, pdu: bytes, timestamp):
+        if not pdu:
+            return
+        opcode = pdu[0]
+        if opcode == 0x0A and len(pdu) >= 3:
+            # read request
+            connection.reading = int.from_bytes(pdu[1:3], "little")
+        elif opcode == 0x0B:
+            handle, connection.reading = connection.reading, None
+            if handle is not None:
+                yield self._payload(connection, handle, pdu[1:], READ, timestamp)
+        elif opcode in (0x12, 0x52) and len(pdu) >= 3:
+            handle = int.from_bytes(pdu[1:3], "little")
+            yield self._payload(connection, handle, pdu[3:], WRITE, timestamp)
+        elif opcode in (0x1B, 0x1D) and len(pdu) >= 3:
+            handle = int.from_bytes(pdu[1:3], "little")
+            yield self._payload(connection, handle, pdu[3:], NOTIFY, timestamp)
+        elif opcode == 0x08 and len(pdu) >= 7:
+            # read by type request, 16-bit types only
+            connection.read_type = int.from_bytes(pdu[5:7], "little")
+        elif opcode == 0x09 and len(pdu) >= 2:
+            read_type, connection.read_type = connection.read_type, None
+            if read_type == _CHARACTERISTIC_DECLARATION:
+                self._discovered(connection, pdu[1], pdu[2:])
+
+    def _discovered(self, connection: _Connection, size: int, data: bytes) -> None:
+        # characteristic declarations: handle, properties, value handle, UUID
+        if size < 7:
+            return
+        for offset in range(0, len(data) - size + 1, size):
+            entry = data[offset : offset + size]
+            value_handle = int.from_bytes(entry[3:5], "little")
+            connection.handles[value_handle] = _uuid(entry[5:])
+
+    def _payload(self, connection, handle, value, kind, timestamp) -> Payload:
+        return Payload(
+            connection.handles.get(handle),
+            bytes(value),
+            kind,
+            connection.address,
+            timestamp,
+            handle,
+        )
+
+
+def read_btsnoop(stream: BinaryIO, parser: HciParser, head: bytes = b""):
+    """Reads HCI packets of a btsnoop file (e.g. Android's HCI snoop log).
+
+    :param head: bytes that were already read from the stream
+    """
+    header = head + stream.read(16 - len(head))
+    if len(header) < 16 or header[:8] != BTSNOOP_MAGIC:
+        raise ValueError("Not a btsnoop file")
+    _, datalink = struct.unpack_from(">II", header, 8)
+    if datalink not in (DLT_HCI_UNENCAPSULATED, DLT_HCI_UART):
+        raise ValueError(f"Unsupported btsnoop datalink: {datalink}")
+
+    record = struct.Struct(">IIIIq")
+    while True:
+        data = stream.read(record.size)
+        if len(data) < record.size:
+            return
+        _, length, flags, _, timestamp = record.unpack(data)
+        packet = stream.read(length)
+        timestamp = (timestamp - BTSNOOP_EPOCH) / 1e6
+        if datalink == DLT_HCI_UNENCAPSULATED:
+            # the packet type is stored in the flags
+            if flags & 0x02:
+                indicator = H4_EVENT if flags & 0x01 else H4_COMMAND
+            else:
+                indicator = H4_ACL
+            packet = bytes([indicator]) + packet
+        yield from parser.feed(packet, timestamp)
+
+
+_PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e9),
+}
+
+
+def read_pcap(stream: BinaryIO, parser: HciParser, head: bytes = b""):
+    """Reads HCI packets of a pcap file (link types 187 and 201)."""
+    header = head + stream.read(24 - len(head))
+    if len(header) < 24 or header[:4] not in _PCAP_MAGIC:
+        raise ValueError("Not a pcap file")
+    order, resolution = _PCAP_MAGIC[header[:4]]
+    linktype = struct.unpack_from(order + "I", header, 20)[0]
+    if linktype not in (
+        LINKTYPE_BLUETOOTH_HCI_H4,
+        LINKTYPE_BLUETOOTH_HCI_H4_WITH_PHDR,
+    ):
+        raise ValueError(f"Unsupported pcap link type: {linktype}")
+
+    record = struct.Struct(order + "IIII")
+    while True:
+        data = stream.read(record.size)
+        if len(data) < record.size:
+            return
+        seconds, fraction, length, _ = record.unpack(data)
+        packet = stream.read(length)
+        if linktype == LINKTYPE_BLUETOOTH_HCI_H4_WITH_PHDR:
+            # skip the direction header
+            packet = packet[4:]
+        yield from parser.feed(packet, seconds + fraction / resolution)
+
+
+def read_capture(
+    stream: BinaryIO, parser: Optional[HciParser] = None
+) -> Iterator[Payload]:
+    """Reads payloads from a binary stream.
+
+    The format is detected from the first bytes: btsnoop and pcap files
+    are parsed with *parser* (a new :class:`HciParser` by default), all
+    other input is read as text lines (see :func:`parse_line`).
+    """
+    parser = parser or HciParser()
+    head = stream.read(8)
+    if head == BTSNOOP_MAGIC:
+        return read_btsnoop(stream, parser, head)
+    if head[:4] in _PCAP_MAGIC:
+        return read_pcap(stream, parser, head)
+    first = head + stream.readline()
+    return read_lines(itertools.chain([first], stream))
+
+
+class PayloadDecoder:
+    """Decodes captured payloads with the registered models.
+
+    Characteristic values are decoded with their model from
+    ``__characteristics__``, advertisements as
+    :class:`BrushAdvertisement`. Control requests are tracked per device:
+    the next value of ``CH_SESSION_DATA`` is decoded with the model of the
+    requested metadata or data item (see
+    :func:`~oralb.blesdk.harvest.decode_item`).
+
+    :param protocol: protocol version of all payloads, taken from the
+        advertisements of each device if omitted
+    """
+
+    def __init__(self, protocol: Optional[ProtocolVersion] = None) -> None:
+        self.protocol = protocol
+        self.protocols: Dict[Optional[str], ProtocolVersion] = {}
+        self._pending: Dict[Optional[str], ItemKey] = {}
+
+    def protocol_of(self, address: Optional[str]) -> ProtocolVersion:
+        if self.protocol is not None:
+            return self.protocol
+        return self.protocols.get(address, ProtocolVersion.V006)
+
+    def decode(self, payload: Payload) -> Decoded:
+        """Decodes a single payload; errors are reported in the result."""
+        try:
+            return self._decode(payload)
+        except (StructException, ValueError, EOFError) as err:
+            if payload.item is not None:
+                name = _item_name(payload.item)
+            else:
+                name = _name(payload.characteristic)
+            return Decoded(payload, name, None, f"{type(err).__name__}: {err}")
+
+    def decode_all(self, payloads: Iterable[Payload]) -> Iterator[Decoded]:
+        return map(self.decode, payloads)
+
+    def _decode(self, payload: Payload) -> Decoded:
+        characteristic, data = payload.characteristic, payload.data
+        if characteristic == ADVERTISEMENT:
+            adv = unpack(BrushAdvertisement, data)
+            if adv.protocol != ProtocolVersion.UNKNOWN:
+                self.protocols[payload.address] = adv.protocol
+            return Decoded(payload, ADVERTISEMENT, adv)
+
+        protocol = self.protocol_of(payload.address)
+        if characteristic == CH_CONTROL:
+            request = unpack(Control, data, protocol=protocol)
+            if payload.kind != READ:
+                self._remember(payload.address, request)
+            return Decoded(payload, "control", request)
+
+        if characteristic == CH_SESSION_DATA:
+            item = payload.item
+            if item is None and payload.kind != WRITE:
+                item = self._pending.pop(payload.address, None)
+            if item is None:
+                return Decoded(payload, "session_data", bytes(data))
+            return Decoded(payload, _item_name(item), decode_item(item, data))
+
+        model = __characteristics__.get(characteristic)
+        if model is None:
+            return Decoded(payload, None, bytes(data))
+        return Decoded(
+            payload, model.__cname__, unpack(model, data, protocol=protocol)
+        )
+
+    def _remember(self, address: Optional[str], request: Control) -> None:
+        if request.command == Control.Command.READ_METADATA:
+            self._pending[address] = (META, request.parameter)
+        elif request.command == Control.Command.READ_DATA:
+            self._pending[address] = (DATA, request.parameter)
+        else:
+            self._pending.pop(address, None)
+
+
+def _item_name(item: ItemKey) -> str:
+    kind, value = item
+    enum_type = Control.METADATA if kind == META else Control.DataRead
+    try:
+        return f"{kind}:{enum_type(value).name}"
+    except ValueError:
+        return f"{kind}:{value}"
+
+
+def _name(characteristic: Optional[str]) -> Optional[str]:
+    if characteristic in (ADVERTISEMENT, None):
+        return characteristic
+    model = __characteristics__.get(characteristic)
+    if model is not None:
+        return model.__cname__
+    return {CH_CONTROL: "control", CH_SESSION_DATA: "session_data"}.get(
+        characteristic
+    )
+
+
+def decode_capture(
+    stream: BinaryIO,
+    protocol: Optional[ProtocolVersion] = None,
+    parser: Optional[HciParser] = None,
+) -> Iterator[Decoded]:
+    """Reads and decodes all payloads of a capture or text dump."""
+    return PayloadDecoder(protocol).decode_all(read_capture(stream, parser))
@@ -12,6 +12,8 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import time
+
 from typing import Optional, List
 from asyncio import all_tasks
 
@@ -22,6 +24,12 @@ from caterpillar.abc import hasstruct, getstruct
 
 from .model import __characteristics__
 from .advertise import ProtocolVersion
+from .control import ControlChannel
+from .hub import NotificationHub
+from .brush import BrushAdvertisement, BrushInfo, BrushType
+from .scanner import find_brush
+from .metrics import MetricsSink
+from .gatt import GattScheduler
 
 
 class OralBProperty:
@@ -36,11 +44,23 @@ class OralBProperty:
             return self.model() if not hasstruct(self.model) else getstruct(self.model)
         return self.model
 
+    def decode(self, data: bytes):
+        metrics = self.obclient.metrics
+        if metrics is None:
+            return unpack(self._get_struct(), data, protocol=self.obclient.protocol)
+
+        start = time.perf_counter()
+        try:
+            return unpack(self._get_struct(), data, protocol=self.obclient.protocol)
+        finally:
+            model_name = getattr(self.model, "__name__", type(self.model).__name__)
+            elapsed = time.perf_counter() - start
+            metrics.observe("decode", self.obclient.address, model_name, elapsed)
+
     async def _get(self):
         if self._value is None:
             data = await self.obclient.read(self.name)
-            struct = self._get_struct()
-            self._value = unpack(struct, data, protocol=self.obclient.protocol)
+            self._value = self.decode(data)
 
         return self._value
 
@@ -66,7 +86,31 @@ class OralBClient:
     ) -> None:
         self.protocol = protocol or ProtocolVersion.V006
         self.address = address
+        self.brush_type: Optional[BrushType] = None
+        self.advertisement: Optional[BrushAdvertisement] = None
+        # the protocol is taken from advertisements unless set explicitly
+        self._detect = protocol is None
         self.client = None
+        self.control = ControlChannel(self)
+
+        #: shares notifications between many consumers
+        self.hub = NotificationHub(self)
+
+        #: the adapter used for connections (e.g. ``"hci1"``, BlueZ only)
+        self.adapter: Optional[str] = None
+        self._client_adapter: Optional[str] = None
+
+        #: orders reads and writes with other clients on the same adapter
+        #: if set (see oralb.blesdk.gatt)
+        self.scheduler: Optional[GattScheduler] = None
+
+        #: called with this client when the connection was lost
+        self.disconnected_callback = None
+
+        #: receives operation latencies if set (see oralb.blesdk.metrics)
+        self.metrics: Optional[MetricsSink] = None
+        # active subscriptions, restored on every connect
+        self._subscriptions = {}
         self._fields = set()
 
         for name, cls_ in __characteristics__.items():
@@ -82,25 +126,130 @@ class OralBClient:
     async def __aexit__(self, exc_type, exc_value, traceback) -> None:
         await self.client.disconnect()
 
-    async def connect(self, address=None):
+    async def connect(self, address=None, advertisement=None):
         if self.client:
             await self.disconnect()
 
         previous_address = self.address
         self.address = address or self.address
-        if self.client is None or self.address != previous_address:
-            self.client = BleakClient(address)
+        # the adapter is bound to the BleakClient, a new one is needed if
+        # a different adapter was chosen
+        if (
+            self.client is None
+            or self.address != previous_address
+            or self._client_adapter != self.adapter
+        ):
+            if previous_address is not None and self.address != previous_address:
+                self.invalidate()
+            if advertisement is not None:
+                self.configure(advertisement)
+            options = {"adapter": self.adapter} if self.adapter else {}
+            self._client_adapter = self.adapter
+            self.client = BleakClient(
+                await self._resolve_device(),
+                disconnected_callback=self._on_disconnect,
+                **options,
+            )
+
+        result = await self._measure("connect", self.address, self.client.connect())
+        await self.restore_subscriptions()
+        # control responses are read explicitly if the firmware does not
+        # notify on CH_SESSION_DATA
+        await self.control.start_notify()
+        return result
+
+    async def _measure(self, op: str, target: str, awaitable):
+        if self.metrics is None:
+            return await awaitable
+
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.observe(op, self.address, target, elapsed)
+
+    def _on_disconnect(self, _) -> None:
+        self.control.cancel_pending()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def restore_subscriptions(self) -> None:
+        """Subscribes to all characteristics that were subscribed before."""
+        for char, callback in self._subscriptions.items():
+            await self._start_notify(char, callback)
 
-        return await self.client.connect()
+    async def _start_notify(self, char: str, callback) -> None:
+        if self.metrics is not None:
+            metrics, address, user_callback = self.metrics, self.address, callback
+
+            def callback(sender, data):
+                metrics.count("notify", address, char)
+                user_callback(sender, data)
+
+        await self._measure("subscribe", char, self.client.start_notify(char, callback))
+
+    async def _resolve_device(self):
+        if not self._detect or self.advertisement is not None or not self.address:
+            return self.address
+
+        # bleak would scan for the device anyway, so we use that scan to
+        # capture the advertisement.
+        result = await find_brush(self.address, adapter=self.adapter)
+        if result is None:
+            # let bleak report the missing device
+            return self.address
+
+        device, advertisement = result
+        if advertisement is not None:
+            self.configure(advertisement)
+        return device
+
+    def configure(self, advertisement: BrushAdvertisement) -> None:
+        """Applies protocol version and brush type from an advertisement.
+
+        ``BrushInfo`` is derived from the advertisement as well, so it won't
+        be read from the device.
+        """
+        self.advertisement = advertisement
+        self.brush_type = advertisement.type
+        if self._detect and advertisement.protocol != ProtocolVersion.UNKNOWN:
+            self.protocol = advertisement.protocol
+
+        self.brush_info._value = BrushInfo(
+            advertisement.type, advertisement.protocol, advertisement.version
+        )
 
     async def disconnect(self):
+        self.control.cancel_pending()
         return await self.client.disconnect()
 
     async def unpair(self):
         await self.client.unpair()
 
     async def pair(self):
-        await self.client.pair()
+        await self._measure("pair", self.address, self.client.pair())
+
+    def invalidate(self) -> None:
+        """Drops all values that were read from the device."""
+        for name in self._fields:
+            getattr(self, name)._value = None
+        self.brush_type = None
+        self.advertisement = None
+        self._subscriptions.clear()
+        self.hub.reset()
+        self.control.reset()
+
+    @property
+    def detects_protocol(self) -> bool:
+        """Whether the protocol version is still unknown, i.e. it was neither
+        set explicitly nor taken from an advertisement."""
+        if not self._detect:
+            return False
+        advertisement = self.advertisement
+        if advertisement is None:
+            return True
+        return advertisement.protocol == ProtocolVersion.UNKNOWN
 
     @property
     def characteristics(self) -> List[str]:
@@ -112,21 +261,39 @@ class OralBClient:
         return self.client.is_connected if self.client else False
 
     async def subscribe(self, char: str, callback) -> None:
-        await self.client.start_notify(char, callback)
+        await self._start_notify(char, callback)
+        self._subscriptions[char] = callback
 
     async def stop_notify(self, char: str):
-        await self.client.stop_notify(char)
+        self._subscriptions.pop(char, None)
+        if self.is_connected:
+            await self.client.stop_notify(char)
 
     async def write(self, char: str, obj, response=False):
         if not isinstance(obj, bytes):
             obj = pack(obj, protocol=self.protocol)
 
-        return await self.client.write_gatt_char(char, obj, response)
+        operation = self.client.write_gatt_char(char, obj, response)
+        return await self._measure("write", char, self._schedule(operation))
 
     async def read(self, char: str):
-        return await self.client.read_gatt_char(char)
+        return await self._measure(
+            "read", char, self._schedule(self.client.read_gatt_char(char))
+        )
+
+    def _schedule(self, awaitable):
+        if self.scheduler is None:
+            return awaitable
+        return self.scheduler.run(self.address, awaitable, metrics=self.metrics)
 
     async def write_read_on(self, write: str, obj, read: str):
+        # NOTE: this method is not synchronized. Use self.control.request
+        # for control requests that may be issued concurrently.
         # result is ignored for now
+        return await self._measure(
+            "write_read_on", write, self._write_read(write, obj, read)
+        )
+
+    async def _write_read(self, write: str, obj, read: str):
         await self.write(write, obj, response=True)
         return await self.read(read)
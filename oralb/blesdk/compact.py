@@ -0,0 +1,142 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import collections
+import dataclasses
+import functools
+
+from typing import Dict, Optional
+
+from caterpillar.shortcuts import unpack
+
+from .layout import compile_layout, is_fixed
+
+# compact type -> model
+_models: Dict[type, type] = {}
+
+
+def _register(model: type, compact: type, suffix: str) -> type:
+    # compact types live in this module, so they can be pickled
+    compact.__name__ = compact.__qualname__ = model.__name__ + suffix
+    compact.__module__ = __name__
+    compact.__doc__ = f"Compact variant of :class:`{model.__name__}`."
+    globals()[compact.__name__] = compact
+    _models[compact] = model
+    return compact
+
+
+def _fields(model: type):
+    if not dataclasses.is_dataclass(model):
+        raise TypeError(f"{model!r} is not a struct model")
+    return dataclasses.fields(model)
+
+
+@functools.cache
+def compact_type(model: type) -> type:
+    """Returns a named tuple type with the fields of a model.
+
+    Named tuples have no per-instance ``__dict__`` and are the smallest
+    representation that keeps attribute access. They can be passed to
+    ``pack`` together with the model.
+    """
+    fields = _fields(model)
+    defaults = [
+        field.default
+        for field in fields
+        if field.default is not dataclasses.MISSING
+    ]
+    compact = collections.namedtuple(
+        "Compact", [field.name for field in fields], defaults=defaults or None
+    )
+    return _register(model, compact, "Tuple")
+
+
+@functools.cache
+def slotted_type(model: type) -> type:
+    """Returns a mutable dataclass with ``__slots__`` and the fields of a
+    model."""
+    fields = [
+        (field.name, field.type, dataclasses.field(default=field.default))
+        if field.default is not dataclasses.MISSING
+        else (field.name, field.type)
+        for field in _fields(model)
+    ]
+    compact = dataclasses.make_dataclass("Compact", fields, slots=True)
+    return _register(model, compact, "Slots")
+
+
+def _values(obj, model: type) -> dict:
+    return {field.name: getattr(obj, field.name) for field in _fields(model)}
+
+
+def _compact(model: type, slots: bool) -> type:
+    return slotted_type(model) if slots else compact_type(model)
+
+
+def to_compact(obj, slots: bool = False):
+    """Converts a model instance into its compact variant."""
+    return _compact(type(obj), slots)(**_values(obj, type(obj)))
+
+
+def expand(record):
+    """Converts a compact record back into an instance of its model."""
+    model = _models[type(record)]
+    return model(**_values(record, model))
+
+
+def unpack_compact(
+    data: bytes, model: type, protocol=None, slots: bool = False, offset: int = 0
+):
+    """Decodes one record of a model directly into its compact variant.
+
+    Fixed-layout models are decoded with their precompiled layout, all
+    others with the generic parser first.
+    """
+    target = _compact(model, slots)
+    if is_fixed(model):
+        return compile_layout(model).decode(data, offset, factory=target)
+
+    kwargs = {"protocol": protocol} if protocol is not None else {}
+    obj = unpack(model, bytes(data[offset:]), **kwargs)
+    return target(**_values(obj, model))
+
+
+def iter_unpack_compact(data: bytes, model: type, slots: bool = False):
+    """Decodes consecutive records of a fixed-layout model.
+
+    :raises TypeError: if the model has no fixed layout
+    """
+    layout = compile_layout(model)
+    target = _compact(model, slots)
+    for offset in range(0, len(data) - layout.size + 1, layout.size):
+        yield layout.decode(data, offset, factory=target)
+
+
+def __getattr__(name: str):
+    # compact types are created on demand, e.g. when unpickled in another
+    # process
+    base, suffix = name[:-5], name[-5:]
+    if suffix in ("Tuple", "Slots") and base:
+        from . import model, brush
+
+        for module in (model, brush):
+            candidate = getattr(module, base, None)
+            if isinstance(candidate, type) and dataclasses.is_dataclass(candidate):
+                return _compact(candidate, suffix == "Slots")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def model_of(compact: type) -> Optional[type]:
+    """Returns the model of a compact type."""
+    return _models.get(compact)
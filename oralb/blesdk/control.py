@@ -0,0 +1,219 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import heapq
+import asyncio
+import itertools
+
+from typing import Optional, Iterable, List
+
+from bleak import exc
+
+from .model import Control, CH_CONTROL, CH_SESSION_DATA
+from .gatt import current_priority
+
+
+class _PriorityLock:
+    """Lock that is handed over to waiters by :func:`gatt_priority`.
+
+    Waiters of the same priority are served in order, so a keep-alive
+    only waits for the request in flight, not for queued ones.
+    """
+
+    def __init__(self) -> None:
+        self._locked = False
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def locked(self) -> bool:
+        return self._locked
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
+
+    async def acquire(self) -> None:
+        if not self._locked:
+            self._locked = True
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters, (current_priority(), next(self._counter), future)
+        )
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # the lock was handed over concurrently
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            *_, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # the lock stays held by the next waiter
+                future.set_result(None)
+                return
+        self._locked = False
+
+
+class ControlChannel:
+    """Request/response multiplexer for the control characteristic.
+
+    Every :class:`Control` request writes to ``CH_CONTROL`` and places its
+    answer in ``CH_SESSION_DATA``. The response carries no request
+    identifier, so only one request may be in flight at a time. This class
+    queues concurrent callers, correlates each answer with the request that
+    is currently in flight and applies a timeout per request. Queued
+    callers are served by their :func:`gatt_priority`, so keep-alives
+    don't wait behind a long batch of requests.
+    """
+
+    def __init__(self, client, timeout: float = 5.0) -> None:
+        self.obclient = client
+
+        #: default timeout (in seconds) for a single round trip
+        self.timeout = timeout
+
+        self._lock = _PriorityLock()
+        self._pending: Optional[asyncio.Future] = None
+        self._notify = False
+        # the firmware did not answer a request with a notification
+        self._silent = False
+
+    @property
+    def uses_notify(self) -> bool:
+        """Whether responses are delivered by notifications."""
+        return self._notify
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def start_notify(self) -> bool:
+        """Tries to receive responses through notifications.
+
+        Not every firmware notifies on ``CH_SESSION_DATA``. If the
+        subscription fails, requests fall back to an explicit read. The
+        same happens after the first request that was not answered by a
+        notification in time.
+        """
+        if self._notify:
+            return True
+        if self._silent:
+            return False
+
+        try:
+            # through the hub, which may have other subscribers as well
+            await self.obclient.hub.add_listener(CH_SESSION_DATA, self._on_response)
+        except (exc.BleakError, ValueError):
+            return False
+
+        self._notify = True
+        return True
+
+    async def stop_notify(self) -> None:
+        self._notify = False
+        await self.obclient.hub.remove_listener(CH_SESSION_DATA, self._on_response)
+
+    def cancel_pending(self) -> None:
+        """Cancels the request in flight (e.g. after the connection was lost)."""
+        if self._pending is not None and not self._pending.done():
+            self._pending.cancel()
+        self._pending = None
+
+    def reset(self) -> None:
+        """Drops the notification state (e.g. when switching devices)."""
+        self._notify = self._silent = False
+        self.cancel_pending()
+
+    def _on_response(self, _, data: bytearray) -> None:
+        pending = self._pending
+        # Late answers of timed out requests are dropped here
+        if pending is not None and not pending.done():
+            pending.set_result(bytes(data))
+
+    async def request(self, command: Control, timeout: Optional[float] = None) -> bytes:
+        """Sends the given command and returns the raw response.
+
+        The timeout covers the round trip only, time spent waiting behind
+        other requests is not counted. If a notification does not arrive in
+        time, the response is read with a second timeout. Cancelling the
+        calling task releases the channel for the next request.
+
+        :param command: the control request
+        :param timeout: timeout in seconds, defaults to :attr:`timeout`
+        :raises TimeoutError: if no response was received in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        async with self._lock:
+            return await self.obclient._measure(
+                "control",
+                f"{command.command}:{command.parameter}",
+                self._submit(command, timeout),
+            )
+
+    async def send(self, command: Control) -> None:
+        """Writes a command without waiting for a response.
+
+        The write waits for the request in flight, so it can't land between
+        another request and its response.
+        """
+        async with self._lock:
+            await self.obclient.write(CH_CONTROL, command, response=True)
+
+    async def request_many(
+        self,
+        commands: Iterable[Control],
+        timeout: Optional[float] = None,
+        return_exceptions: bool = False,
+    ) -> List[bytes]:
+        """Queues all commands and returns their responses in order."""
+        return await asyncio.gather(
+            *(self.request(command, timeout) for command in commands),
+            return_exceptions=return_exceptions,
+        )
+
+    async def _submit(self, command: Control, timeout: float) -> bytes:
+        if not self._notify:
+            async with asyncio.timeout(timeout):
+                await self.obclient.write(CH_CONTROL, command, response=True)
+                return bytes(await self.obclient.read(CH_SESSION_DATA))
+
+        # The future must exist before the write, because the notification
+        # may arrive before write_gatt_char returns.
+        self._pending = pending = asyncio.get_running_loop().create_future()
+        written = False
+        try:
+            async with asyncio.timeout(timeout):
+                await self.obclient.write(CH_CONTROL, command, response=True)
+                written = True
+                return await pending
+        except TimeoutError:
+            if not written:
+                raise
+        finally:
+            self._pending = None
+
+        # A successful subscription does not mean that the firmware
+        # notifies. The response is read instead, and so are all following
+        # ones.
+        self._notify = False
+        self._silent = True
+        async with asyncio.timeout(timeout):
+            return bytes(await self.obclient.read(CH_SESSION_DATA))
@@ -0,0 +1,179 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import dataclasses
+
+from typing import List, Optional, Tuple
+
+from oralb.exceptions import DashboardError
+from .layout import compile_layout
+from .model import (
+    Control,
+    DashboardConfig,
+    DashboardData,
+    CH_SENSOR_DATA,
+)
+
+#: fields of a single dashboard record (the timestamp is unwrapped)
+DASHBOARD_FIELDS = (
+    "timestamp",
+    "gyro_x",
+    "gyro_y",
+    "gyro_z",
+    "motion_x",
+    "motion_y",
+    "motion_z",
+)
+
+
+def unwrap_timestamps(values: List[int], bits: int = 16) -> List[int]:
+    """Converts wrapping counter values into monotonic timestamps."""
+    span = 1 << bits
+    result = []
+    epoch = 0
+    last = None
+    for value in values:
+        if last is not None and value < last and last - value > span // 2:
+            epoch += span
+        last = value
+        result.append(epoch + value)
+    return result
+
+
+def find_gaps(
+    timestamps: List[int], step: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """Returns ``(index, missing)`` for every gap in the given timestamps.
+
+    *index* is the position of the first record after the gap, *missing*
+    the estimated number of lost records. The expected step is the most
+    common difference if not given.
+    """
+    deltas = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    if not deltas:
+        return []
+
+    if step is None:
+        positive = [delta for delta in deltas if delta > 0]
+        if not positive:
+            return []
+        step = max(set(positive), key=positive.count)
+
+    gaps = []
+    for index, delta in enumerate(deltas, start=1):
+        if delta > step * 1.5:
+            gaps.append((index, round(delta / step) - 1))
+    return gaps
+
+
+@dataclasses.dataclass
+class DashboardSession:
+    """A stored brushing session downloaded from the brush."""
+
+    session_id: int
+    divider: DashboardConfig.Divider
+
+    #: all records in transfer order
+    records: List[DashboardData] = dataclasses.field(default_factory=list)
+
+    #: unwrapped timestamps of all records
+    timestamps: List[int] = dataclasses.field(default_factory=list)
+
+    #: detected gaps as (index, missing records)
+    gaps: List[Tuple[int, int]] = dataclasses.field(default_factory=list)
+
+    #: whether the last package was received
+    complete: bool = False
+
+    @property
+    def missing(self) -> int:
+        return sum(missing for _, missing in self.gaps)
+
+    def to_numpy(self):
+        """Returns all records as a NumPy structured array.
+
+        NumPy is an optional dependency (``pip install oralb-io[analysis]``).
+        """
+        try:
+            import numpy as np
+        except ImportError as err:
+            raise ImportError("NumPy is required to export dashboard data") from err
+
+        # same layout as the records, but with room for unwrapped timestamps
+        fields = compile_layout(DashboardData).dtype.descr[1:]
+        dtype = np.dtype([("timestamp", np.uint32)] + fields)
+        rows = [
+            (timestamp, *(getattr(record, name) for name in DASHBOARD_FIELDS[1:]))
+            for timestamp, record in zip(self.timestamps, self.records)
+        ]
+        return np.array(rows, dtype=dtype)
+
+
+def _is_dashboard_frame(decoded) -> bool:
+    return (
+        isinstance(decoded, list)
+        and len(decoded) > 0
+        and isinstance(decoded[0], DashboardData)
+    )
+
+
+async def download_dashboard(
+    client,
+    session_id: int,
+    divider: DashboardConfig.Divider = DashboardConfig.Divider.FULL_RESOLUTION,
+    idle_timeout: float = 5.0,
+) -> DashboardSession:
+    """Downloads a stored session through the sensor data characteristic.
+
+    The session is selected by writing ``DashboardConfig``, the transfer is
+    started with ``Control.dashboard()``. A lower resolution (*divider*)
+    reduces the number of transferred packages.
+
+    :param client: a connected :class:`~oralb.blesdk.client.OralBClient`
+    :param idle_timeout: maximum time (in seconds) between two packages
+    :raises DashboardError: if the brush rejected the session ID
+    :raises TimeoutError: if the transfer stalled before the last package
+    """
+    session = DashboardSession(session_id, divider)
+
+    await client.dashboard.set(DashboardConfig(session_id, divider), response=True)
+    # unbounded, the transfer must not lose packages
+    subscription = await client.hub.subscribe(CH_SENSOR_DATA, maxsize=0)
+    try:
+        await client.control.send(Control.dashboard())
+        while not session.complete:
+            async with asyncio.timeout(idle_timeout):
+                notification = await subscription.get()
+
+            if notification is None:
+                raise DashboardError("Notifications were stopped during the transfer")
+            # Motion data may be interleaved with the transfer
+            if not _is_dashboard_frame(notification.value):
+                continue
+
+            # the status belongs to the frame, all records share it
+            status = notification.value[0].status
+            if status == DashboardData.Status.SESSION_ID_INVALID:
+                raise DashboardError(f"Invalid session ID: {session_id}")
+
+            session.records.extend(notification.value)
+            if status == DashboardData.Status.LAST_PACKAGE:
+                session.complete = True
+    finally:
+        await subscription.close()
+
+    session.timestamps = unwrap_timestamps([x.timestamp for x in session.records])
+    session.gaps = find_gaps(session.timestamps)
+    return session
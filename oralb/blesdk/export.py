@@ -0,0 +1,253 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import time
+import typing
+import dataclasses
+
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .model import (
+    Pressure,
+    MotionData,
+    GyroMotionData,
+    HighResolutionMotionData,
+    CalibrationData,
+    DashboardData,
+)
+from .brush import BrushAdvertisement
+from .session import BrushingSession
+from .layout import compile_layout, arrow_field_types
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as err:
+        raise ImportError(
+            "pyarrow is required for exports (pip install oralb-io[analysis])"
+        ) from err
+    return pyarrow
+
+
+@dataclasses.dataclass(frozen=True)
+class TableSpec:
+    """Describes how objects are converted into table rows."""
+
+    #: column names and arrow type names (e.g. ``"int8"``)
+    columns: Tuple[Tuple[str, str], ...]
+
+    #: converts one object into any number of rows
+    rows: Callable[[object], Iterable[tuple]]
+
+
+#: every table starts with these columns, their values are passed to
+#: :meth:`ArrowExporter.write`
+COMMON_COLUMNS = (("address", "string"), ("received", "float64"))
+
+
+def _field_type(field_type) -> str:
+    # caterpillar annotates enum fields as ``Enum | int``
+    for arg in typing.get_args(field_type) or (field_type,):
+        if isinstance(arg, type) and issubclass(arg, enum.IntEnum):
+            return "int16"
+    if field_type is str:
+        return "string"
+    if field_type in (bytes, memoryview):
+        return "binary"
+    if field_type is float:
+        return "float64"
+    # integer fields and protocol dependent fields
+    return "int64"
+
+
+def model_spec(model: type, **types: str) -> TableSpec:
+    """Derives a table specification from a struct model.
+
+    Every field becomes a column, enums are stored by value. Column types
+    are taken from the compiled layout of fixed-size models and from the
+    field definitions of other models. Fields without a fixed format
+    (e.g. protocol dependent ones) fall back to their annotation, unless
+    their type is given explicitly.
+
+    :param types: arrow type names by field name
+    """
+    try:
+        columns = compile_layout(model).arrow_types
+    except TypeError:
+        fixed = arrow_field_types(model)
+        columns = tuple(
+            (field.name, fixed.get(field.name) or _field_type(field.type))
+            for field in dataclasses.fields(model)
+        )
+    columns = tuple((name, types.get(name, type_name)) for name, type_name in columns)
+    names = [name for name, _ in columns]
+
+    def rows(obj):
+        yield tuple(getattr(obj, name) for name in names)
+
+    return TableSpec(columns, rows)
+
+
+def _pressure_rows(obj: Pressure):
+    state = int(obj.state)
+    yield (state, obj.timestamp_a, obj.record_a, obj.identifier)
+    yield (state, obj.timestamp_b, obj.record_b, obj.identifier)
+
+
+def _session_rows(obj: BrushingSession):
+    quadrants = tuple(obj.quadrant_times.get(index, 0.0) for index in range(8))
+    yield (
+        obj.start,
+        obj.end,
+        obj.brushing_time,
+        obj.high_pressure_time,
+        obj.high_pressure_count,
+        len(obj.mode_changes),
+        *quadrants,
+    )
+
+
+#: all known tables
+TABLES = {
+    # status and mode are protocol dependent uint8 enums
+    "advertisement": model_spec(BrushAdvertisement, status="uint8", brush_mode="uint8"),
+    "motion": model_spec(MotionData),
+    "gyro": model_spec(GyroMotionData),
+    "high-resolution": model_spec(HighResolutionMotionData),
+    "calibration": model_spec(CalibrationData),
+    "dashboard": model_spec(DashboardData),
+    # one row per pressure sample
+    "pressure": TableSpec(
+        (
+            ("state", "int16"),
+            ("timestamp", "uint16"),
+            ("record", "uint16"),
+            ("identifier", "uint8"),
+        ),
+        _pressure_rows,
+    ),
+    "session": TableSpec(
+        (
+            ("start", "float64"),
+            ("end", "float64"),
+            ("brushing_time", "int32"),
+            ("high_pressure_time", "float64"),
+            ("high_pressure_count", "int32"),
+            ("mode_changes", "int32"),
+            *((f"quadrant_{index + 1}", "float64") for index in range(8)),
+        ),
+        _session_rows,
+    ),
+}
+
+
+class ArrowExporter:
+    """Writes decoded objects to Parquet or Arrow IPC files in batches.
+
+    Rows are buffered per column and written as a separate row group (or
+    record batch) once *batch_size* rows were collected, so memory stays
+    bounded regardless of the amount of data.
+
+    :param path: the output file
+    :param table: name of the table in :data:`TABLES`
+    :param format: ``"parquet"`` or ``"arrow"``, guessed from the file name
+        if omitted
+    :param batch_size: number of rows per row group
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        format: Optional[str] = None,
+        batch_size: int = 65536,
+    ) -> None:
+        pa = _require_pyarrow()
+        self.spec = TABLES[table]
+        self.path = str(path)
+        self.format = format or (
+            "parquet" if self.path.endswith(".parquet") else "arrow"
+        )
+        self.batch_size = batch_size
+        self.rows_written = 0
+
+        columns = COMMON_COLUMNS + self.spec.columns
+        self.schema = pa.schema(
+            [(name, getattr(pa, type_name)()) for name, type_name in columns]
+        )
+        self._columns: List[list] = [[] for _ in columns]
+
+        match self.format:
+            case "parquet":
+                import pyarrow.parquet as pq
+
+                self._writer = pq.ParquetWriter(self.path, self.schema)
+            case "arrow":
+                import pyarrow.ipc
+
+                self._writer = pyarrow.ipc.new_file(self.path, self.schema)
+            case _:
+                raise ValueError(f"Unknown export format: {self.format!r}")
+
+    def __enter__(self) -> "ArrowExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def pending(self) -> int:
+        return len(self._columns[0])
+
+    def write(self, obj, address: str = "", received: Optional[float] = None) -> None:
+        """Adds one object (which may produce several rows)."""
+        if received is None:
+            received = time.time()
+
+        columns = self._columns
+        for row in self.spec.rows(obj):
+            columns[0].append(address)
+            columns[1].append(received)
+            for column, value in zip(columns[2:], row):
+                column.append(int(value) if isinstance(value, enum.Enum) else value)
+
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def write_all(self, objects: Iterable, address: str = "", received=None) -> None:
+        for obj in objects:
+            self.write(obj, address, received)
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+
+        pa = _require_pyarrow()
+        arrays = [
+            pa.array(column, type=field.type)
+            for column, field in zip(self._columns, self.schema)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.rows_written += batch.num_rows
+        for column in self._columns:
+            column.clear()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,235 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import time
+import asyncio
+import contextlib
+import contextvars
+import collections
+import dataclasses
+
+from typing import Deque, Dict, List, Optional, OrderedDict
+
+from .metrics import MetricsSink
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of GATT operations (lower values first)."""
+
+    #: ``Control.extend_connection`` and other requests that keep the
+    #: connection alive
+    KEEP_ALIVE = 0
+
+    #: user commands and requests waiting for a result (the default)
+    INTERACTIVE = 1
+
+    #: periodic reads
+    POLLING = 2
+
+    #: bulk transfers, e.g. OTA payload writes
+    BULK = 3
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "gatt_priority", default=Priority.INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def gatt_priority(priority: Priority):
+    """Sets the priority of all GATT operations started in this context
+    (including tasks created within it)::
+
+        with gatt_priority(Priority.BULK):
+            await client.write(CH_OTA_PAYLOAD, chunk)
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+@dataclasses.dataclass
+class QueueStats:
+    """Queue metrics of one priority class."""
+
+    #: currently queued operations and the maximum seen so far
+    depth: int = 0
+    max_depth: int = 0
+
+    #: operations that were started
+    started: int = 0
+
+    #: total and maximum time spent in the queue (in seconds)
+    wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.wait / self.started if self.started else 0.0
+
+
+class _Ticket:
+    __slots__ = ("address", "priority", "future", "queued")
+
+    def __init__(self, address: str, priority: Priority) -> None:
+        self.address = address
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued = time.perf_counter()
+
+
+class GattScheduler:
+    """Orders the GATT operations of all clients on one adapter.
+
+    BlueZ serializes GATT operations per adapter; without a scheduler a
+    long OTA transfer or a burst of polled reads delays everything else,
+    including the keep-alives that hold connections open. Operations are
+    queued in :class:`Priority` classes and started strictly by priority.
+    Within a class, devices take turns (round robin), so one busy device
+    can't starve the others.
+
+    Keep-alives may use one slot beyond *concurrency*, so they never wait
+    for a running bulk operation either.
+
+    Clients use a scheduler if :attr:`OralBClient.scheduler` is set; the
+    priority of their operations is taken from :func:`gatt_priority`.
+
+    :param concurrency: number of operations running at the same time
+    """
+
+    _adapters: Dict[Optional[str], "GattScheduler"] = {}
+
+    def __init__(self, adapter: Optional[str] = None, concurrency: int = 1) -> None:
+        self.adapter = adapter
+        self.concurrency = concurrency
+        self.running = 0
+        self.queues: List[OrderedDict[str, Deque[_Ticket]]] = [
+            collections.OrderedDict() for _ in Priority
+        ]
+        self.stats: Dict[Priority, QueueStats] = {p: QueueStats() for p in Priority}
+
+    @classmethod
+    def for_adapter(cls, adapter: Optional[str] = None) -> "GattScheduler":
+        """Returns the shared scheduler of an adapter (``None`` is the
+        default adapter)."""
+        scheduler = cls._adapters.get(adapter)
+        if scheduler is None:
+            scheduler = cls._adapters[adapter] = cls(adapter)
+        return scheduler
+
+    @property
+    def depth(self) -> int:
+        """Number of queued operations."""
+        return sum(stats.depth for stats in self.stats.values())
+
+    async def run(
+        self,
+        address: str,
+        awaitable,
+        priority: Optional[Priority] = None,
+        metrics: Optional[MetricsSink] = None,
+    ):
+        """Waits for a slot and awaits the operation.
+
+        :param priority: defaults to the priority of the current context
+        :param metrics: receives the queue time as ``"queue"`` operation
+        """
+        priority = current_priority() if priority is None else priority
+        ticket = _Ticket(address, priority)
+        if self._can_start(priority) and not self._waiting(priority):
+            self._start(ticket)
+        else:
+            self._enqueue(ticket)
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.cancelled():
+                self._discard(ticket)
+            else:
+                # the slot was granted concurrently
+                self._release()
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+
+        if metrics is not None:
+            wait = time.perf_counter() - ticket.queued
+            metrics.observe("queue", address, priority.name.lower(), wait)
+        try:
+            return await awaitable
+        finally:
+            self._release()
+
+    def _can_start(self, priority: Priority) -> bool:
+        limit = self.concurrency + (priority == Priority.KEEP_ALIVE)
+        return self.running < limit
+
+    def _waiting(self, priority: Priority) -> bool:
+        # operations of the same or a higher priority are queued
+        return any(self.queues[index] for index in range(priority + 1))
+
+    def _enqueue(self, ticket: _Ticket) -> None:
+        queue = self.queues[ticket.priority]
+        queue.setdefault(ticket.address, collections.deque()).append(ticket)
+        stats = self.stats[ticket.priority]
+        stats.depth += 1
+        stats.max_depth = max(stats.max_depth, stats.depth)
+
+    def _discard(self, ticket: _Ticket) -> None:
+        queue = self.queues[ticket.priority]
+        tickets = queue.get(ticket.address)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self.stats[ticket.priority].depth -= 1
+            if not tickets:
+                del queue[ticket.address]
+
+    def _start(self, ticket: _Ticket) -> None:
+        self.running += 1
+        stats = self.stats[ticket.priority]
+        wait = time.perf_counter() - ticket.queued
+        stats.started += 1
+        stats.wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        ticket.future.set_result(None)
+
+    def _release(self) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            queue = self.queues[priority]
+            while queue and self._can_start(priority):
+                # the device at the front takes one turn and moves to the end
+                address, tickets = next(iter(queue.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    queue.move_to_end(address)
+                else:
+                    del queue[address]
+                self.stats[priority].depth -= 1
+                if not ticket.future.cancelled():
+                    self._start(ticket)
+            if queue:
+                # strict priorities: nothing below a waiting class starts
+                return
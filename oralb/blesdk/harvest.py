@@ -0,0 +1,215 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import dataclasses
+
+from typing import Any, Dict, Optional, Tuple
+
+from caterpillar.shortcuts import unpack
+from caterpillar.exception import StructException
+
+from .model import Control
+from .metadata import (
+    metadata_models,
+    data_models,
+    SonosMetadata,
+    SystemController1,
+    SystemController2,
+    BLEProfile,
+    ServiceDataA,
+    ServiceDataB,
+)
+
+#: Items are identified by their kind ("meta" or "data") and the
+#: request parameter.
+ItemKey = Tuple[str, int]
+
+META = "meta"
+DATA = "data"
+
+#: Service data contains counters that change with every use of the
+#: brush. Everything else is fixed for a given firmware.
+MUTABLE_ITEMS = frozenset(
+    [
+        (DATA, Control.DataRead.SERVICE_DATA_A),
+        (DATA, Control.DataRead.SERVICE_DATA_B),
+    ]
+)
+
+
+def all_items() -> list:
+    """Returns the keys of all known metadata and data items."""
+    items = [(META, value) for value in Control.METADATA]
+    items.extend((DATA, value) for value in Control.DataRead)
+    return items
+
+
+def make_request(key: ItemKey) -> Control:
+    kind, value = key
+    if kind == META:
+        return Control.read_metadata(value)
+    return Control.read_data(value)
+
+
+def decode_item(key: ItemKey, data: bytes) -> Any:
+    """Decodes a raw response using the registered models.
+
+    Returns the raw data if no model is configured for the given item.
+    """
+    kind, value = key
+    models = metadata_models() if kind == META else data_models()
+    model = models.get(value, None)
+    if model is None:
+        return bytes(data)
+    return unpack(model, data)
+
+
+class HarvestCache:
+    """In-memory cache of immutable responses per device ID.
+
+    Only raw responses are stored, so entries can be decoded again with
+    updated models.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[int, Dict[ItemKey, bytes]] = {}
+
+    def __contains__(self, device_id: int) -> bool:
+        return device_id in self._entries
+
+    def get(self, device_id: int) -> Dict[ItemKey, bytes]:
+        return dict(self._entries.get(device_id, {}))
+
+    def put(self, device_id: int, key: ItemKey, data: bytes) -> None:
+        if key in MUTABLE_ITEMS:
+            return
+        self._entries.setdefault(device_id, {})[key] = bytes(data)
+
+    def invalidate(self, device_id: Optional[int] = None) -> None:
+        if device_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(device_id, None)
+
+
+@dataclasses.dataclass
+class DeviceReport:
+    """Result of a metadata and service-data harvest."""
+
+    #: the value of ``BrushID`` (if available)
+    device_id: Optional[int] = None
+
+    #: raw responses of all items that were read successfully
+    raw: Dict[ItemKey, bytes] = dataclasses.field(default_factory=dict)
+
+    #: decoded values (raw bytes if no model is configured)
+    values: Dict[ItemKey, Any] = dataclasses.field(default_factory=dict)
+
+    #: errors per item that could not be read or decoded
+    errors: Dict[ItemKey, str] = dataclasses.field(default_factory=dict)
+
+    #: items that were taken from the cache
+    cached: set = dataclasses.field(default_factory=set)
+
+    def get(self, kind: str, value: int, default=None) -> Any:
+        return self.values.get((kind, value), default)
+
+    @property
+    def sonos(self) -> Optional[SonosMetadata]:
+        return self.get(META, Control.METADATA.SONOS_TYPE)
+
+    @property
+    def system_controller_1(self) -> Optional[SystemController1]:
+        return self.get(META, Control.METADATA.SW_VER_SYSTEM_CONTROLLER_1)
+
+    @property
+    def system_controller_2(self) -> Optional[SystemController2]:
+        return self.get(META, Control.METADATA.SW_VER_SYSTEM_CONTROLLER_2)
+
+    @property
+    def ble_profile(self) -> Optional[BLEProfile]:
+        return self.get(META, Control.METADATA.BLE_PROFILE)
+
+    @property
+    def service_data_a(self) -> Optional[ServiceDataA]:
+        return self.get(DATA, Control.DataRead.SERVICE_DATA_A)
+
+    @property
+    def service_data_b(self) -> Optional[ServiceDataB]:
+        return self.get(DATA, Control.DataRead.SERVICE_DATA_B)
+
+    @property
+    def build_date(self) -> Optional[str]:
+        return self.get(DATA, Control.DataRead.DATE_OF_BUILD)
+
+    @property
+    def build_time(self) -> Optional[str]:
+        return self.get(DATA, Control.DataRead.TIME_OF_BUILD)
+
+    @property
+    def main_version(self) -> Optional[str]:
+        return self.get(DATA, Control.DataRead.SOFTWARE_VERSION_MAIN_CONTROLLER)
+
+    @property
+    def secondary_version(self) -> Optional[str]:
+        return self.get(DATA, Control.DataRead.SOFTWARE_VERSION_SECONDARY_CONTROLLER)
+
+    def add(self, key: ItemKey, data: bytes) -> None:
+        self.raw[key] = data
+        try:
+            self.values[key] = decode_item(key, data)
+        except StructException as err:
+            self.errors[key] = f"Invalid data {data!r}: {err}"
+
+
+async def harvest(
+    client,
+    cache: Optional[HarvestCache] = None,
+    device_id: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> DeviceReport:
+    """Reads all known metadata and data items in one pass.
+
+    All requests are queued on the client's control channel at once.
+    Immutable items found in *cache* are not requested again.
+
+    :param client: a connected :class:`~oralb.blesdk.client.OralBClient`
+    :param cache: optional cache for immutable items
+    :param device_id: the ``BrushID``, read from the device if omitted and
+        a cache is used
+    :param timeout: timeout per request
+    """
+    if device_id is None and cache is not None:
+        device_id = (await client.brush_id).id
+
+    report = DeviceReport(device_id)
+    known = cache.get(device_id) if cache is not None else {}
+    for key, data in known.items():
+        report.add(key, data)
+        report.cached.add(key)
+
+    keys = [key for key in all_items() if key not in known]
+    responses = await client.control.request_many(
+        map(make_request, keys), timeout=timeout, return_exceptions=True
+    )
+    for key, response in zip(keys, responses):
+        if isinstance(response, BaseException):
+            report.errors[key] = f"{type(response).__name__}: {response}"
+            continue
+
+        report.add(key, response)
+        if cache is not None and key not in report.errors:
+            cache.put(device_id, key, response)
+
+    return report
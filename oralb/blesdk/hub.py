@@ -0,0 +1,252 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import time
+import asyncio
+
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from caterpillar.exception import StructException
+
+from .model import __characteristics__
+
+# marks the end of a subscription in its queue
+_CLOSED = object()
+
+
+class DropPolicy(enum.Enum):
+    """What happens if a subscriber's queue is full."""
+
+    #: discard the oldest queued notification (keeps the latest values)
+    DROP_OLDEST = "oldest"
+
+    #: discard the new notification
+    DROP_NEWEST = "newest"
+
+
+class Notification(NamedTuple):
+    characteristic: str
+    #: the decoded value, or the raw data if it could not be decoded
+    value: object
+    data: bytes
+    #: time of reception (time.time)
+    timestamp: float
+
+
+class Subscription:
+    """A single consumer of a characteristic.
+
+    Notifications are buffered in a bounded queue; iterate over the
+    subscription or call :meth:`get` to receive them. Iteration ends once
+    the subscription was closed.
+    """
+
+    def __init__(
+        self, hub: "NotificationHub", char: str, maxsize: int, policy: DropPolicy
+    ) -> None:
+        self.hub = hub
+        self.characteristic = char
+        self.policy = policy
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+        #: number of notifications lost due to a full queue
+        self.dropped = 0
+
+    async def __aenter__(self) -> "Subscription":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Notification:
+        item = await self.get()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+    def _offer(self, item) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy is DropPolicy.DROP_NEWEST and item is not _CLOSED:
+                self.dropped += 1
+                return
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+            self.dropped += 1
+
+    async def get(self) -> Optional[Notification]:
+        """Waits for the next notification, returns ``None`` once closed."""
+        item = await self.queue.get()
+        if item is _CLOSED:
+            # wake up other readers as well
+            self.queue.put_nowait(_CLOSED)
+            return None
+        return item
+
+    async def close(self) -> None:
+        await self.hub.unsubscribe(self)
+
+
+class _Topic:
+    __slots__ = ("decode", "subscribers", "listeners")
+
+    def __init__(self, decode) -> None:
+        self.decode = decode
+        self.subscribers: List[Subscription] = []
+        #: callbacks that receive the raw data without a queue
+        self.listeners: List[Callable[[str, bytes], None]] = []
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.subscribers and not self.listeners
+
+
+class NotificationHub:
+    """Shares the notifications of one client between many consumers.
+
+    bleak accepts a single callback per characteristic. The hub subscribes
+    once per characteristic, decodes every notification once and hands it
+    to all subscribers without awaiting them: each subscriber has its own
+    bounded queue, so a slow consumer only loses its own notifications.
+    All consumers of the client must go through the hub, a direct
+    subscription would replace the hub's callback.
+    """
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.topics: Dict[str, _Topic] = {}
+        self._lock = asyncio.Lock()
+
+    def _decoder(self, char):
+        if hasattr(char, "decode"):
+            # an OralBProperty
+            return char.name, char.decode
+
+        model = __characteristics__.get(char)
+        if model is None:
+            return char, None
+        return char, getattr(self.client, model.__cname__).decode
+
+    async def subscribe(
+        self,
+        char,
+        maxsize: int = 64,
+        policy: DropPolicy = DropPolicy.DROP_OLDEST,
+    ) -> Subscription:
+        """Adds a subscriber to the given characteristic.
+
+        :param char: UUID or property of the characteristic; values of
+            unknown characteristics are delivered as raw bytes
+        :param maxsize: queue capacity of this subscriber (0 is unbounded)
+        :param policy: the drop policy if the queue is full
+        """
+        uuid, decode = self._decoder(char)
+        async with self._lock:
+            topic = await self._topic(uuid, decode)
+            subscription = Subscription(self, uuid, maxsize, policy)
+            topic.subscribers.append(subscription)
+        return subscription
+
+    async def add_listener(self, char: str, callback: Callable[[str, bytes], None]):
+        """Calls *callback* with the UUID and raw data of every notification.
+
+        Listeners are called directly from the notification callback, so
+        they must not block. Used by internal consumers that correlate
+        notifications themselves (e.g. the :class:`ControlChannel`).
+        """
+        async with self._lock:
+            topic = await self._topic(char, None)
+            if callback not in topic.listeners:
+                topic.listeners.append(callback)
+
+    async def remove_listener(self, char: str, callback) -> None:
+        async with self._lock:
+            topic = self.topics.get(char)
+            if topic is None or callback not in topic.listeners:
+                return
+
+            topic.listeners.remove(callback)
+            await self._release(char, topic)
+
+    async def _topic(self, uuid: str, decode) -> _Topic:
+        topic = self.topics.get(uuid)
+        if topic is None:
+            topic = _Topic(decode)
+
+            def on_notify(_, data: bytearray) -> None:
+                self._dispatch(uuid, topic, bytes(data))
+
+            await self.client.subscribe(uuid, on_notify)
+            self.topics[uuid] = topic
+        elif topic.decode is None:
+            topic.decode = decode
+        return topic
+
+    async def _release(self, uuid: str, topic: _Topic) -> None:
+        if topic.is_empty:
+            del self.topics[uuid]
+            # the client forgets the subscription even if it is not
+            # connected, so it won't be restored on the next connect
+            await self.client.stop_notify(uuid)
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        """Removes a subscriber, the last one stops the notifications."""
+        if subscription.closed:
+            return
+
+        subscription.closed = True
+        subscription._offer(_CLOSED)
+        async with self._lock:
+            uuid = subscription.characteristic
+            topic = self.topics.get(uuid)
+            if topic is None or subscription not in topic.subscribers:
+                return
+
+            topic.subscribers.remove(subscription)
+            await self._release(uuid, topic)
+
+    def subscribers(self, char: str) -> int:
+        topic = self.topics.get(char)
+        return len(topic.subscribers) if topic is not None else 0
+
+    def reset(self) -> None:
+        """Closes all subscriptions without touching the device."""
+        for topic in self.topics.values():
+            for subscription in topic.subscribers:
+                subscription.closed = True
+                subscription._offer(_CLOSED)
+        self.topics.clear()
+
+    def _dispatch(self, uuid: str, topic: _Topic, data: bytes) -> None:
+        for listener in topic.listeners:
+            listener(uuid, data)
+        if not topic.subscribers:
+            return
+
+        value = data
+        if topic.decode is not None:
+            try:
+                value = topic.decode(data)
+            except StructException:
+                pass
+
+        notification = Notification(uuid, value, data, time.time())
+        for subscription in topic.subscribers:
+            subscription._offer(notification)
@@ -0,0 +1,293 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import struct
+import functools
+
+from typing import Dict, Iterator, Optional, Tuple
+
+from caterpillar.abc import getstruct, hasstruct
+from caterpillar.shortcuts import unpack
+from caterpillar.exception import StructException
+
+#: NumPy type codes of all supported format characters
+NUMPY_TYPES = {
+    "b": "i1",
+    "B": "u1",
+    "h": "i2",
+    "H": "u2",
+    "i": "i4",
+    "I": "u4",
+    "l": "i4",
+    "L": "u4",
+    "q": "i8",
+    "Q": "u8",
+    "e": "f2",
+    "f": "f4",
+    "d": "f8",
+    "?": "b1",
+}
+
+#: Arrow type names of all supported format characters
+ARROW_TYPES = {
+    "b": "int8",
+    "B": "uint8",
+    "h": "int16",
+    "H": "uint16",
+    "i": "int32",
+    "I": "uint32",
+    "l": "int32",
+    "L": "uint32",
+    "q": "int64",
+    "Q": "uint64",
+    "e": "float16",
+    "f": "float32",
+    "d": "float64",
+    "?": "bool_",
+}
+
+
+def _to_enum(model: type, value: int):
+    try:
+        return model(value)
+    except ValueError:
+        # same behaviour as caterpillar: unknown values stay integers
+        return value
+
+
+def _members(model: type) -> Dict[str, object]:
+    sequence = getstruct(model)
+    # caterpillar does not expose the member map publicly, its name
+    # differs between releases
+    for attr in ("_member_map_", "_members"):
+        members = getattr(sequence, attr, None)
+        if isinstance(members, dict):
+            return members
+    return dict(model.__annotations__)
+
+
+def _format_char(field, name: str) -> Tuple[str, Optional[type], Optional[int]]:
+    for attr in ("amount", "condition", "options"):
+        if getattr(field, attr, None) not in (None, True):
+            raise TypeError(f"Field {name!r} is not a fixed-layout field")
+
+    offset = getattr(field, "offset", None)
+    if offset in (None, -1):
+        offset = None
+    elif not isinstance(offset, int):
+        raise TypeError(f"Field {name!r} has a dynamic offset")
+
+    # unwrap fields and transformers, e.g. Field(Enum(Status, uint8))
+    enum_type = None
+    while field is not None:
+        if isinstance(field, type) and issubclass(field, enum.Enum):
+            enum_type, field = field, getattr(field, "__struct__", None)
+            continue
+        model = getattr(field, "model", None)
+        if isinstance(model, type) and issubclass(model, enum.Enum):
+            enum_type = model
+        if hasattr(field, "__fmt__"):
+            break
+        field = getattr(field, "struct", None)
+
+    fmt = field.__fmt__() if field is not None else None
+    if not isinstance(fmt, str) or fmt not in NUMPY_TYPES:
+        raise TypeError(f"Field {name!r} has no fixed-size format")
+    return fmt, enum_type, offset
+
+
+def arrow_field_types(model: type) -> Dict[str, Optional[str]]:
+    """Arrow type names of all fields of a (possibly non-fixed) model.
+
+    Fields without a fixed format (strings, sequences or protocol
+    dependent fields) map to ``None``.
+    """
+    types = {}
+    for name, field in _members(model).items():
+        try:
+            code, _, _ = _format_char(field, name)
+        except TypeError:
+            types[name] = None
+        else:
+            types[name] = ARROW_TYPES[code]
+    return types
+
+
+class Layout:
+    """Fixed binary layout of a struct model.
+
+    The layout mirrors the model field by field and provides fast decoders
+    that bypass the generic parser: a precompiled :class:`struct.Struct`
+    for single records and a NumPy dtype for bulk decoding.
+
+    Fields with a constant offset (``field @ offset``) are not part of the
+    record itself. caterpillar reads them from that absolute position in
+    the input and returns afterwards, so they are shared by all records
+    in one buffer. They are listed in :attr:`absolute` and excluded from
+    :attr:`struct` and :attr:`dtype`.
+    """
+
+    def __init__(self, model: type) -> None:
+        self.model = model
+
+        #: all field names in order
+        self.names: Tuple[str, ...] = ()
+
+        #: format characters of all fields
+        self.codes: Tuple[str, ...] = ()
+
+        #: enum types of fields that are converted by the full decoder
+        self.enums: Dict[str, type] = {}
+
+        #: fields at an absolute position as name -> (offset, struct)
+        self.absolute: Dict[str, Tuple[int, struct.Struct]] = {}
+
+        byteorder = getattr(getstruct(model), "order", None)
+        self.byteorder: str = getattr(byteorder, "ch", "=")
+
+        names, codes, self._all = [], [], []
+        for name, field in _members(model).items():
+            code, enum_type, offset = _format_char(field, name)
+            self._all.append((name, code))
+            if offset is not None:
+                self.absolute[name] = (offset, struct.Struct(self.byteorder + code))
+            else:
+                names.append(name)
+                codes.append(code)
+            if enum_type is not None:
+                self.enums[name] = enum_type
+
+        self.names, self.codes = tuple(names), tuple(codes)
+
+        #: the precompiled struct (standard sizes, no padding)
+        self.struct = struct.Struct(self.byteorder + "".join(codes))
+
+    def __repr__(self) -> str:
+        return f"<Layout of {self.model.__name__} {self.format!r}>"
+
+    @property
+    def format(self) -> str:
+        return self.struct.format
+
+    @property
+    def size(self) -> int:
+        return self.struct.size
+
+    @functools.cached_property
+    def dtype(self):
+        """NumPy structured dtype with the same layout.
+
+        NumPy is an optional dependency (``pip install oralb-io[analysis]``).
+        """
+        try:
+            import numpy as np
+        except ImportError as err:
+            raise ImportError("NumPy is required to build a dtype") from err
+
+        order = "=" if self.byteorder in ("@", "=") else self.byteorder
+        if order == "!":
+            order = ">"
+        dtype = np.dtype(
+            [
+                (name, order + NUMPY_TYPES[code])
+                for name, code in zip(self.names, self.codes)
+            ]
+        )
+        assert dtype.itemsize == self.size
+        return dtype
+
+    @property
+    def arrow_types(self) -> Tuple[Tuple[str, str], ...]:
+        """Names and Arrow type names of all fields (including absolute ones)."""
+        return tuple((name, ARROW_TYPES[code]) for name, code in self._all)
+
+    def unpack(self, data: bytes, offset: int = 0) -> tuple:
+        """Decodes one record into a plain tuple (enums stay integers)."""
+        return self.struct.unpack_from(data, offset)
+
+    def iter_unpack(self, data: bytes) -> Iterator[tuple]:
+        """Decodes consecutive records (*data* must be a multiple of the size)."""
+        return self.struct.iter_unpack(data)
+
+    def decode(self, data: bytes, offset: int = 0, factory=None):
+        """Decodes one record into an instance of the model.
+
+        Absolute fields are read from *data* regardless of *offset*.
+
+        :param factory: called with all fields as keyword arguments instead
+            of the model
+        """
+        values = dict(zip(self.names, self.struct.unpack_from(data, offset)))
+        for name, (position, field) in self.absolute.items():
+            values[name] = field.unpack_from(data, position)[0]
+        for name, enum_type in self.enums.items():
+            values[name] = _to_enum(enum_type, values[name])
+        return (factory or self.model)(**values)
+
+    def encode(self, obj) -> bytes:
+        """Encodes the record fields of an object (without absolute fields)."""
+        return self.struct.pack(*(int(getattr(obj, name)) for name in self.names))
+
+    def frombuffer(self, data, count: int = -1, offset: int = 0):
+        """Decodes many records at once into a NumPy structured array."""
+        import numpy as np
+
+        return np.frombuffer(data, dtype=self.dtype, count=count, offset=offset)
+
+
+def _verify(layout: Layout) -> None:
+    # The layout is read from caterpillar internals (__fmt__ and the member
+    # map), which change between releases. A sample record must decode
+    # exactly like the generic parser, otherwise callers use the parser.
+    end = layout.size
+    for offset, field in layout.absolute.values():
+        end = max(end, offset + field.size)
+    data = bytes(index % 251 + 1 for index in range(end))
+    try:
+        expected = unpack(layout.model, data)
+    except (StructException, ValueError) as err:
+        raise TypeError(f"Can't verify the layout of {layout.model!r}") from err
+    if layout.decode(data) != expected:
+        raise TypeError(f"The layout of {layout.model!r} differs from the parser")
+
+
+@functools.cache
+def compile_layout(model: type) -> Layout:
+    """Compiles (and caches) the fixed layout of a struct model.
+
+    The compiled layout is checked against caterpillar's parser once.
+
+    :raises TypeError: if the model contains fields without fixed size or
+        position, e.g. strings, sequences, conditional or protocol dependent
+        fields, or if the layout can't be derived with the installed
+        caterpillar release
+    """
+    if not hasstruct(model):
+        raise TypeError(f"{model!r} is not a struct model")
+    try:
+        layout = Layout(model)
+    except (AttributeError, KeyError) as err:
+        raise TypeError(f"Can't compile the layout of {model!r}: {err}") from err
+    _verify(layout)
+    return layout
+
+
+def is_fixed(model: type) -> bool:
+    """Returns whether a fixed layout can be compiled for the given model."""
+    try:
+        compile_layout(model)
+    except TypeError:
+        return False
+    return True
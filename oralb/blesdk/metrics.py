@@ -0,0 +1,198 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import bisect
+import math
+import time
+
+from typing import Dict, Optional, Tuple, List
+
+#: upper bounds (in seconds) of all histogram buckets
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    math.inf,
+)
+
+#: metrics are grouped by operation, device address and target (the
+#: characteristic UUID or model name)
+MetricKey = Tuple[str, str, str]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram."""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket containing the quantile."""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class MetricsSink:
+    """Receives measurements from :class:`~oralb.blesdk.client.OralBClient`.
+
+    Subclasses may forward measurements to other systems. The default
+    implementation ignores everything.
+    """
+
+    def observe(self, op: str, device: str, target: str, seconds: float) -> None:
+        pass
+
+    def count(self, op: str, device: str, target: str) -> None:
+        pass
+
+
+class MultiSink(MetricsSink):
+    """Forwards all measurements to several sinks."""
+
+    def __init__(self, *sinks: MetricsSink) -> None:
+        self.sinks = list(sinks)
+
+    def observe(self, op: str, device: str, target: str, seconds: float) -> None:
+        for sink in self.sinks:
+            sink.observe(op, device, target, seconds)
+
+    def count(self, op: str, device: str, target: str) -> None:
+        for sink in self.sinks:
+            sink.count(op, device, target)
+
+
+class StatsSink(MetricsSink):
+    """In-process statistics: latency histograms and event counters."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self.counters: Dict[MetricKey, int] = {}
+        # first and last occurrence of counted events
+        self._seen: Dict[MetricKey, Tuple[float, float]] = {}
+
+    def observe(self, op: str, device: str, target: str, seconds: float) -> None:
+        key = (op, str(device), target)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def count(self, op: str, device: str, target: str) -> None:
+        key = (op, str(device), target)
+        self.counters[key] = self.counters.get(key, 0) + 1
+        now = time.monotonic()
+        first, _ = self._seen.get(key, (now, now))
+        self._seen[key] = (first, now)
+
+    def rate(self, key: MetricKey) -> Optional[float]:
+        """Returns events per second for a counter (if enough data)."""
+        first, last = self._seen.get(key, (0.0, 0.0))
+        if last <= first:
+            return None
+        # the first event only marks the start of the interval
+        return (self.counters[key] - 1) / (last - first)
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+        self._seen.clear()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: MetricKey, **extra) -> str:
+    op, device, target = key
+    values = {"op": op, "device": device, "target": target, **extra}
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in values.items())
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+def to_prometheus(stats: StatsSink, prefix: str = "oralb") -> str:
+    """Renders the given statistics in the Prometheus text format."""
+    lines: List[str] = []
+    if stats.histograms:
+        name = f"{prefix}_operation_seconds"
+        lines.append(f"# HELP {name} Latency of BLE operations and decode steps.")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(stats.histograms.items()):
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                labels = _labels(key, le=_format_bound(bound))
+                lines.append(f"{name}_bucket{{{labels}}} {total}")
+            lines.append(f"{name}_sum{{{_labels(key)}}} {histogram.sum!r}")
+            lines.append(f"{name}_count{{{_labels(key)}}} {histogram.count}")
+
+    if stats.counters:
+        name = f"{prefix}_events_total"
+        lines.append(f"# HELP {name} Number of received events (e.g. notifications).")
+        lines.append(f"# TYPE {name} counter")
+        for key, count in sorted(stats.counters.items()):
+            lines.append(f"{name}{{{_labels(key)}}} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(stats: StatsSink, path: str, prefix: str = "oralb") -> None:
+    """Writes the statistics to a file (e.g. for node_exporter's textfile
+    collector)."""
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(to_prometheus(stats, prefix))
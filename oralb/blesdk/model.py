@@ -18,6 +18,8 @@ from caterpillar.shortcuts import *
 from caterpillar.fields import *
 from caterpillar.exception import *
 
+from .sensor import sensor_codec, MODEL
+
 BASE_UUID = "A0F0XXXX-5047-4D53-8208-4F72616C2D42"
 
 # struct configuration
@@ -404,49 +406,18 @@ class SensorData(Transformer):
     def __init__(self) -> None:
         super().__init__(Bytes(...))
 
-    def decode(self, parsed: bytes, context) -> None:
-        if len(parsed) != 20:
-            # The parsed data must be 20 bytes
-            raise ValidationError(
-                f"Expected motion data of length 20 - got {len(parsed)}", context
-            )
-
-        if parsed[-1] != SensorData.Data.SPECIAL:
-            # Default motion data (takes up all the space)
-            return unpack(MotionData[4], parsed)
-
-        match parsed[-2]:
-            case SensorData.Data.COMINO:
-                return unpack(GyroMotionData[2], parsed)
-            case SensorData.Data.HIGH_RESOLUTION:
-                return unpack(F(HighResolutionMotionData), parsed)
-            case SensorData.Data.CALIBRATION:
-                return unpack(CalibrationData[3], parsed)
-            case SensorData.Data.DASHBOARD:
-                return unpack(DashboardData[2], parsed)
-            case _:
-                raise ValidationError(f"Unexpected data: {parsed[-2]:x}", context)
+    def decode(self, parsed: bytes, context):
+        # see oralb.blesdk.sensor for the frame layouts
+        try:
+            return sensor_codec(MODEL).decode(parsed).records
+        except ValueError as err:
+            raise ValidationError(str(err), context) from err
 
     def encode(self, obj, context) -> bytes:
-        data: bytes = pack(obj)
-        if len(data) < 20:
-            if len(data) < 18:
-                data += bytes(18 - len(data))
-
-            data_ty = None
-            match obj:
-                case HighResolutionMotionData():
-                    data_ty = SensorData.Data.HIGH_RESOLUTION
-                case GyroMotionData():
-                    data_ty = SensorData.Data.COMINO
-                case CalibrationData():
-                    data_ty = SensorData.Data.CALIBRATION
-                case DashboardData():
-                    data_ty = SensorData.Data.DASHBOARD
-                case _:
-                    raise ValidationError(f"Invalid data type: {type(obj)}", context)
-            data += bytes([data_ty, SensorData.Data.SPECIAL])
-        return data
+        try:
+            return sensor_codec(MODEL).encode(obj)
+        except ValueError as err:
+            raise ValidationError(str(err), context) from err
 
 
 def _cmd_condition(context) -> bool:
@@ -0,0 +1,222 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import time
+import heapq
+import random
+import asyncio
+import itertools
+
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from bleak import exc
+from caterpillar.exception import StructException
+
+from .gatt import Priority, gatt_priority
+
+_MISSING = object()
+
+
+class Change(NamedTuple):
+    """A polled value that differs from the previous read."""
+
+    address: str
+    #: UUID of the characteristic
+    characteristic: str
+    value: object
+    #: the previous value, ``None`` for the first read
+    previous: object
+    #: time of the read (time.time)
+    timestamp: float
+
+
+class _Entry:
+    __slots__ = ("prop", "interval", "due", "value", "errors", "active")
+
+    def __init__(self, prop, interval: float, due: float) -> None:
+        self.prop = prop
+        self.interval = interval
+        self.due = due
+        self.value = _MISSING
+        self.errors = 0
+        self.active = True
+
+
+class Poller:
+    """Reads characteristics of many devices periodically.
+
+    Every characteristic is read at its own interval. Entries that fall
+    due within *coalesce* seconds of each other are read in one batch:
+    the reads of one device are issued together, all devices of a batch
+    concurrently. Each interval is varied by up to *jitter* (a fraction
+    of the interval), so entries that were added at the same time drift
+    apart instead of hitting the adapter in bursts.
+
+    Iterating over :meth:`changes` runs the poller and yields a
+    :class:`Change` for every value that differs from its previous read.
+    Reads go through :meth:`OralBClient.read` and update the cached value
+    of the property, so other users of the client see the latest value.
+    Failed reads (e.g. while a device reconnects) are retried at the next
+    due time.
+
+    :param coalesce: window (in seconds) of reads that are batched
+    :param jitter: maximum relative variation of the intervals
+    """
+
+    def __init__(self, coalesce: float = 0.25, jitter: float = 0.1) -> None:
+        self.coalesce = coalesce
+        self.jitter = jitter
+        self.entries: Dict[Tuple[object, str], _Entry] = {}
+        self._heap: List[Tuple[float, int, _Entry]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, prop, interval: float, delay: float = 0.0) -> None:
+        """Polls a property (e.g. ``client.battery_level``).
+
+        Adding a property twice keeps the shorter interval.
+
+        :param delay: time until the first read
+        """
+        key = (prop.obclient, prop.name)
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.interval = min(entry.interval, interval)
+            return
+
+        entry = self.entries[key] = _Entry(prop, interval, time.monotonic() + delay)
+        self._push(entry)
+        self._wakeup.set()
+
+    def remove(self, prop) -> None:
+        entry = self.entries.pop((prop.obclient, prop.name), None)
+        if entry is not None:
+            # removed lazily from the heap
+            entry.active = False
+
+    def remove_client(self, client) -> None:
+        """Stops polling all characteristics of a client."""
+        for key in [key for key in self.entries if key[0] is client]:
+            self.entries.pop(key).active = False
+
+    def close(self) -> None:
+        """Ends all iterations over :meth:`changes`."""
+        self.closed = True
+        self._wakeup.set()
+
+    def _push(self, entry: _Entry) -> None:
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry))
+
+    def _next_due(self, entry: _Entry, now: float) -> float:
+        variation = random.uniform(-self.jitter, self.jitter) if self.jitter else 0
+        return max(now, entry.due + entry.interval * (1.0 + variation))
+
+    def _pop_batch(self, now: float) -> List[_Entry]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now + self.coalesce:
+            _, _, entry = heapq.heappop(self._heap)
+            if entry.active:
+                batch.append(entry)
+        return batch
+
+    async def _wait(self) -> None:
+        while not self.closed:
+            while self._heap and not self._heap[0][2].active:
+                heapq.heappop(self._heap)
+
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - time.monotonic()
+                if timeout <= 0:
+                    return
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def _read(self, entries: List[_Entry]) -> List[object]:
+        # all due characteristics of one device
+        client = entries[0].prop.obclient
+        if not client.is_connected:
+            return [_MISSING] * len(entries)
+
+        with gatt_priority(Priority.POLLING):
+            results = await asyncio.gather(
+                *(client.read(entry.prop.name) for entry in entries),
+                return_exceptions=True,
+            )
+        values = []
+        for entry, data in zip(entries, results):
+            if isinstance(data, (exc.BleakError, TimeoutError, OSError)):
+                entry.errors += 1
+                values.append(_MISSING)
+                continue
+            if isinstance(data, BaseException):
+                raise data
+            try:
+                value = entry.prop.decode(bytes(data))
+            except StructException:
+                value = bytes(data)
+            entry.prop._value = value
+            values.append(value)
+        return values
+
+    async def changes(self) -> AsyncIterator[Change]:
+        """Polls until :meth:`close` is called and yields all changes."""
+        while not self.closed:
+            await self._wait()
+            if self.closed:
+                break
+
+            now = time.monotonic()
+            batch = self._pop_batch(now)
+            devices: Dict[object, List[_Entry]] = {}
+            for entry in batch:
+                devices.setdefault(entry.prop.obclient, []).append(entry)
+                entry.due = self._next_due(entry, now)
+                self._push(entry)
+
+            groups = list(devices.values())
+            results = await asyncio.gather(*map(self._read, groups))
+            timestamp = time.time()
+            for entries, values in zip(groups, results):
+                for entry, value in zip(entries, values):
+                    if value is _MISSING or value == entry.value:
+                        continue
+                    previous = None if entry.value is _MISSING else entry.value
+                    entry.value = value
+                    if entry.active:
+                        yield Change(
+                            entry.prop.obclient.address,
+                            entry.prop.name,
+                            value,
+                            previous,
+                            timestamp,
+                        )
+
+    def __aiter__(self) -> AsyncIterator[Change]:
+        return self.changes()
+
+    def last(self, prop) -> Optional[object]:
+        """Returns the last polled value of a property."""
+        entry = self.entries.get((prop.obclient, prop.name))
+        if entry is None or entry.value is _MISSING:
+            return None
+        return entry.value
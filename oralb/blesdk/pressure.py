@@ -0,0 +1,253 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import collections
+import math
+
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from .model import Pressure
+
+_HIGH_PRESSURE = int(Pressure.State.HIGH_PRESSURE)
+
+
+class Aggregate(NamedTuple):
+    """Aggregated pressure samples of a single window."""
+
+    #: first timestamp of the window (unwrapped, in device ticks)
+    start: int
+    count: int
+    min: int
+    max: int
+    sum: int
+    #: number of high pressure events that started in this window
+    high_events: int
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def merge(self, other: "Aggregate") -> "Aggregate":
+        return Aggregate(
+            min(self.start, other.start),
+            self.count + other.count,
+            min(self.min, other.min),
+            max(self.max, other.max),
+            self.sum + other.sum,
+            self.high_events + other.high_events,
+        )
+
+
+class _Window:
+    __slots__ = ("start", "count", "min", "max", "sum", "high_events")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0
+        self.high_events = 0
+
+    def add(self, value: int, high_event: bool) -> None:
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if high_event:
+            self.high_events += 1
+
+    def merge(self, aggregate: Aggregate) -> None:
+        self.count += aggregate.count
+        self.sum += aggregate.sum
+        self.min = min(self.min, aggregate.min)
+        self.max = max(self.max, aggregate.max)
+        self.high_events += aggregate.high_events
+
+    def freeze(self) -> Aggregate:
+        return Aggregate(
+            self.start, self.count, self.min, self.max, self.sum, self.high_events
+        )
+
+
+class _Level:
+    __slots__ = ("resolution", "windows", "current")
+
+    def __init__(self, resolution: int, capacity: int) -> None:
+        self.resolution = resolution
+        self.windows = collections.deque(maxlen=capacity)
+        self.current: Optional[_Window] = None
+
+
+class PressureSeries:
+    """Multi-resolution time series of pressure samples of one brush.
+
+    Samples are aggregated into fixed windows (min/max/sum/count and high
+    pressure events) as they arrive. Completed windows of one level are
+    merged into the next, coarser level. Only a bounded number of
+    windows is kept per level, raw samples are never stored.
+
+    Timestamps are ``uint16`` device ticks and are unwrapped internally.
+    Samples that repeat the previous notification are counted as
+    duplicates. Any other backward jump means that the brush restarted its
+    counter (e.g. for a new session); the samples continue right after the
+    last one.
+
+    :param resolutions: window sizes in ticks, each one a multiple of the
+        previous one
+    :param capacity: number of completed windows kept per level
+    :param threshold: optional record value from which a sample counts
+        as high pressure (in addition to the reported pressure state)
+    """
+
+    def __init__(
+        self,
+        resolutions: Sequence[int] = (100, 1000, 10000),
+        capacity: int = 1024,
+        threshold: Optional[int] = None,
+    ) -> None:
+        for lower, upper in zip(resolutions, resolutions[1:]):
+            if upper % lower:
+                raise ValueError(f"Resolution {upper} is not a multiple of {lower}")
+
+        self.levels = [_Level(resolution, capacity) for resolution in resolutions]
+        self.threshold = threshold
+        self.total = _Window(0)
+        self.duplicates = 0
+        #: number of restarted tick counters
+        self.resets = 0
+
+        # raw timestamps of the last two samples (one notification)
+        self._recent = collections.deque(maxlen=2)
+        self._epoch = 0
+        self._last_raw: Optional[int] = None
+        self._last: Optional[int] = None
+        self._high = False
+
+    def add(self, pressure: Pressure) -> int:
+        """Adds both samples of a pressure notification.
+
+        :return: the number of new (not duplicated) samples
+        """
+        high = int(pressure.state) == _HIGH_PRESSURE
+        added = self.add_sample(pressure.timestamp_a, pressure.record_a, high)
+        added += self.add_sample(pressure.timestamp_b, pressure.record_b, high)
+        return added
+
+    def add_sample(self, timestamp: int, value: int, high: bool = False) -> bool:
+        """Adds a single sample, returns ``False`` for duplicates."""
+        if self._overlaps(timestamp):
+            self.duplicates += 1
+            return False
+        self._recent.append(timestamp)
+        timestamp = self._unwrap(timestamp)
+        self._last = timestamp
+
+        if self.threshold is not None and value >= self.threshold:
+            high = True
+        high_event = high and not self._high
+        self._high = high
+
+        if not self.total.count:
+            self.total.start = timestamp
+        self.total.add(value, high_event)
+        level = self.levels[0]
+        start = timestamp - timestamp % level.resolution
+        if level.current is None or level.current.start != start:
+            self._rollover(0, start)
+        level.current.add(value, high_event)
+        return True
+
+    def _overlaps(self, timestamp: int) -> bool:
+        # whether the sample lies within the previous notification
+        if not self._recent:
+            return False
+        first = self._recent[0]
+        span = (self._recent[-1] - first) & 0xFFFF
+        return (timestamp - first) & 0xFFFF <= span
+
+    def _unwrap(self, timestamp: int) -> int:
+        last = self._last_raw
+        if last is not None and timestamp < last:
+            if last - timestamp > 0x8000:
+                self._epoch += 0x10000
+            else:
+                # restarted counter, the new samples follow the last one
+                self.resets += 1
+                self._epoch = self._last + 1 - timestamp
+                self._high = False
+        self._last_raw = timestamp
+        return self._epoch + timestamp
+
+    def _rollover(self, index: int, start: int) -> None:
+        level = self.levels[index]
+        window = level.current
+        level.current = _Window(start)
+        if window is None or not window.count:
+            return
+
+        aggregate = window.freeze()
+        level.windows.append(aggregate)
+        if index + 1 < len(self.levels):
+            upper = self.levels[index + 1]
+            upper_start = aggregate.start - aggregate.start % upper.resolution
+            if upper.current is None or upper.current.start != upper_start:
+                self._rollover(index + 1, upper_start)
+            upper.current.merge(aggregate)
+
+    def windows(self, level: int = 0, partial: bool = True) -> List[Aggregate]:
+        """Returns all stored windows of the given level (oldest first)."""
+        result = list(self.levels[level].windows)
+        current = self.levels[level].current
+        if partial and current is not None and current.count:
+            result.append(current.freeze())
+        return result
+
+    def rolling(self, count: int, level: int = 0) -> Optional[Aggregate]:
+        """Aggregates the last *count* windows (including the partial one)."""
+        windows = self.windows(level)[-count:]
+        if not windows:
+            return None
+
+        result = windows[0]
+        for window in windows[1:]:
+            result = result.merge(window)
+        return result
+
+    @property
+    def summary(self) -> Optional[Aggregate]:
+        """Aggregate over all samples so far."""
+        return self.total.freeze() if self.total.count else None
+
+
+class PressureStore:
+    """Pressure series of many brushes, keyed by address."""
+
+    def __init__(self, **options) -> None:
+        self.options = options
+        self.series: Dict[str, PressureSeries] = {}
+
+    def add(self, address: str, pressure: Pressure) -> int:
+        series = self.series.get(address)
+        if series is None:
+            series = self.series[address] = PressureSeries(**self.options)
+        return series.add(pressure)
+
+    def __getitem__(self, address: str) -> PressureSeries:
+        return self.series[address]
+
+    def __contains__(self, address: str) -> bool:
+        return address in self.series
@@ -0,0 +1,307 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import json
+import typing
+import asyncio
+import pathlib
+import dataclasses
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .model import Control, __characteristics__
+from .brush import Mode
+from .push import ConfigPush, PushResult
+from .client import OralBClient
+from .supervisor import ConnectionSupervisor, CONNECTION_ERRORS
+
+#: characteristic models by property name
+MODELS = {model.__cname__: model for model in __characteristics__.values()}
+
+#: alternative names accepted in profiles
+ALIASES = {
+    "color": "my_color",
+    "refill_reminder": "refill_remainder",
+}
+
+#: enums of fields that are declared as plain integers
+FIELD_ENUMS = {
+    ("brush_modes", "modes"): Mode,
+}
+
+#: parameters of ``Control.motor_ramping``
+MOTOR_RAMPING = {
+    "off": Control.Command.DISABLE_ALL_MOTOR_RAMPING,
+    "soft_start": Control.Command.ENABLE_SOFT_START_ONLY_MOTOR_RAMPING,
+    "low_charge": Control.Command.ENABLE_LOW_CHARGE_ONLY_MOTOR_RAMPING,
+    "all": Control.Command.ENABLE_ALL_MOTOR_RAMPING,
+}
+
+# prefix of the smart guide commands
+_SMART_GUIDE = 51
+
+
+def _require_yaml():
+    try:
+        import yaml
+    except ImportError as err:
+        raise ImportError(
+            "PyYAML is required for YAML profiles (pip install oralb-io[profiles])"
+        ) from err
+    return yaml
+
+
+def _convert(value, enum_type):
+    if isinstance(value, list):
+        return [_convert(item, enum_type) for item in value]
+    if isinstance(value, bool) and enum_type is not None:
+        # YAML reads unquoted on/off as booleans
+        value = "on" if value else "off"
+    if isinstance(value, str) and enum_type is not None:
+        try:
+            return enum_type[value.upper()]
+        except KeyError:
+            raise ValueError(f"Unknown {enum_type.__name__}: {value!r}") from None
+    if enum_type is not None:
+        return enum_type(value)
+    return value
+
+
+def _field_enum(field: dataclasses.Field):
+    # enum fields may be annotated as "State | int"
+    for candidate in (field.type, *typing.get_args(field.type)):
+        if isinstance(candidate, type) and issubclass(candidate, enum.Enum):
+            return candidate
+
+
+def build_value(name: str, value):
+    """Creates the model instance of a characteristic from a profile value.
+
+    Mappings are used as keyword arguments, other values are allowed for
+    models with a single field. Enum values may be given by name.
+    """
+    model = MODELS[name]
+    if isinstance(value, model):
+        return value
+
+    fields = dataclasses.fields(model)
+    if not isinstance(value, dict):
+        if len(fields) != 1:
+            raise ValueError(f"{name} requires a mapping of {len(fields)} fields")
+        value = {fields[0].name: value}
+
+    names = {field.name for field in fields}
+    unknown = set(value) - names
+    if unknown:
+        raise ValueError(f"Unknown fields of {name}: {', '.join(sorted(unknown))}")
+
+    kwargs = {}
+    for field in fields:
+        if field.name not in value:
+            continue
+        enum_type = _field_enum(field) or FIELD_ENUMS.get((name, field.name))
+        kwargs[field.name] = _convert(value[field.name], enum_type)
+    return model(**kwargs)
+
+
+@dataclasses.dataclass
+class Profile:
+    """A named set of desired brush settings.
+
+    Profiles are plain mappings (usually stored as JSON or YAML) of
+    characteristic property names to values, plus the write-only settings
+    ``smart_guide`` (bool) and ``motor_ramping`` (one of
+    :data:`MOTOR_RAMPING`)::
+
+        name: clinic
+        my_color: {red: 0, green: 120, blue: 255, identifier: 0}
+        brush_modes: [daily_clean, sensitive, whitening, off, off, off, off, off]
+        tongue_time: 10
+        refill_remainder: {state: on, days_left: 90, brushing_seconds_left: 0}
+        smart_guide: true
+        motor_ramping: soft_start
+    """
+
+    name: str = ""
+
+    #: desired values by property name
+    values: Dict[str, object] = dataclasses.field(default_factory=dict)
+
+    #: control commands sent after all values were written
+    commands: List[Control] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, document: dict) -> "Profile":
+        profile = cls(str(document.get("name", "")))
+        for key, value in document.items():
+            if key == "name":
+                continue
+            if key == "smart_guide":
+                parameter = Control.Command.SMART_GUIDE_ENABLE
+                if not value:
+                    parameter = Control.Command.SMART_GUIDE_DISABLE
+                profile.commands.append(Control(_SMART_GUIDE, parameter))
+            elif key == "motor_ramping":
+                if isinstance(value, str):
+                    if value not in MOTOR_RAMPING:
+                        raise ValueError(f"Unknown motor ramping: {value!r}")
+                    value = MOTOR_RAMPING[value]
+                profile.commands.append(Control.motor_ramping(value))
+            else:
+                name = ALIASES.get(key, key)
+                if name not in MODELS:
+                    raise ValueError(f"Unknown setting: {key!r}")
+                profile.values[name] = build_value(name, value)
+        return profile
+
+    @classmethod
+    def load(cls, path) -> "Profile":
+        """Loads a JSON or YAML (``.yml``/``.yaml``) profile."""
+        path = pathlib.Path(path)
+        with open(path, "r", encoding="utf-8") as fp:
+            if path.suffix.lower() in (".yml", ".yaml"):
+                document = _require_yaml().safe_load(fp)
+            else:
+                document = json.load(fp)
+
+        if not isinstance(document, dict):
+            raise ValueError(f"{str(path)!r} does not contain a mapping")
+        if not document.get("name"):
+            document["name"] = path.stem
+        return cls.from_dict(document)
+
+    def push(self, client, verify: bool = True) -> ConfigPush:
+        """Returns a :class:`~oralb.blesdk.push.ConfigPush` of this profile."""
+        push = ConfigPush(client, verify)
+        for name, value in self.values.items():
+            push.set(name, value)
+        for command in self.commands:
+            push.command(command)
+        return push
+
+    async def drift(
+        self, client, errors: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Tuple[object, object]]:
+        """Reads all values of this profile from the device.
+
+        Cached values are dropped first, so the values are compared with
+        the device and not with earlier reads. The values that were read
+        become the new cached values. Values that can't be read are left
+        out of the result.
+
+        :param errors: receives the errors of unreadable values by name
+        :return: values that differ as name -> (current, desired)
+        """
+        names = list(self.values)
+        for name in names:
+            getattr(client, name)._value = None
+        current = await asyncio.gather(
+            *(getattr(client, name)._get() for name in names),
+            return_exceptions=True,
+        )
+        drift = {}
+        for name, value in zip(names, current):
+            if isinstance(value, BaseException):
+                if errors is not None:
+                    errors[name] = f"{type(value).__name__}: {value}"
+            elif value != self.values[name]:
+                drift[name] = (value, self.values[name])
+        return drift
+
+
+@dataclasses.dataclass
+class ApplyReport:
+    """Outcome of applying a profile to one device."""
+
+    address: str
+
+    #: values that differed before the profile was applied
+    drift: Dict[str, Tuple[object, object]] = dataclasses.field(
+        default_factory=dict
+    )
+
+    #: values that could not be read as name -> error
+    errors: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+    #: ``None`` for dry runs and failed devices
+    result: Optional[PushResult] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and (self.result is None or self.result.ok)
+
+
+async def apply_profile(
+    profile: Profile,
+    client,
+    dry_run: bool = False,
+    verify: bool = True,
+) -> ApplyReport:
+    """Applies a profile to a connected client.
+
+    All values of the profile are read first, only drifted values are
+    written, so applying a profile twice writes nothing the second time.
+    Control commands can't be read back and are sent on every apply; they
+    set absolute states and are therefore safe to repeat.
+
+    :param dry_run: only report the drift
+    """
+    report = ApplyReport(client.address)
+    report.drift = await profile.drift(client, report.errors)
+    if not dry_run:
+        report.result = await profile.push(client, verify).commit()
+    return report
+
+
+async def apply_fleet(
+    profile: Profile,
+    addresses: Iterable[str],
+    concurrency: int = 4,
+    dry_run: bool = False,
+    verify: bool = True,
+    client_factory: Optional[Callable[[str], object]] = None,
+) -> List[ApplyReport]:
+    """Applies a profile to many brushes concurrently.
+
+    Each brush is connected, updated and disconnected on its own; errors
+    are recorded in its report instead of stopping the other devices.
+    Connections are paired and kept alive by a
+    :class:`~oralb.blesdk.supervisor.ConnectionSupervisor`, the same way
+    the CLI connects.
+
+    :param concurrency: maximum number of simultaneous connections
+    :param client_factory: creates an unconnected client for an address
+        (defaults to :class:`~oralb.blesdk.client.OralBClient`)
+    """
+    client_factory = client_factory or OralBClient
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def apply_one(address: str) -> ApplyReport:
+        async with semaphore:
+            client = client_factory(address)
+            supervisor = ConnectionSupervisor(client, unpair_first=True)
+            try:
+                await supervisor.start(address)
+                return await apply_profile(profile, client, dry_run, verify)
+            except Exception as err:
+                return ApplyReport(address.upper(), error=err)
+            finally:
+                try:
+                    await supervisor.stop(disconnect=client.is_connected)
+                except CONNECTION_ERRORS:
+                    pass
+
+    return await asyncio.gather(*map(apply_one, addresses))
@@ -0,0 +1,252 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import math
+import time
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from bleak import BLEDevice, AdvertisementData
+
+# RSSI values are bucketed by dBm for nearest-N queries
+_MIN_RSSI = -127
+_MAX_RSSI = 20
+
+
+class Proximity(NamedTuple):
+    """Snapshot of a tracked device."""
+
+    address: str
+    #: smoothed and last received RSSI (in dBm)
+    rssi: float
+    raw_rssi: int
+    #: timestamp of the last advertisement
+    last_seen: float
+    #: estimated advertisements per second
+    rate: float
+    #: number of received advertisements
+    count: int
+
+
+class _Entry:
+    __slots__ = (
+        "address",
+        "rssi",
+        "variance",
+        "raw",
+        "last_seen",
+        "interval",
+        "count",
+        "bucket",
+        "slot",
+    )
+
+    def __init__(self, address: str, rssi: int, timestamp: float) -> None:
+        self.address = address
+        self.rssi = float(rssi)
+        self.variance = 0.0
+        self.raw = rssi
+        self.last_seen = timestamp
+        self.interval = 0.0
+        self.count = 1
+        self.bucket = 0
+        self.slot = -1
+
+    def snapshot(self) -> Proximity:
+        rate = 1.0 / self.interval if self.interval > 0 else 0.0
+        return Proximity(
+            self.address, self.rssi, self.raw, self.last_seen, rate, self.count
+        )
+
+
+class ProximityTracker:
+    """Tracks smoothed RSSI values of many devices.
+
+    Every advertisement updates the smoothed RSSI (EWMA or a scalar Kalman
+    filter), the last-seen time and the advertisement rate of its device
+    in constant time.
+
+    Devices are kept in RSSI buckets of 1 dBm, so :meth:`nearest` walks
+    at most the ~150 possible buckets instead of all devices. Stale
+    devices are evicted through a time wheel: each device is placed in the
+    slot of its expiry time and :meth:`expire` only visits the slots that
+    passed since the last call.
+
+    :param ttl: devices without advertisements for this long (in seconds)
+        are evicted
+    :param smoothing: ``"ewma"`` or ``"kalman"``
+    :param alpha: EWMA weight of a new value (also used for the rate)
+    :param process_noise: Kalman process noise (how fast the RSSI drifts)
+    :param measurement_noise: Kalman measurement noise (RSSI variance)
+    :param tick: resolution of the time wheel (in seconds)
+    """
+
+    def __init__(
+        self,
+        ttl: float = 30.0,
+        smoothing: str = "ewma",
+        alpha: float = 0.3,
+        process_noise: float = 0.5,
+        measurement_noise: float = 16.0,
+        tick: float = 1.0,
+    ) -> None:
+        if smoothing not in ("ewma", "kalman"):
+            raise ValueError(f"Unknown smoothing: {smoothing!r}")
+
+        self.ttl = ttl
+        self.smoothing = smoothing
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.tick = tick
+
+        self.entries: Dict[str, _Entry] = {}
+        buckets = _MAX_RSSI - _MIN_RSSI + 1
+        self._buckets: List[Set[str]] = [set() for _ in range(buckets)]
+        slots = math.ceil(ttl / tick) + 1
+        self._wheel: List[Set[str]] = [set() for _ in range(slots)]
+        self._wheel_tick: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, address: str) -> bool:
+        return address.upper() in self.entries
+
+    def update(
+        self, address: str, rssi: int, timestamp: Optional[float] = None
+    ) -> Proximity:
+        """Processes the RSSI of a single advertisement."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        address = address.upper()
+        entry = self.entries.get(address)
+        if entry is None:
+            entry = self.entries[address] = _Entry(address, rssi, timestamp)
+            entry.variance = self.measurement_noise
+        else:
+            self._smooth(entry, rssi, timestamp)
+            self._buckets[entry.bucket].discard(address)
+
+        entry.bucket = _bucket(entry.rssi)
+        self._buckets[entry.bucket].add(address)
+        self._schedule(entry)
+        return entry.snapshot()
+
+    def _smooth(self, entry: _Entry, rssi: int, timestamp: float) -> None:
+        elapsed = timestamp - entry.last_seen
+        if elapsed > 0:
+            if entry.interval:
+                entry.interval += self.alpha * (elapsed - entry.interval)
+            else:
+                entry.interval = elapsed
+
+        if self.smoothing == "ewma":
+            entry.rssi += self.alpha * (rssi - entry.rssi)
+        else:
+            # predict: the RSSI drifts with time, then correct
+            variance = entry.variance + self.process_noise * max(elapsed, 0.0)
+            gain = variance / (variance + self.measurement_noise)
+            entry.rssi += gain * (rssi - entry.rssi)
+            entry.variance = (1.0 - gain) * variance
+
+        entry.raw = rssi
+        entry.last_seen = timestamp
+        entry.count += 1
+
+    def _schedule(self, entry: _Entry) -> None:
+        tick = int((entry.last_seen + self.ttl) // self.tick)
+        slot = tick % len(self._wheel)
+        if slot != entry.slot:
+            if entry.slot >= 0:
+                self._wheel[entry.slot].discard(entry.address)
+            self._wheel[slot].add(entry.address)
+            entry.slot = slot
+
+    def _remove(self, entry: _Entry) -> None:
+        del self.entries[entry.address]
+        self._buckets[entry.bucket].discard(entry.address)
+        self._wheel[entry.slot].discard(entry.address)
+
+    def get(self, address: str) -> Optional[Proximity]:
+        entry = self.entries.get(address.upper())
+        return entry.snapshot() if entry is not None else None
+
+    def forget(self, address: str) -> None:
+        entry = self.entries.get(address.upper())
+        if entry is not None:
+            self._remove(entry)
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Evicts all devices that exceeded the TTL.
+
+        :return: the addresses of all evicted devices
+        """
+        now = time.monotonic() if now is None else now
+        size = len(self._wheel)
+        # all ticks before the current one are complete
+        current = int(now // self.tick)
+        start = self._wheel_tick if self._wheel_tick is not None else current - size
+        self._wheel_tick = current
+
+        evicted = []
+        for tick in range(max(start, current - size), current):
+            slot = self._wheel[tick % size]
+            for address in list(slot):
+                entry = self.entries[address]
+                # slots are shared by consecutive rounds of the wheel
+                if now - entry.last_seen >= self.ttl:
+                    self._remove(entry)
+                    evicted.append(address)
+        return evicted
+
+    def nearest(
+        self, count: int, max_age: Optional[float] = None, now: Optional[float] = None
+    ) -> List[Proximity]:
+        """Returns up to *count* devices with the strongest smoothed RSSI.
+
+        :param max_age: skip devices that were not seen within this time
+        """
+        now = time.monotonic() if now is None else now
+        result = []
+        for bucket in reversed(self._buckets):
+            if not bucket:
+                continue
+            entries = sorted(
+                (self.entries[address] for address in bucket),
+                key=lambda entry: entry.rssi,
+                reverse=True,
+            )
+            for entry in entries:
+                if max_age is not None and now - entry.last_seen > max_age:
+                    continue
+                result.append(entry.snapshot())
+                if len(result) >= count:
+                    return result
+        return result
+
+    def detection_callback(
+        self, filter_fn: Optional[Callable[..., bool]] = None
+    ) -> Callable[[BLEDevice, AdvertisementData], None]:
+        """Returns a scanner callback that feeds the RSSI of all (matching)
+        advertisements into this tracker."""
+
+        def on_detection(device: BLEDevice, adv: AdvertisementData) -> None:
+            if filter_fn is None or filter_fn(device, adv):
+                self.update(device.address, adv.rssi)
+
+        return on_detection
+
+
+def _bucket(rssi: float) -> int:
+    return min(max(round(rssi), _MIN_RSSI), _MAX_RSSI) - _MIN_RSSI
@@ -0,0 +1,185 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import dataclasses
+
+from typing import Dict, List, Tuple
+
+from bleak import exc
+from caterpillar.shortcuts import pack
+from caterpillar.exception import StructException
+
+from .model import Control
+
+#: characteristics are written in this order, all others afterwards. The
+#: clock comes first, values that depend on the brush mode last.
+WRITE_ORDER = (
+    "timezone",
+    "rtc",
+    "my_color",
+    "brush_modes",
+    "tongue_time",
+    "refill_remainder",
+    "smiley",
+    "dashboard",
+)
+
+#: values that change on their own and can't be verified by reading them
+UNVERIFIED = frozenset(["rtc"])
+
+
+@dataclasses.dataclass
+class PushResult:
+    """Outcome of :meth:`ConfigPush.commit`."""
+
+    #: written and skipped (unchanged) characteristics by name
+    written: List[str] = dataclasses.field(default_factory=list)
+    skipped: List[str] = dataclasses.field(default_factory=list)
+
+    #: sent control commands
+    commands: List[Control] = dataclasses.field(default_factory=list)
+
+    #: verified values that differ as name -> (desired, actual)
+    mismatches: Dict[str, Tuple[object, object]] = dataclasses.field(
+        default_factory=dict
+    )
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatches
+
+
+class ConfigPush:
+    """Writes a set of configuration values as one transaction.
+
+    Values are collected with :meth:`set` and :meth:`command` (setting a
+    value twice keeps the last one) and written by :meth:`commit`:
+
+    1. values that were not read yet are read from the device, values
+       equal to the current value are skipped,
+    2. the remaining values are written in :data:`WRITE_ORDER`, without
+       waiting for a response where the characteristic supports it,
+    3. control commands are sent afterwards through the client's
+       :class:`ControlChannel`, in the order they were added,
+    4. all written values are read back concurrently and compared.
+
+    Verified values become the new cached values, so pushing the same
+    configuration again writes nothing.
+
+    :param client: a connected :class:`~oralb.blesdk.client.OralBClient`
+    :param verify: read back all written values
+    """
+
+    def __init__(self, client, verify: bool = True) -> None:
+        self.client = client
+        self.verify = verify
+        self.values: Dict[str, object] = {}
+        self.commands: List[Control] = []
+
+    def set(self, name: str, value) -> "ConfigPush":
+        """Adds a value by property name (e.g. ``"my_color"``)."""
+        if name not in self.client.characteristics:
+            raise ValueError(f"Unknown characteristic: {name!r}")
+        self.values[name] = value
+        return self
+
+    def command(self, command: Control) -> "ConfigPush":
+        """Adds a control command, duplicates are sent only once."""
+        if all(_key(c) != _key(command) for c in self.commands):
+            self.commands.append(command)
+        return self
+
+    def plan(self) -> Tuple[List[str], List[str]]:
+        """Returns the names of values to write (in order) and to skip.
+
+        Values are compared with the client's cached values; uncached
+        values are always written (see :meth:`load`).
+        """
+        names = sorted(
+            self.values,
+            key=lambda name: (
+                WRITE_ORDER.index(name) if name in WRITE_ORDER else len(WRITE_ORDER)
+            ),
+        )
+        write, skip = [], []
+        for name in names:
+            cached = getattr(self.client, name)._value
+            (skip if cached == self.values[name] else write).append(name)
+        return write, skip
+
+    def _no_response(self, uuid: str) -> bool:
+        # only values that are verified afterwards may be written blindly
+        if not self.verify:
+            return False
+        services = getattr(self.client.client, "services", None)
+        char = services.get_characteristic(uuid) if services else None
+        return char is not None and "write-without-response" in char.properties
+
+    async def load(self) -> None:
+        """Reads all values that are not cached yet, concurrently.
+
+        Values that can't be read stay uncached and are written.
+        """
+        props = [
+            getattr(self.client, name)
+            for name in self.values
+            if name not in UNVERIFIED and getattr(self.client, name)._value is None
+        ]
+        await asyncio.gather(*map(self._load, props))
+
+    async def _load(self, prop) -> None:
+        try:
+            await prop._get()
+        except (exc.BleakError, StructException):
+            prop._value = None
+
+    async def commit(self) -> PushResult:
+        client = self.client
+        await self.load()
+        write, skip = self.plan()
+        result = PushResult(skipped=skip)
+
+        for name in write:
+            prop = getattr(client, name)
+            data = pack(self.values[name], prop.model, protocol=client.protocol)
+            response = not self._no_response(prop.name)
+            await client.write(prop.name, data, response=response)
+            # the cached value is unknown until verified
+            prop._value = None if self.verify else self.values[name]
+            result.written.append(name)
+
+        for command in self.commands:
+            await client.control.send(command)
+            result.commands.append(command)
+
+        if self.verify:
+            await self._verify(result)
+        return result
+
+    async def _verify(self, result: PushResult) -> None:
+        names = [name for name in result.written if name not in UNVERIFIED]
+        # all reads are issued at once instead of one round trip each; the
+        # values that were read become the new cached values
+        values = await asyncio.gather(
+            *(getattr(self.client, name)._get() for name in names)
+        )
+        for name, actual in zip(names, values):
+            desired = self.values[name]
+            if actual != desired:
+                result.mismatches[name] = (desired, actual)
+
+
+def _key(command: Control) -> Tuple[int, int]:
+    return command.command, getattr(command, "parameter", 0)
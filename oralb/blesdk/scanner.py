@@ -0,0 +1,76 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Optional, Tuple, Dict
+
+from bleak import BleakScanner, BLEDevice, AdvertisementData
+from caterpillar.shortcuts import unpack
+from caterpillar.exception import StructException
+
+from .advertise import is_brush, COMPANY_ID
+from .brush import BrushAdvertisement
+
+
+def parse_advertisement(adv: AdvertisementData) -> Optional[BrushAdvertisement]:
+    """Decodes the manufacturer data of a brush advertisement.
+
+    Returns ``None`` if the advertisement was not sent by a brush or
+    could not be parsed.
+    """
+    data = (adv.manufacturer_data or {}).get(COMPANY_ID)
+    if data is None:
+        return None
+
+    try:
+        return unpack(BrushAdvertisement, data)
+    except StructException:
+        return None
+
+
+async def find_brush(
+    address: str, timeout: float = 10.0, adapter: Optional[str] = None
+) -> Optional[Tuple[BLEDevice, Optional[BrushAdvertisement]]]:
+    """Scans for a single brush and captures its advertisement.
+
+    Connecting by address makes bleak scan for the device anyway. Doing
+    it here lets us keep the advertisement, which carries the protocol
+    version and brush type.
+    """
+    address = address.upper()
+    captured = []
+
+    def match(device: BLEDevice, adv: AdvertisementData) -> bool:
+        if device.address.upper() != address or not is_brush(device, adv):
+            return False
+        captured.append(adv)
+        return True
+
+    options = {"adapter": adapter} if adapter else {}
+    device = await BleakScanner.find_device_by_filter(match, timeout, **options)
+    if device is None:
+        return None
+    return device, parse_advertisement(captured[-1])
+
+
+async def discover_brushes(
+    timeout: float = 10.0,
+) -> Dict[str, Tuple[BLEDevice, BrushAdvertisement]]:
+    """Scans for all brushes in range, keyed by their address."""
+    devices = await BleakScanner.discover(timeout=timeout, return_adv=True)
+    brushes = {}
+    for device, adv in devices.values():
+        advertisement = parse_advertisement(adv)
+        if advertisement is not None:
+            brushes[device.address.upper()] = (device, advertisement)
+    return brushes
@@ -0,0 +1,300 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from caterpillar.shortcuts import pack, unpack
+
+from .layout import Layout, compile_layout
+from .compact import compact_type, model_of
+
+#: size of every sensor data frame
+FRAME_SIZE = 20
+
+#: marks frames whose type is given in the second to last byte
+SPECIAL = 0xFF - 127
+
+
+class FrameCodec(NamedTuple):
+    """How one frame type is decoded."""
+
+    model: type
+    #: number of records in a frame
+    count: int
+    #: type byte (``None`` for plain motion data without trailer)
+    type: Optional[int]
+    #: whether the frame holds one record instead of a list
+    single: bool
+    #: ``None`` if no layout could be compiled, the frames are decoded with
+    #: caterpillar's parser then
+    layout: Optional[Layout]
+    #: record type of :data:`NAMEDTUPLE` results (see
+    #: :func:`~oralb.blesdk.compact.compact_type`)
+    record: type
+
+
+class SensorFrame(NamedTuple):
+    """A decoded sensor data frame."""
+
+    model: type
+    #: a list of records (a single record for high resolution data)
+    records: object
+
+
+#: records as plain tuples, absolute fields (the dashboard status) last
+TUPLE = "tuple"
+#: records as named tuples with the same fields as the model
+NAMEDTUPLE = "namedtuple"
+#: records as model instances (dataclasses)
+MODEL = "model"
+
+
+class SensorCodec:
+    """Table-driven codec of the ``sensor_data`` characteristic.
+
+    Every frame is 20 bytes long. Plain motion data takes up the whole
+    frame; all other types end with their type byte and
+    :data:`SPECIAL`. The codec looks up the frame type in a table of
+    precompiled layouts and decodes all records of a frame with
+    :meth:`struct.Struct.iter_unpack`, without the generic parser. Frame
+    types whose layout can't be compiled (see :func:`compile_layout`) are
+    decoded with the generic parser instead.
+
+    :param kind: result type of the records, one of :data:`TUPLE`,
+        :data:`NAMEDTUPLE` or :data:`MODEL`
+    """
+
+    def __init__(self, frames: Sequence[tuple], kind: str = TUPLE) -> None:
+        if kind not in (TUPLE, NAMEDTUPLE, MODEL):
+            raise ValueError(f"Unknown record kind: {kind!r}")
+
+        self.kind = kind
+        self.codecs: Dict[Optional[int], FrameCodec] = {}
+        self.models: Dict[type, FrameCodec] = {}
+        self._decoders: Dict[Optional[int], Callable[[bytes], object]] = {}
+        for model, count, type_byte in frames:
+            try:
+                layout = compile_layout(model)
+            except TypeError:
+                layout = None
+            record = compact_type(model)
+            single = type_byte is not None and count == 1
+            codec = FrameCodec(model, count, type_byte, single, layout, record)
+            self.codecs[type_byte] = self.models[model] = codec
+            self._decoders[type_byte] = self._decoder(codec)
+
+    def codec(self, frame: bytes) -> FrameCodec:
+        """Returns the codec of a 20 byte frame.
+
+        :raises ValueError: on invalid frames
+        """
+        if len(frame) != FRAME_SIZE:
+            raise ValueError(
+                f"Expected motion data of length {FRAME_SIZE} - got {len(frame)}"
+            )
+
+        key = frame[-2] if frame[-1] == SPECIAL else None
+        codec = self.codecs.get(key)
+        if codec is None:
+            raise ValueError(f"Unexpected data: {frame[-2]:x}")
+        return codec
+
+    def decode(self, frame: bytes) -> SensorFrame:
+        """Decodes all records of a frame."""
+        codec = self.codec(frame)
+        return SensorFrame(codec.model, self._decoders[codec.type](frame))
+
+    def records(self, frame: bytes):
+        """Decodes all records of a frame without the frame's model."""
+        return self._decoders[self.codec(frame).type](frame)
+
+    def _decoder(self, codec: FrameCodec) -> Callable[[bytes], object]:
+        # one specialized function per frame type keeps the per-frame work
+        # down to a table lookup and a single call
+        if codec.layout is None:
+            return self._parser_decoder(codec)
+
+        layout, count, single = codec.layout, codec.count, codec.single
+        if self.kind == MODEL:
+
+            def decode(frame: bytes):
+                # absolute fields are read from the whole frame
+                records = [
+                    layout.decode(frame, index * layout.size)
+                    for index in range(count)
+                ]
+                return records[0] if single else records
+
+            return decode
+
+        shared = _shared(layout)
+        make = _maker(codec) if self.kind == NAMEDTUPLE else None
+        if single:
+            unpack_from = layout.struct.unpack_from
+            make = make or tuple
+
+            def decode(frame: bytes):
+                return make(unpack_from(frame) + shared(frame))
+
+            return decode
+
+        span = count * layout.size
+        iter_unpack = layout.struct.iter_unpack
+        if layout.absolute:
+
+            def decode(frame: bytes):
+                values = shared(frame)
+                records = [record + values for record in iter_unpack(frame[:span])]
+                return list(map(make, records)) if make else records
+
+        elif span == FRAME_SIZE:
+
+            def decode(frame: bytes):
+                records = iter_unpack(frame)
+                return list(map(make, records)) if make else list(records)
+
+        else:
+
+            def decode(frame: bytes):
+                records = iter_unpack(frame[:span])
+                return list(map(make, records)) if make else list(records)
+
+        return decode
+
+    def _parser_decoder(self, codec: FrameCodec) -> Callable[[bytes], object]:
+        # slow path of models without a compiled layout, tuples follow the
+        # field order of the model
+        model = codec.model if codec.single else codec.model[codec.count]
+        if self.kind == MODEL:
+            return lambda frame: unpack(model, frame)
+
+        names = codec.record._fields
+        make = codec.record._make if self.kind == NAMEDTUPLE else tuple
+
+        def convert(record):
+            return make([getattr(record, name) for name in names])
+
+        if codec.single:
+            return lambda frame: convert(unpack(model, frame))
+        return lambda frame: list(map(convert, unpack(model, frame)))
+
+    def encode(self, records, model: Optional[type] = None) -> bytes:
+        """Encodes a list of records (or a single record) into a frame.
+
+        :param model: the model of plain tuple records, taken from the
+            records if they are model instances or compact records
+        """
+        if not isinstance(records, list):
+            records = [records]
+        if model is None:
+            if not records:
+                raise ValueError("Can't encode an empty frame without model")
+            model = type(records[0])
+            model = model_of(model) or model
+
+        codec = self.models.get(model)
+        if codec is None:
+            raise ValueError(f"Invalid data type: {model}")
+        if len(records) > codec.count:
+            raise ValueError(f"{model.__name__} frames hold {codec.count} records")
+
+        frame = bytearray(FRAME_SIZE)
+        if codec.layout is not None:
+            _pack_records(codec.layout, records, frame)
+        elif all(isinstance(record, codec.model) for record in records):
+            data = pack(records, codec.model[len(records)])
+            frame[: len(data)] = data
+        else:
+            raise ValueError(f"{model.__name__} frames require model records")
+
+        if codec.type is not None:
+            frame[-2] = codec.type
+            frame[-1] = SPECIAL
+        return bytes(frame)
+
+
+def _pack_records(layout: Layout, records: list, frame: bytearray) -> None:
+    for index, record in enumerate(records):
+        if type(record) is tuple:
+            values = record[: len(layout.names)]
+        else:
+            values = [int(getattr(record, name)) for name in layout.names]
+        layout.struct.pack_into(frame, index * layout.size, *values)
+
+    if records:
+        first = records[0]
+        absolute = layout.absolute.items()
+        for position, (name, (offset, field)) in enumerate(absolute):
+            if type(first) is tuple:
+                value = first[len(layout.names) + position]
+            else:
+                value = int(getattr(first, name))
+            field.pack_into(frame, offset, value)
+
+
+def _shared(layout: Layout) -> Callable[[bytes], tuple]:
+    # values of absolute fields, appended to every record
+    fields = tuple(layout.absolute.values())
+    if not fields:
+        return lambda frame: ()
+    return lambda frame: tuple(
+        field.unpack_from(frame, offset)[0] for offset, field in fields
+    )
+
+
+def _maker(codec: FrameCodec) -> Callable[[tuple], tuple]:
+    # tuples hold the absolute fields last, the named tuples follow the
+    # field order of the model
+    layout = codec.layout
+    names = layout.names + tuple(layout.absolute)
+    order = [names.index(name) for name in codec.record._fields]
+    if order == list(range(len(order))):
+        return codec.record._make
+    return lambda values: codec.record._make([values[index] for index in order])
+
+
+def default_frames() -> List[tuple]:
+    """Returns the (model, record count, type byte) table of all frames."""
+    from .model import (
+        SensorData,
+        MotionData,
+        GyroMotionData,
+        HighResolutionMotionData,
+        CalibrationData,
+        DashboardData,
+    )
+
+    return [
+        (MotionData, 4, None),
+        (GyroMotionData, 2, SensorData.Data.COMINO),
+        (HighResolutionMotionData, 1, SensorData.Data.HIGH_RESOLUTION),
+        (CalibrationData, 3, SensorData.Data.CALIBRATION),
+        (DashboardData, 2, SensorData.Data.DASHBOARD),
+    ]
+
+
+_codecs: Dict[str, SensorCodec] = {}
+
+
+def sensor_codec(kind: str = TUPLE) -> SensorCodec:
+    """Returns the shared codec of all sensor data frames."""
+    codec = _codecs.get(kind)
+    if codec is None:
+        codec = _codecs[kind] = SensorCodec(default_frames(), kind)
+    return codec
+
+
+def decode_frame(frame: bytes, kind: str = TUPLE) -> SensorFrame:
+    """Decodes a sensor data frame, see :class:`SensorCodec`."""
+    return sensor_codec(kind).decode(frame)
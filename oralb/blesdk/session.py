@@ -0,0 +1,336 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import time
+import dataclasses
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bleak import BLEDevice, AdvertisementData
+
+from .model import DeviceState, Pressure
+from .brush import (
+    BrushAdvertisement,
+    BrushingTime,
+    BrushingMode,
+    ToothbrushQuadrant,
+    Quadrant,
+)
+from .scanner import parse_advertisement
+
+_RUN = int(DeviceState.State.RUN)
+_HIGH_PRESSURE = int(Pressure.State.HIGH_PRESSURE)
+# quadrant values above this one have a special meaning
+_MAX_QUADRANT = int(Quadrant.EIGHTH_QUADRANT)
+
+
+@dataclasses.dataclass
+class BrushingSession:
+    """A completed brushing session."""
+
+    address: str
+
+    #: timestamps (in seconds) of the first and last event of the session
+    start: float
+    end: float
+
+    #: the brushing time reported by the brush (in seconds)
+    brushing_time: int = 0
+
+    #: time spent per quadrant (in seconds)
+    quadrant_times: Dict[int, float] = dataclasses.field(default_factory=dict)
+
+    #: pressure state changes as (timestamp, state)
+    pressure_events: List[Tuple[float, int]] = dataclasses.field(default_factory=list)
+
+    #: total time with high pressure (in seconds)
+    high_pressure_time: float = 0.0
+
+    #: mode changes as (timestamp, mode)
+    mode_changes: List[Tuple[float, int]] = dataclasses.field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def high_pressure_count(self) -> int:
+        return sum(1 for _, state in self.pressure_events if state == _HIGH_PRESSURE)
+
+
+class _Device:
+    __slots__ = (
+        "session",
+        "last_seen",
+        "paused_at",
+        "quadrant",
+        "quadrant_since",
+        "pressure",
+        "pressure_since",
+        "mode",
+        "brushing_time",
+    )
+
+    def __init__(self) -> None:
+        self.session: Optional[BrushingSession] = None
+        self.last_seen = 0.0
+        self.paused_at: Optional[float] = None
+        self.quadrant: Optional[int] = None
+        self.quadrant_since = 0.0
+        self.pressure: Optional[int] = None
+        self.pressure_since = 0.0
+        self.mode: Optional[int] = None
+        #: the last brushing time reported by the brush
+        self.brushing_time: Optional[int] = None
+
+
+class SessionTracker:
+    """Reconstructs brushing sessions from advertisements and notifications.
+
+    Events are fed one at a time together with the address of the brush
+    and a timestamp. Each event is processed in constant time, sessions
+    are emitted once they are completed.
+
+    A session starts when the brush reports the ``RUN`` state (or its
+    brushing time increases) and ends if the brush did not return
+    to ``RUN`` within *pause_timeout* seconds, if no event was received
+    for *idle_timeout* seconds or if the brushing time was reset.
+
+    :param pause_timeout: maximum pause (in seconds) within a session
+    :param idle_timeout: sessions without events are closed after this
+        time (see :meth:`expire`)
+    :param min_duration: shorter sessions are dropped
+    :param on_session: called with every completed session
+    """
+
+    def __init__(
+        self,
+        pause_timeout: float = 5.0,
+        idle_timeout: float = 30.0,
+        min_duration: float = 0.0,
+        on_session: Optional[Callable[[BrushingSession], None]] = None,
+    ) -> None:
+        self.pause_timeout = pause_timeout
+        self.idle_timeout = idle_timeout
+        self.min_duration = min_duration
+        self.on_session = on_session
+        self.devices: Dict[str, _Device] = {}
+        self._handlers = {
+            BrushAdvertisement: self._on_advertisement,
+            BrushingTime: self._on_brushing_time,
+            ToothbrushQuadrant: self._on_quadrant,
+            Pressure: self._on_pressure,
+            BrushingMode: self._on_mode,
+            DeviceState: self._on_device_state,
+        }
+
+    @property
+    def active(self) -> int:
+        """Number of sessions in progress."""
+        return sum(1 for device in self.devices.values() if device.session)
+
+    def feed(
+        self, address: str, event, timestamp: Optional[float] = None
+    ) -> List[BrushingSession]:
+        """Processes a single decoded event.
+
+        Unknown event types are ignored.
+
+        :return: the sessions that were completed by this event (a timed
+            out session and the one ended by a reset brushing time)
+        """
+        handler = self._handlers.get(type(event))
+        if handler is None:
+            return []
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = _Device()
+
+        completed = []
+        session = device.session
+        if session is not None:
+            if timestamp - device.last_seen > self.idle_timeout or (
+                device.paused_at is not None
+                and timestamp - device.paused_at > self.pause_timeout
+            ):
+                completed.append(self._close(device))
+
+        device.last_seen = timestamp
+        completed.append(handler(address, device, event, timestamp))
+        return [session for session in completed if session is not None]
+
+    def expire(self, now: Optional[float] = None) -> List[BrushingSession]:
+        """Closes all sessions that did not receive events in time."""
+        now = time.time() if now is None else now
+        completed = []
+        for device in self.devices.values():
+            if device.session is None:
+                continue
+
+            paused = device.paused_at
+            if now - device.last_seen > self.idle_timeout or (
+                paused is not None and now - paused > self.pause_timeout
+            ):
+                session = self._close(device)
+                if session is not None:
+                    completed.append(session)
+        return completed
+
+    def flush(self) -> List[BrushingSession]:
+        """Closes all sessions in progress (e.g. at the end of a capture)."""
+        completed = []
+        for device in self.devices.values():
+            if device.session is not None:
+                session = self._close(device)
+                if session is not None:
+                    completed.append(session)
+        return completed
+
+    def detection_callback(self) -> Callable[[BLEDevice, AdvertisementData], None]:
+        """Returns a callback for :class:`bleak.BleakScanner` that feeds all
+        brush advertisements into this tracker."""
+
+        def on_detection(device: BLEDevice, adv: AdvertisementData) -> None:
+            advertisement = parse_advertisement(adv)
+            if advertisement is not None:
+                self.feed(device.address, advertisement)
+
+        return on_detection
+
+    # -- state transitions ---------------------------------------------------
+    def _open(self, address: str, device: _Device, timestamp: float) -> None:
+        device.session = BrushingSession(address, timestamp, timestamp)
+        device.paused_at = None
+        device.quadrant_since = device.pressure_since = timestamp
+
+    def _close(self, device: _Device) -> Optional[BrushingSession]:
+        session = device.session
+        end = device.paused_at if device.paused_at is not None else device.last_seen
+        session.end = max(end, session.start)
+        if device.quadrant is not None:
+            self._add_quadrant_time(device, session.end)
+        if device.pressure == _HIGH_PRESSURE:
+            session.high_pressure_time += max(0.0, session.end - device.pressure_since)
+
+        device.session = None
+        device.paused_at = None
+        device.quadrant = None
+        device.pressure = None
+        if session.duration < self.min_duration:
+            return None
+
+        if self.on_session is not None:
+            self.on_session(session)
+        return session
+
+    def _add_quadrant_time(self, device: _Device, timestamp: float) -> None:
+        quadrant = device.quadrant
+        if quadrant <= _MAX_QUADRANT:
+            times = device.session.quadrant_times
+            elapsed = max(0.0, timestamp - device.quadrant_since)
+            times[quadrant] = times.get(quadrant, 0.0) + elapsed
+        device.quadrant_since = timestamp
+
+    def _running(self, address, device: _Device, running: bool, timestamp: float):
+        if running:
+            if device.session is None:
+                self._open(address, device, timestamp)
+            else:
+                device.paused_at = None
+            device.session.end = timestamp
+        elif device.session is not None and device.paused_at is None:
+            device.paused_at = timestamp
+
+    def _brushing_time(self, address, device: _Device, seconds: int, timestamp):
+        completed = None
+        reset = False
+        session = device.session
+        if session is not None and seconds < session.brushing_time:
+            # the brush started a new session
+            completed = self._close(device)
+            session = None
+            reset = True
+
+        # an idle brush keeps reporting the time of its last session, so
+        # only a counting brushing time starts a new one
+        last = device.brushing_time
+        device.brushing_time = seconds
+        counting = reset or (last is not None and seconds > last)
+        if session is None and seconds > 0 and counting:
+            self._open(address, device, timestamp)
+            session = device.session
+        if session is not None:
+            session.brushing_time = seconds
+            session.end = timestamp
+        return completed
+
+    def _quadrant(self, device: _Device, quadrant: int, timestamp: float) -> None:
+        if device.session is None or quadrant == device.quadrant:
+            return
+
+        if device.quadrant is not None:
+            self._add_quadrant_time(device, timestamp)
+        device.quadrant = quadrant
+        device.quadrant_since = timestamp
+
+    def _pressure(self, device: _Device, state: int, timestamp: float) -> None:
+        session = device.session
+        if session is None or state == device.pressure:
+            return
+
+        if device.pressure == _HIGH_PRESSURE:
+            session.high_pressure_time += timestamp - device.pressure_since
+        session.pressure_events.append((timestamp, state))
+        device.pressure = state
+        device.pressure_since = timestamp
+
+    def _mode(self, device: _Device, mode: int, timestamp: float) -> None:
+        if mode == device.mode:
+            return
+
+        device.mode = mode
+        if device.session is not None:
+            device.session.mode_changes.append((timestamp, mode))
+
+    # -- event handlers ------------------------------------------------------
+    def _on_advertisement(self, address, device, adv: BrushAdvertisement, ts):
+        seconds = adv.brush_time_min * 60 + adv.brush_time_sec
+        completed = self._brushing_time(address, device, seconds, ts)
+        self._running(address, device, int(adv.state) == _RUN, ts)
+        self._mode(device, int(adv.brush_mode), ts)
+        self._quadrant(device, int(adv.quadrant_completion), ts)
+        if adv.protocol <= 5:
+            # the status field carries the pressure state
+            self._pressure(device, int(adv.status), ts)
+        return completed
+
+    def _on_brushing_time(self, address, device, event: BrushingTime, ts):
+        seconds = event.minutes * 60 + event.seconds
+        return self._brushing_time(address, device, seconds, ts)
+
+    def _on_quadrant(self, address, device, event: ToothbrushQuadrant, ts):
+        self._quadrant(device, int(event.quadrant), ts)
+
+    def _on_pressure(self, address, device, event: Pressure, ts):
+        self._pressure(device, int(event.state), ts)
+
+    def _on_mode(self, address, device, event: BrushingMode, ts):
+        self._mode(device, int(event.mode), ts)
+
+    def _on_device_state(self, address, device, event: DeviceState, ts):
+        self._running(address, device, int(event.state) == _RUN, ts)
@@ -0,0 +1,290 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import enum
+import errno
+import random
+import asyncio
+import dataclasses
+import time
+
+from typing import Optional, Callable
+
+from bleak import exc
+
+from .model import Control
+from .gatt import Priority, gatt_priority
+
+#: errors that indicate a lost or failed connection. Everything else
+#: is passed to the caller.
+CONNECTION_ERRORS = (TimeoutError, OSError, exc.BleakError)
+
+
+def is_disconnect_error(error: BaseException) -> bool:
+    """Returns whether the given error was caused by a lost connection."""
+    if isinstance(error, exc.BleakError):
+        return str(error).endswith("Unreachable")
+
+    if isinstance(error, OSError) and error.errno == errno.EINVAL:
+        # windows closed connection
+        return len(error.args) == 5 and list(error.args)[3] == -0x7FFFFFED
+
+    return False
+
+
+class ConnectionState(enum.Enum):
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    PAIRING = "pairing"
+    CONNECTED = "connected"
+    BACKOFF = "backoff"
+    FAILED = "failed"
+    CLOSED = "closed"
+
+
+@dataclasses.dataclass
+class Backoff:
+    """Bounded exponential backoff with jitter."""
+
+    #: delay before the second attempt (in seconds)
+    initial: float = 0.5
+
+    #: upper bound for a single delay
+    maximum: float = 30.0
+
+    factor: float = 2.0
+
+    #: fraction of the delay that is randomized (0 disables jitter)
+    jitter: float = 0.5
+
+    #: the number of attempts before giving up
+    max_attempts: int = 6
+
+    def delay(self, attempt: int) -> float:
+        base = min(self.maximum, self.initial * self.factor**attempt)
+        return base * (1.0 - self.jitter * random.random())
+
+
+@dataclasses.dataclass
+class SupervisorMetrics:
+    connects: int = 0
+    reconnects: int = 0
+    failed_attempts: int = 0
+    keep_alives: int = 0
+    keep_alive_failures: int = 0
+
+    #: time (in seconds) from losing the connection to being connected
+    #: again, for the last reconnect
+    last_reconnect_time: Optional[float] = None
+    total_reconnect_time: float = 0.0
+
+    @property
+    def mean_reconnect_time(self) -> Optional[float]:
+        if not self.reconnects:
+            return None
+        return self.total_reconnect_time / self.reconnects
+
+
+class ConnectionSupervisor:
+    """Keeps an :class:`~oralb.blesdk.client.OralBClient` connected.
+
+    The supervisor connects (and pairs) with bounded exponential backoff,
+    extends the connection periodically and reconnects once the
+    connection is lost. Notification subscriptions are restored by the
+    client on every connect.
+
+    :param client: the client to supervise
+    :param backoff: retry configuration
+    :param keep_alive: interval (in seconds) between two
+        ``Control.extend_connection`` requests, ``None`` disables it
+    :param pair: whether to pair after connecting
+    :param unpair_first: whether to remove an existing bond before
+        connecting, which helps with stale bonds on some platforms
+    :param on_state: called with the supervisor on every state change
+    """
+
+    def __init__(
+        self,
+        client,
+        backoff: Optional[Backoff] = None,
+        keep_alive: Optional[float] = 25.0,
+        pair: bool = True,
+        unpair_first: bool = False,
+        on_state: Optional[Callable[["ConnectionSupervisor"], None]] = None,
+    ) -> None:
+        self.client = client
+        self.backoff = backoff or Backoff()
+        self.keep_alive = keep_alive
+        self.pair = pair
+        self.unpair_first = unpair_first
+        self.on_state = on_state
+        self.metrics = SupervisorMetrics()
+
+        #: the delay of the current backoff state
+        self.next_delay: float = 0.0
+        self.last_error: Optional[BaseException] = None
+
+        self._state = ConnectionState.DISCONNECTED
+        self._lost_at: Optional[float] = None
+        self._keep_alive_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # reconnect started by a disconnect callback
+        self._disconnect_task: Optional[asyncio.Task] = None
+        client.disconnected_callback = self._on_disconnect
+
+    @property
+    def state(self) -> ConnectionState:
+        return self._state
+
+    @property
+    def is_connected(self) -> bool:
+        return self._state == ConnectionState.CONNECTED
+
+    def _set_state(self, state: ConnectionState) -> None:
+        if state != self._state:
+            self._state = state
+            if self.on_state is not None:
+                self.on_state(self)
+
+    async def start(self, address=None, advertisement=None) -> None:
+        """Connects to the device and starts the keep-alive loop.
+
+        :raises: the last connection error if all attempts failed
+        """
+        if self._state == ConnectionState.CLOSED:
+            self._state = ConnectionState.DISCONNECTED
+
+        await self._connect(address, advertisement)
+        if self.keep_alive and self._keep_alive_task is None:
+            self._keep_alive_task = asyncio.create_task(self._keep_alive_loop())
+
+    async def stop(self, disconnect: bool = True) -> None:
+        self._set_state(ConnectionState.CLOSED)
+        tasks = (self._keep_alive_task, self._reconnect_task, self._disconnect_task)
+        for task in tasks:
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self._keep_alive_task = self._reconnect_task = self._disconnect_task = None
+        if disconnect and self.client.client is not None:
+            await self.client.disconnect()
+
+    async def reconnect(self) -> bool:
+        """Reconnects to the device, joining a reconnect in progress.
+
+        :return: whether the device is connected again
+        """
+        if self._state == ConnectionState.CLOSED:
+            return False
+
+        if self._reconnect_task is None or self._reconnect_task.done():
+            if self._lost_at is None:
+                self._lost_at = time.monotonic()
+            self._reconnect_task = asyncio.create_task(self._connect())
+
+        try:
+            await asyncio.shield(self._reconnect_task)
+        except CONNECTION_ERRORS:
+            return False
+        return self.is_connected
+
+    async def extend_connection(self) -> None:
+        with gatt_priority(Priority.KEEP_ALIVE):
+            # through the channel, so it can't separate another request
+            # from its response; the priority moves it ahead of queued ones
+            await self.client.control.send(Control.extend_connection(255))
+        self.metrics.keep_alives += 1
+
+    def _on_disconnect(self, _) -> None:
+        # Disconnects during connect attempts or after stop() are expected
+        if self._state != ConnectionState.CONNECTED:
+            return
+
+        self._set_state(ConnectionState.DISCONNECTED)
+        self._lost_at = time.monotonic()
+        self._disconnect_task = asyncio.get_running_loop().create_task(
+            self.reconnect()
+        )
+
+    async def _connect(self, address=None, advertisement=None) -> None:
+        for attempt in range(self.backoff.max_attempts):
+            if self._state == ConnectionState.CLOSED:
+                raise asyncio.CancelledError
+
+            if attempt > 0:
+                self.next_delay = self.backoff.delay(attempt - 1)
+                self._set_state(ConnectionState.BACKOFF)
+                await asyncio.sleep(self.next_delay)
+
+            try:
+                await self._attempt(address, advertisement)
+            except CONNECTION_ERRORS as error:
+                self.last_error = error
+                self.metrics.failed_attempts += 1
+                # never pass a stale advertisement twice
+                advertisement = None
+                continue
+
+            self._connected()
+            return
+
+        self._set_state(ConnectionState.FAILED)
+        if self.last_error is None:
+            raise ConnectionError("No connection attempts are configured")
+        raise self.last_error
+
+    async def _attempt(self, address, advertisement) -> None:
+        client = self.client
+        self._set_state(ConnectionState.CONNECTING)
+        if self.unpair_first and client.client is not None:
+            await client.unpair()
+
+        await client.connect(address=address, advertisement=advertisement)
+        if self.pair:
+            self._set_state(ConnectionState.PAIRING)
+            await client.pair()
+
+        if self.keep_alive:
+            # The brush drops connections quickly without this request
+            await self.extend_connection()
+
+    def _connected(self) -> None:
+        self.metrics.connects += 1
+        if self._lost_at is not None:
+            elapsed = time.monotonic() - self._lost_at
+            self.metrics.reconnects += 1
+            self.metrics.last_reconnect_time = elapsed
+            self.metrics.total_reconnect_time += elapsed
+            self._lost_at = None
+
+        self.last_error = None
+        self._set_state(ConnectionState.CONNECTED)
+
+    async def _keep_alive_loop(self) -> None:
+        while self._state != ConnectionState.CLOSED:
+            await asyncio.sleep(self.keep_alive)
+            if self._state in (ConnectionState.FAILED, ConnectionState.DISCONNECTED):
+                # try again after all attempts of the last reconnect failed
+                await self.reconnect()
+                continue
+
+            if self._state != ConnectionState.CONNECTED:
+                continue
+
+            try:
+                await self.extend_connection()
+            except CONNECTION_ERRORS as error:
+                self.last_error = error
+                self.metrics.keep_alive_failures += 1
+                self._set_state(ConnectionState.DISCONNECTED)
+                await self.reconnect()
@@ -0,0 +1,257 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import json
+import math
+import time
+import asyncio
+import pathlib
+import dataclasses
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from caterpillar.shortcuts import pack
+
+from .model import RTC, CH_RTC
+from .cache import default_cache_path
+
+#: maximum number of offsets kept per device
+HISTORY_SIZE = 64
+
+
+def rtc_time(rtc: RTC) -> float:
+    """Converts an RTC value into a UNIX timestamp.
+
+    The brush counts whole seconds since 1970-01-01 (UTC); the field is
+    named ``epochMillis`` but has only 32 bits.
+    """
+    return float(rtc.epochMillis)
+
+
+def make_rtc(timestamp: float) -> RTC:
+    return RTC(int(timestamp))
+
+
+class SyncSample(NamedTuple):
+    #: host time (time.time) in the middle of the read
+    timestamp: float
+    #: device clock minus host clock (in seconds)
+    offset: float
+    #: round-trip time of the read (in seconds)
+    rtt: float
+
+
+@dataclasses.dataclass
+class DeviceClock:
+    """Clock state of a single brush."""
+
+    address: str
+
+    #: host time of the last correction
+    synced: Optional[float] = None
+
+    #: measured offset right after the last correction
+    residual: float = 0.0
+
+    #: estimated drift of the device clock (seconds per second)
+    drift: float = 0.0
+
+    #: (host time, offset) of the measurements since the last correction
+    history: List[Tuple[float, float]] = dataclasses.field(default_factory=list)
+
+    @property
+    def ppm(self) -> float:
+        return self.drift * 1e6
+
+    def observe(self, sample: SyncSample) -> None:
+        self.history.append((sample.timestamp, sample.offset))
+        del self.history[:-HISTORY_SIZE]
+        if len(self.history) > 1:
+            self.drift = _slope(self.history)
+
+    def reset(self, timestamp: float, residual: float) -> None:
+        """Records a correction of the device clock."""
+        self.synced = timestamp
+        self.residual = residual
+        self.history = [(timestamp, residual)]
+
+    def offset(self, timestamp: Optional[float] = None) -> float:
+        """Predicts the offset of the device clock at the given host time."""
+        if self.synced is None:
+            return self.history[-1][1] if self.history else 0.0
+        timestamp = time.time() if timestamp is None else timestamp
+        return self.residual + self.drift * (timestamp - self.synced)
+
+    def to_host(self, device_time: float) -> float:
+        """Converts a device timestamp into host time."""
+        # the offset changes slowly, so evaluating it at the device time
+        # is accurate enough
+        return device_time - self.offset(device_time)
+
+
+def _slope(points: List[Tuple[float, float]]) -> float:
+    # least squares fit of offset over time
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if var == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+@dataclasses.dataclass
+class SyncReport:
+    """Outcome of :meth:`TimeSync.sync` for one device."""
+
+    address: str
+    #: offset and round-trip time before the correction
+    offset: Optional[float] = None
+    rtt: Optional[float] = None
+    corrected: bool = False
+    #: offset after the correction
+    residual: Optional[float] = None
+    #: estimated drift in ppm
+    ppm: float = 0.0
+    error: Optional[BaseException] = None
+
+
+class TimeSync:
+    """Synchronizes and tracks the clocks of many brushes.
+
+    The device clock is read several times; the read with the lowest
+    round-trip time gives the offset, assuming the value was taken in the
+    middle of the round trip. Clocks that are off by more than *threshold*
+    are corrected: the new time is written right before a full second
+    (the RTC has a resolution of one second), compensating for half of
+    the round-trip time.
+
+    Offsets measured between corrections give the drift of every device,
+    which :meth:`DeviceClock.to_host` uses to align device timestamps.
+    Clock states are stored in a JSON file.
+
+    :param path: file of the clock states (no persistence if ``None``)
+    :param samples: number of reads per measurement
+    :param threshold: minimum offset (in seconds) that triggers a write
+    """
+
+    def __init__(
+        self,
+        path: Optional[pathlib.Path] = None,
+        samples: int = 3,
+        threshold: float = 1.0,
+    ) -> None:
+        self.path = pathlib.Path(path) if path else None
+        self.samples = samples
+        self.threshold = threshold
+        self.clocks: Dict[str, DeviceClock] = {}
+
+    @classmethod
+    def load(cls, path: Optional[pathlib.Path] = None, **kwargs) -> "TimeSync":
+        """Loads clock states, defaults to ``clocks.json`` next to the
+        device cache."""
+        sync = cls(path or default_cache_path().parent / "clocks.json", **kwargs)
+        try:
+            with open(sync.path, "r", encoding="utf-8") as fp:
+                document = json.load(fp)
+            for address, values in document.items():
+                values["history"] = [tuple(point) for point in values["history"]]
+                sync.clocks[address] = DeviceClock(**values)
+        except (OSError, ValueError, TypeError, KeyError):
+            # missing or corrupted files result in empty states
+            sync.clocks.clear()
+        return sync
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+
+        document = {
+            address: dataclasses.asdict(clock)
+            for address, clock in self.clocks.items()
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(document, fp, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def clock(self, address: str) -> DeviceClock:
+        address = address.upper()
+        if address not in self.clocks:
+            self.clocks[address] = DeviceClock(address)
+        return self.clocks[address]
+
+    async def measure(self, client) -> SyncSample:
+        """Measures the offset of the device clock."""
+        best = None
+        for _ in range(self.samples):
+            start = time.time()
+            data = await client.read(CH_RTC)
+            end = time.time()
+            device_time = rtc_time(client.rtc.decode(data))
+            # the RTC truncates to full seconds
+            sample = SyncSample(
+                (start + end) / 2, device_time + 0.5 - (start + end) / 2, end - start
+            )
+            if best is None or sample.rtt < best.rtt:
+                best = sample
+        return best
+
+    async def correct(self, client, rtt: float) -> None:
+        """Writes the host time to the device clock."""
+        # the value should arrive right at the start of a second
+        arrival = time.time() + rtt / 2
+        await asyncio.sleep(math.ceil(arrival) - arrival)
+        data = pack(make_rtc(math.ceil(arrival)), RTC, protocol=client.protocol)
+        await client.write(CH_RTC, data, response=True)
+        client.rtc._value = None
+
+    async def sync(self, client, force: bool = False) -> SyncReport:
+        """Measures and, if necessary, corrects the clock of one device."""
+        clock = self.clock(client.address)
+        report = SyncReport(clock.address)
+        sample = await self.measure(client)
+        clock.observe(sample)
+        report.offset, report.rtt = sample.offset, sample.rtt
+
+        if force or abs(sample.offset) >= self.threshold:
+            await self.correct(client, sample.rtt)
+            after = await self.measure(client)
+            drift = clock.drift
+            clock.reset(after.timestamp, after.offset)
+            # the drift stays valid for the corrected clock
+            clock.drift = drift
+            report.corrected = True
+            report.residual = after.offset
+        report.ppm = clock.ppm
+        return report
+
+    async def sync_all(
+        self, clients: Iterable, force: bool = False
+    ) -> List[SyncReport]:
+        """Synchronizes all given (connected) clients concurrently."""
+        clients = list(clients)
+        results = await asyncio.gather(
+            *(self.sync(client, force) for client in clients), return_exceptions=True
+        )
+        reports = []
+        for client, result in zip(clients, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                result = SyncReport(client.address.upper(), error=result)
+            reports.append(result)
+        self.save()
+        return reports
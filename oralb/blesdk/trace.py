@@ -0,0 +1,186 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import json
+import time
+import asyncio
+import collections
+
+from typing import NamedTuple, Optional, Dict
+
+from .metrics import MetricsSink
+
+
+class Span(NamedTuple):
+    op: str
+    device: str
+    target: str
+    #: start and duration in seconds (perf_counter clock)
+    start: float
+    duration: float
+    #: name of the asyncio task that recorded the span
+    task: str
+
+
+def _task_name() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task.get_name() if task is not None else "main"
+
+
+class TraceSink(MetricsSink):
+    """Records every measured operation as a span.
+
+    The client reports operations when they finish, so the start of a
+    span is derived from its duration. Nested operations (e.g. the write
+    and read of a control request) therefore line up with their parent
+    in trace viewers.
+
+    :param max_spans: upper bound of stored spans, older spans are dropped
+    """
+
+    def __init__(self, max_spans: int = 100_000) -> None:
+        self.spans = collections.deque(maxlen=max_spans)
+        # wall clock reference for the perf_counter values
+        self._origin_ns = time.time_ns()
+        self._origin = time.perf_counter()
+
+    def observe(self, op: str, device: str, target: str, seconds: float) -> None:
+        end = time.perf_counter()
+        self.spans.append(
+            Span(op, str(device), target, end - seconds, seconds, _task_name())
+        )
+
+    def count(self, op: str, device: str, target: str) -> None:
+        # events are stored as spans without duration
+        self.spans.append(
+            Span(op, str(device), target, time.perf_counter(), 0.0, _task_name())
+        )
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+    def _unix_ns(self, value: float) -> int:
+        return self._origin_ns + int((value - self._origin) * 1e9)
+
+    def to_chrome(self) -> dict:
+        """Converts all spans into the Chrome trace-event format.
+
+        Every device is shown as a process and every asyncio task as a
+        thread. The result can be opened in Perfetto or chrome://tracing.
+        """
+        pids: Dict[str, int] = {}
+        tids: Dict[str, int] = {}
+        events = []
+        for span in self.spans:
+            pid = pids.get(span.device)
+            if pid is None:
+                pid = pids[span.device] = len(pids) + 1
+                events.append(
+                    {
+                        "ph": "M",
+                        "name": "process_name",
+                        "pid": pid,
+                        "args": {"name": span.device},
+                    }
+                )
+            tid = tids.get(span.task)
+            if tid is None:
+                tid = tids[span.task] = len(tids) + 1
+            event = {
+                "name": span.op,
+                "cat": "ble",
+                "pid": pid,
+                "tid": tid,
+                "ts": (span.start - self._origin) * 1e6,
+                "args": {"target": span.target},
+            }
+            if span.duration:
+                event.update(ph="X", dur=span.duration * 1e6)
+            else:
+                event.update(ph="i", s="t")
+            events.append(event)
+
+        for pid in pids.values():
+            for task, tid in tids.items():
+                events.append(
+                    {
+                        "ph": "M",
+                        "name": "thread_name",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": task},
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_otlp(self, service_name: str = "oralb") -> dict:
+        """Converts all spans into the OTLP/JSON trace format."""
+        trace_id = os.urandom(16).hex()
+        spans = []
+        for span in self.spans:
+            start = self._unix_ns(span.start)
+            attributes = [
+                {"key": "ble.device", "value": {"stringValue": span.device}},
+                {"key": "ble.target", "value": {"stringValue": span.target}},
+                {"key": "asyncio.task", "value": {"stringValue": span.task}},
+            ]
+            spans.append(
+                {
+                    "traceId": trace_id,
+                    "spanId": os.urandom(8).hex(),
+                    "name": span.op,
+                    # SPAN_KIND_CLIENT
+                    "kind": 3,
+                    "startTimeUnixNano": str(start),
+                    "endTimeUnixNano": str(start + int(span.duration * 1e9)),
+                    "attributes": attributes,
+                }
+            )
+        resource = {
+            "attributes": [
+                {"key": "service.name", "value": {"stringValue": service_name}}
+            ]
+        }
+        return {
+            "resourceSpans": [
+                {
+                    "resource": resource,
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+                }
+            ]
+        }
+
+    def save(self, path: str, format: Optional[str] = None) -> None:
+        """Writes the trace to a file.
+
+        :param format: ``"chrome"`` or ``"otlp"``, guessed from the file
+            name if omitted (``*.otlp.json`` selects OTLP)
+        """
+        if format is None:
+            format = "otlp" if str(path).endswith(".otlp.json") else "chrome"
+
+        match format:
+            case "chrome":
+                document = self.to_chrome()
+            case "otlp":
+                document = self.to_otlp()
+            case _:
+                raise ValueError(f"Unknown trace format: {format!r}")
+
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(document, fp)
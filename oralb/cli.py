@@ -16,9 +16,14 @@ import cmd
 import shlex
 import traceback
 import asyncio
+import argparse
 
-from oralb.command import COMMAND_TYPES, console
+from oralb.command import COMMAND_TYPES, async_input
 from oralb.exceptions import CLIStop
+from oralb.blesdk.cache import DeviceCache
+from oralb.server import serve
+from oralb.decode import DecodeOptions, STDIN, decode_files, cache_handles
+from oralb.blesdk.capture import resolve_characteristic
 
 
 class OralBCmd:
@@ -29,6 +34,17 @@ class OralBCmd:
         self.commands = [x() for x in COMMAND_TYPES]
         self.parsers = {}
         self.obclient = None
+        self.supervisor = None
+        # operation statistics (disabled by default)
+        self.metrics = None
+        self.tracer = None
+        self.device_cache = DeviceCache.load()
+        # brush advertisements of the last scan (by address)
+        self.advertisements = {}
+        # multi-adapter scanner of the last scan (if enabled)
+        self.scanner = None
+        # watched characteristics (name -> (subscription, printer task))
+        self.watches = {}
         for command in self.commands:
             parser = command.get_parser()
             self.parsers[command.name] = parser
@@ -43,7 +59,7 @@ class OralBCmd:
     async def cmdloop(self):
         stop = None
         while not stop:
-            line = console.input(self.prompt).strip()
+            line = (await async_input.input(self.prompt)).strip()
             if not line:
                 continue
 
@@ -75,14 +91,75 @@ async def amain():
             pass
         except (KeyboardInterrupt, EOFError):
             print()
+        except asyncio.CancelledError:
+            # Ctrl+C cancels the main task now that input is read in the
+            # background. A second Ctrl+C will stop the shell.
+            task = asyncio.current_task()
+            if not task.cancelling():
+                raise
+            task.uncancel()
+            print()
         except CLIStop:
             break
         except Exception:
             traceback.print_exc()
 
 
+def run_decode(parser: argparse.ArgumentParser, argv) -> None:
+    handles = {}
+    for value in argv.handle:
+        handle, _, name = value.partition("=")
+        try:
+            handles[int(handle, 0)] = resolve_characteristic(name)
+        except ValueError:
+            parser.error(f"Invalid handle mapping: {value!r}")
+
+    devices = cache_handles(DeviceCache.load()) if argv.cache else {}
+    options = DecodeOptions(argv.protocol, handles, devices)
+    decode_files(argv.files, options, argv.jobs)
+
+
 def main():
+    parser = argparse.ArgumentParser("oralbcli")
+    sub_parsers = parser.add_subparsers(dest="mode")
+    serve_mod = sub_parsers.add_parser("serve", help="run the gateway daemon")
+    serve_mod.add_argument("-S", "--socket", help="path of the Unix socket")
+    serve_mod.add_argument("--host", help="listen on a TCP host instead")
+    serve_mod.add_argument("--port", type=int, default=8765)
+    serve_mod.add_argument(
+        "--allow-remote",
+        action="store_true",
+        help="allow non-loopback hosts (the API is not authenticated)",
+    )
+    decode_mod = sub_parsers.add_parser(
+        "decode", help="decode captured payloads (hex lines, btsnoop or pcap)"
+    )
+    decode_mod.add_argument(
+        "files", nargs="*", default=[STDIN], help="input files ('-' for stdin)"
+    )
+    decode_mod.add_argument("-j", "--jobs", type=int, help="number of worker processes")
+    decode_mod.add_argument(
+        "-p", "--protocol", type=int, help="protocol version of all payloads"
+    )
+    decode_mod.add_argument(
+        "-H",
+        "--handle",
+        action="append",
+        default=[],
+        metavar="HANDLE=UUID",
+        help="characteristic of an attribute handle",
+    )
+    decode_mod.add_argument(
+        "-c", "--cache", action="store_true", help="use handles of cached devices"
+    )
+    argv = parser.parse_args()
+
     try:
-        asyncio.run(amain())
+        if argv.mode == "serve":
+            asyncio.run(serve(argv.socket, argv.host, argv.port, argv.allow_remote))
+        elif argv.mode == "decode":
+            run_decode(parser, argv)
+        else:
+            asyncio.run(amain())
     except KeyboardInterrupt:
         pass
@@ -15,10 +15,10 @@
 import argparse
 import traceback
 import dataclasses
-import errno
 import functools
 import enum
 import asyncio
+import threading
 
 from rich import print
 from rich.table import Table
@@ -31,13 +31,32 @@ from caterpillar.shortcuts import unpack, F
 from caterpillar.fields import Bytes
 from caterpillar.exception import StructException
 
-from oralb.blesdk.advertise import is_brush, COMPANY_ID
+from oralb.blesdk.advertise import is_brush
+from oralb.blesdk.scanner import parse_advertisement
+from oralb.blesdk.adapters import MultiAdapterScanner
+from oralb.blesdk.proximity import ProximityTracker
+from oralb.blesdk.session import SessionTracker, BrushingSession
 from oralb.blesdk.model import __characteristics__, make_uuid, Control
-from oralb.blesdk.model import CH_CONTROL, CH_SESSION_DATA
-from oralb.blesdk.brush import BrushAdvertisement
+from oralb.blesdk.model import DashboardConfig
+from oralb.blesdk.model import CH_CONTROL
+from oralb.blesdk.brush import BrushType
 from oralb.blesdk.metadata import metadata_models, data_models
 from oralb.blesdk.client import OralBClient, OralBProperty
-from oralb.exceptions import CLIStop
+from oralb.blesdk.harvest import harvest, all_items
+from oralb.blesdk.metrics import StatsSink, MetricsSink, MultiSink, export_prometheus
+from oralb.blesdk.trace import TraceSink
+from oralb.blesdk.dashboard import download_dashboard
+from oralb.blesdk.export import ArrowExporter
+from oralb.blesdk.profile import Profile, ApplyReport, apply_profile, apply_fleet
+from oralb.blesdk.timesync import TimeSync
+from oralb.blesdk.poller import Poller
+from oralb.blesdk.gatt import GattScheduler
+from oralb.blesdk.supervisor import (
+    ConnectionSupervisor,
+    ConnectionState,
+    is_disconnect_error,
+)
+from oralb.exceptions import CLIStop, DashboardError
 
 console = Console()
 
@@ -65,8 +84,102 @@ def print_warn(msg) -> None:
     print(r"\[  [bold yellow]Warn[/]  ] " + msg)
 
 
-def get_input(prompt) -> str:
-    return console.input(r"\[  [bold grey]Input[/] ] " + prompt)
+def load_profile(path: str):
+    try:
+        return Profile.load(path)
+    except (OSError, ValueError, ImportError) as err:
+        print_err(f"Could not load profile {path!r}: {err}")
+
+
+def print_reports(profile, reports) -> None:
+    table = Table(title=f"Profile {profile.name!r}")
+    table.add_column("Address")
+    table.add_column("Drift")
+    table.add_column("Written", justify="center")
+    table.add_column("Commands", justify="center")
+    table.add_column("Status", justify="center")
+    for report in reports:
+        result = report.result
+        if report.error is not None:
+            status = f"[red]{type(report.error).__name__}: {report.error}[/]"
+        elif result is not None and result.mismatches:
+            status = f"[red]mismatch: {', '.join(result.mismatches)}[/]"
+        elif report.errors:
+            status = f"[yellow]unreadable: {', '.join(report.errors)}[/]"
+        elif result is None:
+            status = "[cyan]dry run[/]"
+        else:
+            status = "[green]ok[/]"
+        table.add_row(
+            report.address,
+            ", ".join(report.drift) or "-",
+            str(len(result.written)) if result else "-",
+            str(len(result.commands)) if result else "-",
+            status,
+        )
+    print(table)
+
+
+class AsyncInput:
+    """Reads lines from the console without blocking the event loop.
+
+    A daemon thread performs the blocking read, so keep-alive tasks and
+    notification callbacks keep running while the prompt waits. If the
+    waiting task is cancelled (e.g. by Ctrl+C), the pending read is
+    reused by the next call instead of starting a second reader.
+    """
+
+    def __init__(self) -> None:
+        self._pending: asyncio.Future = None
+
+    async def input(self, prompt: str) -> str:
+        if self._pending is None or self._pending.done():
+            loop = asyncio.get_running_loop()
+            self._pending = loop.create_future()
+            thread = threading.Thread(
+                target=self._read, args=(loop, self._pending, prompt), daemon=True
+            )
+            thread.start()
+        else:
+            console.print(prompt, end="")
+
+        return await asyncio.shield(self._pending)
+
+    @staticmethod
+    def _read(loop, future: asyncio.Future, prompt: str) -> None:
+        def complete(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        try:
+            line = console.input(prompt)
+        except Exception as error:
+            loop.call_soon_threadsafe(complete, None, error)
+        else:
+            loop.call_soon_threadsafe(complete, line, None)
+
+
+async_input = AsyncInput()
+
+
+async def get_input(prompt) -> str:
+    return await async_input.input(r"\[  [bold grey]Input[/] ] " + prompt)
+
+
+def active_sink(shell) -> MetricsSink:
+    sinks = [x for x in (shell.metrics, shell.tracer) if x is not None]
+    if len(sinks) > 1:
+        return MultiSink(*sinks)
+    return sinks[0] if sinks else None
+
+
+def update_sink(shell) -> None:
+    if shell.obclient is not None:
+        shell.obclient.metrics = active_sink(shell)
 
 
 class Command:
@@ -100,6 +213,8 @@ class ExitCommand(Command):
         return parser
 
     async def do_exit(self, shell, argv):
+        if shell.supervisor is not None:
+            await shell.supervisor.stop(disconnect=False)
         if shell.obclient and shell.obclient.is_connected:
             with console.status("Disconnecting from device..."):
                 await shell.obclient.unpair()
@@ -117,14 +232,171 @@ class BLECommand(Command):
         discover_mod = sub_parsers.add_parser("discover")
         discover_mod.add_argument("-T", "--timeout", default=10.0)
         discover_mod.add_argument("-B", "--brushes", action="store_true")
+        discover_mod.add_argument(
+            "-a",
+            "--adapter",
+            action="append",
+            help="scan with this adapter (may be given multiple times)",
+        )
+        discover_mod.add_argument(
+            "-M", "--all-adapters", action="store_true", help="scan with all adapters"
+        )
         discover_mod.set_defaults(fn=self.discover)
+
+        nearby_mod = sub_parsers.add_parser("nearby")
+        nearby_mod.add_argument("-n", "--count", type=int, default=5)
+        nearby_mod.add_argument("-T", "--timeout", type=float, default=5.0)
+        nearby_mod.add_argument(
+            "--smoothing", choices=["ewma", "kalman"], default="ewma"
+        )
+        nearby_mod.set_defaults(fn=self.nearby)
+
+        sessions_mod = sub_parsers.add_parser("sessions")
+        sessions_mod.add_argument("-T", "--timeout", type=float, default=60.0)
+        sessions_mod.add_argument("-O", "--output", help="export sessions to FILE")
+        sessions_mod.add_argument(
+            "-A", "--advertisements", help="export all brush advertisements to FILE"
+        )
+        sessions_mod.set_defaults(fn=self.sessions)
+
+        apply_mod = sub_parsers.add_parser("apply")
+        apply_mod.add_argument("profile", help="JSON or YAML profile")
+        apply_mod.add_argument("addresses", nargs="+")
+        apply_mod.add_argument(
+            "-j", "--jobs", type=int, default=4, help="simultaneous connections"
+        )
+        apply_mod.add_argument(
+            "--dry-run", action="store_true", help="only report the drift"
+        )
+        apply_mod.add_argument("--no-verify", action="store_true")
+        apply_mod.set_defaults(fn=self.apply)
         return parser
 
+    async def apply(self, shell, argv: argparse.Namespace) -> None:
+        profile = load_profile(argv.profile)
+        if profile is None:
+            return
+
+        count = len(argv.addresses)
+        with console.status(f"Applying {profile.name!r} to {count} brushes..."):
+            reports = await apply_fleet(
+                profile,
+                argv.addresses,
+                concurrency=argv.jobs,
+                dry_run=argv.dry_run,
+                verify=not argv.no_verify,
+            )
+        print_reports(profile, reports)
+        failed = sum(not report.ok for report in reports)
+        if failed:
+            print_warn(f"{failed} of {count} brushes failed")
+        else:
+            print_ok(f"Applied profile to {count} brushes")
+
+    async def nearby(self, shell, argv: argparse.Namespace) -> None:
+        tracker = ProximityTracker(smoothing=argv.smoothing)
+        callback = tracker.detection_callback(is_brush)
+        try:
+            with console.status(f"Tracking brushes for {argv.timeout:.0f} seconds..."):
+                if shell.scanner is not None:
+                    shell.scanner.callbacks.append(callback)
+                    try:
+                        await shell.scanner.discover(argv.timeout)
+                    finally:
+                        shell.scanner.callbacks.remove(callback)
+                else:
+                    async with BleakScanner(detection_callback=callback):
+                        await asyncio.sleep(argv.timeout)
+        except exc.BleakError as error:
+            print_err(f"[bold]{type(error).__name__}: [/] {str(error)}")
+            return
+
+        nearest = tracker.nearest(argv.count)
+        if not nearest:
+            print_warn("Could not locate any brushes!")
+            return
+
+        table = Table(title=f"Nearest {len(nearest)} brushes")
+        table.add_column("Address")
+        table.add_column("rssi", justify="center")
+        table.add_column("Last rssi", justify="center")
+        table.add_column("Adv/s", justify="center")
+        table.add_column("Count", justify="center")
+        for entry in nearest:
+            table.add_row(
+                entry.address,
+                f"[cyan]{entry.rssi:.1f}[/]",
+                str(entry.raw_rssi),
+                f"{entry.rate:.1f}",
+                str(entry.count),
+            )
+        print(table)
+
+    async def sessions(self, shell, argv: argparse.Namespace) -> None:
+        try:
+            sessions_out = argv.output and ArrowExporter(argv.output, "session")
+            adv_out = argv.advertisements and ArrowExporter(
+                argv.advertisements, "advertisement"
+            )
+        except (ImportError, OSError) as error:
+            print_err(f"[bold]{type(error).__name__}: [/] {str(error)}")
+            return
+
+        def on_session(session: BrushingSession) -> None:
+            quadrants = ", ".join(
+                f"Q{quadrant + 1}: {seconds:.0f}s"
+                for quadrant, seconds in sorted(session.quadrant_times.items())
+            )
+            print_ok(
+                f"Session of {session.address!r}: {session.brushing_time}s brushing "
+                f"time, {session.high_pressure_count} high pressure events"
+                + (f" ({quadrants})" if quadrants else "")
+            )
+            if sessions_out:
+                sessions_out.write(session, session.address, session.end)
+
+        tracker = SessionTracker(on_session=on_session)
+        callback = tracker.detection_callback()
+        if adv_out:
+
+            def on_detection(device, adv) -> None:
+                advertisement = parse_advertisement(adv)
+                if advertisement is not None:
+                    adv_out.write(advertisement, device.address)
+                    tracker.feed(device.address, advertisement)
+
+            callback = on_detection
+
+        scanner = BleakScanner(detection_callback=callback)
+        print_info(f"Tracking brushing sessions for {argv.timeout:.0f} seconds...")
+        try:
+            async with scanner:
+                for _ in range(int(argv.timeout)):
+                    await asyncio.sleep(1)
+                    tracker.expire()
+        except exc.BleakError as error:
+            print_err(f"[bold]{type(error).__name__}: [/] {str(error)}")
+        tracker.flush()
+        for exporter in (sessions_out, adv_out):
+            if exporter:
+                exporter.close()
+                print_ok(f"Exported {exporter.rows_written} rows to {exporter.path!r}")
+
     async def discover(self, shell, argv: argparse.Namespace) -> None:
-        timeout = argv.timeout
-        with console.status("Starting Bluetooth (LE) scan for 5 seconds..."):
+        timeout = float(argv.timeout)
+        scanner = None
+        if argv.adapter or argv.all_adapters:
+            scanner = MultiAdapterScanner(argv.adapter)
+            scan = scanner.discover(timeout)
+        else:
+            scan = BleakScanner.discover(timeout=timeout, return_adv=True)
+        # connections are only spread over adapters of the last scan
+        shell.scanner = scanner
+
+        status = f"Starting Bluetooth (LE) scan for {timeout:.0f} seconds..."
+        with console.status(status):
             try:
-                devices = await BleakScanner.discover(timeout=timeout, return_adv=True)
+                devices = await scan
             except TimeoutError:
                 print_err(
                     (
@@ -144,6 +416,8 @@ class BLECommand(Command):
         table.add_column("Name", justify="center")
         table.add_column("rssi", justify="center")
         table.add_column("isBrush", justify="center")
+        if scanner is not None:
+            table.add_column("Adapter", justify="center")
 
         brushes = []
         with Live(table, refresh_per_second=4):
@@ -152,12 +426,12 @@ class BLECommand(Command):
                 if argv.brushes and not brush:
                     continue
 
-                table.add_row(
-                    str(device.address),
-                    str(device.name),
-                    f"[cyan]{adv.rssi}[/]",
-                    str(brush),
-                )
+                row = [str(device.address), str(device.name), f"[cyan]{adv.rssi}[/]"]
+                row.append(str(brush))
+                if scanner is not None:
+                    sighting = scanner.best(device.address)
+                    row.append(str(sighting.adapter) if sighting else "-")
+                table.add_row(*row)
                 if brush:
                     brushes.append((device, adv))
 
@@ -171,11 +445,22 @@ class BLECommand(Command):
             print()  # extra new line for style purposes
             print(device)
             print("-" * len(str(device)))
-            print(unpack(BrushAdvertisement, adv.manufacturer_data[COMPANY_ID]))
+            advertisement = parse_advertisement(adv)
+            if advertisement is None:
+                print_warn("Invalid advertisement data!")
+                continue
+
+            print(advertisement)
+            shell.advertisements[device.address.upper()] = advertisement
+            if shell.device_cache.observe(device.address, advertisement):
+                print_info("Firmware changed, dropped cached device data.")
+
+        shell.device_cache.save()
 
 
 name2characteristic = {y.__cname__: y for x, y in __characteristics__.items()}
 cid2characteristic = {x[4:8]: y for x, y in __characteristics__.items()}
+name2uuid = {y.__cname__: x for x, y in __characteristics__.items()}
 
 
 @command
@@ -199,12 +484,49 @@ class DeviceManagerCommand(Command):
         mod_connect.set_defaults(fn=self.do_connect)
         mod_extend = sub_parsers.add_parser("extend-connection")
         mod_extend.set_defaults(fn=self.do_extend_connection)
+        mod_status = sub_parsers.add_parser("status")
+        mod_status.set_defaults(fn=self.show_connection)
+
+        stats_mod = sub_parsers.add_parser("stats")
+        stats_group = stats_mod.add_mutually_exclusive_group()
+        stats_group.add_argument("--enable", action="store_true")
+        stats_group.add_argument("--disable", action="store_true")
+        stats_mod.add_argument("--reset", action="store_true")
+        stats_mod.add_argument("--prometheus", metavar="FILE")
+        stats_mod.set_defaults(fn=self.show_stats)
+
+        queue_mod = sub_parsers.add_parser("queue")
+        queue_mod.set_defaults(fn=self.show_queue)
+
+        trace_mod = sub_parsers.add_parser("trace")
+        trace_subs = trace_mod.add_subparsers()
+        trace_start = trace_subs.add_parser("start")
+        trace_start.set_defaults(fn=self.trace_start)
+        trace_stop = trace_subs.add_parser("stop")
+        trace_stop.add_argument("file", nargs="?")
+        trace_stop.add_argument("--format", choices=["chrome", "otlp"])
+        trace_stop.set_defaults(fn=self.trace_stop)
 
         get_mod = sub_parsers.add_parser("getchar")
         get_mod.add_argument("name")
         get_mod.add_argument("-R", "--raw", action="store_true")
         get_mod.set_defaults(fn=self.get_char)
 
+        watch_mod = sub_parsers.add_parser("watch")
+        watch_mod.add_argument("name")
+        watch_mod.add_argument("-R", "--raw", action="store_true")
+        watch_mod.add_argument(
+            "-P",
+            "--poll",
+            type=float,
+            metavar="SECONDS",
+            help="read the value periodically instead of subscribing",
+        )
+        watch_mod.set_defaults(fn=self.watch)
+        unwatch_mod = sub_parsers.add_parser("unwatch")
+        unwatch_mod.add_argument("name", nargs="?")
+        unwatch_mod.set_defaults(fn=self.unwatch)
+
         list_mod = sub_parsers.add_parser("list")
         list_parsers = list_mod.add_subparsers()
         list_chars = list_parsers.add_parser("chars")
@@ -226,6 +548,41 @@ class DeviceManagerCommand(Command):
             self.build_parser(model_parser, model_ty)
         put_mod.set_defaults(fn=self.put_char)
 
+        profile_mod = sub_parsers.add_parser("profile")
+        profile_mod.add_argument("path", help="JSON or YAML profile")
+        profile_mod.add_argument(
+            "--dry-run", action="store_true", help="only report the drift"
+        )
+        profile_mod.add_argument("--no-verify", action="store_true")
+        profile_mod.set_defaults(fn=self.apply_profile)
+
+        time_mod = sub_parsers.add_parser("sync-time")
+        time_mod.add_argument(
+            "-f", "--force", action="store_true", help="write the time in any case"
+        )
+        time_mod.add_argument("-n", "--samples", type=int, default=3)
+        time_mod.set_defaults(fn=self.sync_time)
+
+        cache_mod = sub_parsers.add_parser("cache")
+        cache_subs = cache_mod.add_subparsers()
+        cache_show = cache_subs.add_parser("show")
+        cache_show.set_defaults(fn=self.cache_show)
+        cache_clear = cache_subs.add_parser("clear")
+        cache_clear.add_argument("address", nargs="?")
+        cache_clear.set_defaults(fn=self.cache_clear)
+
+        dashboard_mod = sub_parsers.add_parser("dashboard")
+        dashboard_mod.add_argument("session_id", type=int)
+        dashboard_mod.add_argument(
+            "-D",
+            "--divider",
+            choices=["full", "half", "quarter"],
+            default="full",
+            help="resolution of the transferred data",
+        )
+        dashboard_mod.add_argument("-O", "--output", help="save records as .npy file")
+        dashboard_mod.set_defaults(fn=self.download_dashboard)
+
         control_mod = sub_parsers.add_parser("ctl", aliases=["control"])
         control_subs = control_mod.add_subparsers()
         control_read_meta = control_subs.add_parser("read-meta")
@@ -234,8 +591,84 @@ class DeviceManagerCommand(Command):
         control_read_data = control_subs.add_parser("read-data")
         control_read_data.add_argument("name")
         control_read_data.set_defaults(fn=self.control_read_data)
+        control_harvest = control_subs.add_parser("harvest")
+        control_harvest.add_argument("--no-cache", action="store_true")
+        control_harvest.set_defaults(fn=self.control_harvest)
         return parser
 
+    @requires_connection
+    async def apply_profile(self, shell, argv):
+        profile = load_profile(argv.path)
+        if profile is None:
+            return
+
+        obclient: OralBClient = shell.obclient
+        try:
+            with console.status(f"Applying {profile.name!r}..."):
+                report = await apply_profile(
+                    profile, obclient, argv.dry_run, not argv.no_verify
+                )
+        except (exc.BleakError, TimeoutError) as err:
+            report = ApplyReport(obclient.address, error=err)
+        print_reports(profile, [report])
+
+    @requires_connection
+    async def sync_time(self, shell, argv):
+        time_sync = TimeSync.load(samples=argv.samples)
+        try:
+            with console.status("Synchronizing clock..."):
+                report = await time_sync.sync(shell.obclient, argv.force)
+        except (exc.BleakError, TimeoutError) as err:
+            print_err(f"[bold]{type(err).__name__}: [/] {str(err)}")
+            return
+        finally:
+            time_sync.save()
+
+        print_info(
+            f"Clock offset: {report.offset:+.2f}s (rtt: {report.rtt * 1000:.0f}ms)"
+        )
+        if report.corrected:
+            print_ok(f"Clock corrected, remaining offset: {report.residual:+.2f}s")
+        clock = time_sync.clock(report.address)
+        if len(clock.history) > 1:
+            print_info(f"Estimated drift: {report.ppm:+.1f} ppm")
+
+    async def cache_show(self, shell, argv):
+        cache = shell.device_cache
+        print_info(f"Device cache at {str(cache.path)!r}:\n")
+        table = Table()
+        table.add_column("Address")
+        table.add_column("ID", justify="center")
+        table.add_column("Type", justify="center")
+        table.add_column("Protocol", justify="center")
+        table.add_column("Firmware", justify="center")
+        table.add_column("Items", justify="center")
+        for record in cache.records.values():
+            brush_type = "-"
+            if record.brush_type is not None:
+                try:
+                    brush_type = BrushType(record.brush_type).name
+                except ValueError:
+                    brush_type = str(record.brush_type)
+            table.add_row(
+                record.address,
+                str(record.device_id),
+                brush_type,
+                str(record.protocol),
+                str(record.firmware),
+                str(len(cache.get(record.device_id))),
+            )
+        print(table)
+
+    async def cache_clear(self, shell, argv):
+        cache = shell.device_cache
+        if argv.address:
+            cache.forget(argv.address)
+        else:
+            cache.invalidate()
+        cache.save()
+        print_ok("Cleared device cache")
+
     def _callback(self, shell):
         def real_callback(characteristic, data):
             print(data)
@@ -255,13 +688,21 @@ class DeviceManagerCommand(Command):
         except Exception as err:
             print_err(f"{type(err).__name__}: {err}")
 
-    async def schedule_extend_connection(self, shell):
-        await asyncio.sleep(25)
-        await self.do_extend_connection(shell, None)
+    def _on_state(self, supervisor: ConnectionSupervisor) -> None:
+        state = supervisor.state
+        if state == ConnectionState.BACKOFF:
+            error = supervisor.last_error
+            print_info(
+                f"Connection attempt failed ({type(error).__name__}: {error}), "
+                f"retrying in {supervisor.next_delay:.1f}s..."
+            )
+        elif state == ConnectionState.DISCONNECTED:
+            print_info("Device disconnected, reconnecting...")
 
     async def do_connect(self, shell, argv):
         if shell.obclient is None:
             obclient = OralBClient(None)
+            obclient.metrics = active_sink(shell)
         else:
             # In this case, the BleakClient is already assigned
             # to the right address.
@@ -274,61 +715,108 @@ class DeviceManagerCommand(Command):
             if obclient.address is None:
                 print_info("Device address is not set, please enter address below!")
                 # Here, we have to request the device's address first
-                address = get_input("[bold]Device: [/]")
+                address = await get_input("[bold]Device: [/]")
                 if not address:
                     return
 
+        supervisor: ConnectionSupervisor = shell.supervisor
+        if supervisor is None or supervisor.client is not obclient:
+            if supervisor is not None:
+                # stops the keep-alive of the previous client
+                try:
+                    await supervisor.stop()
+                except (OSError, exc.BleakError):
+                    pass
+                shell.supervisor = None
+            supervisor = ConnectionSupervisor(
+                obclient, unpair_first=True, on_state=self._on_state
+            )
+
+        if shell.scanner is not None:
+            # spread connections over all adapters that received the device
+            if obclient.address and obclient.address.upper() != address.upper():
+                shell.scanner.release(obclient.address)
+            obclient.adapter = shell.scanner.acquire(address)
+        obclient.scheduler = GattScheduler.for_adapter(obclient.adapter)
+
         msg = "Trying to establish a connection to device..."
         if shell.obclient is not None:
             msg = "Reconnecting to device..."
         try:
             with console.status(msg):
-                if obclient.address:
-                    await obclient.unpair()
-
-                await obclient.connect(address=address)
-            with console.status("Pairing..."):
-                await obclient.pair()
-                # If this command throws an error, we have to
-                # reconnect to the device (cleanup connection)
-                # await obclient.write(
-                #     CH_CONTROL,
-                #     Control.extend_connection(255),
-                #     response=True,
-                # )
+                await supervisor.start(
+                    address=address,
+                    advertisement=shell.advertisements.get(address.upper()),
+                )
         except TimeoutError:
             print_err("Timout error while connecting to device, please try again!")
-        except OSError as osexc:
-            print_err(f"OS related error: {str(osexc)}")
         except exc.BleakDeviceNotFoundError:
             print_err(f"Device with address {obclient.address!r} not found!")
+        except OSError as osexc:
+            print_err(f"OS related error: {str(osexc)}")
         except exc.BleakError as err:
-            if str(err).endswith("Unreachable"):
-                # reconnect
-                shell.obclient = obclient
-                return await self.do_connect(shell, argv)
+            print_err(f"[bold]{type(err).__name__}: [/] {str(err)}")
         except Exception as error:
             print_err(f"[bold]{type(error).__name__}: [/] {str(error)}")
         else:
             shell.obclient = obclient
+            shell.supervisor = supervisor
             print_ok(f"Connected to {obclient.address!r}")
+            if obclient.advertisement is not None:
+                print_info(
+                    f"Detected {obclient.brush_type.name} using protocol "
+                    f"{obclient.protocol.name}"
+                )
+            cache = shell.device_cache
+            if obclient.advertisement is not None:
+                # drops stale records before they are applied
+                if cache.observe(obclient.address, obclient.advertisement):
+                    print_info("Firmware changed, dropped cached device data.")
+            record = cache.get_record(obclient.address)
+            if record is not None:
+                # protocol and identity are known, skip the discovery reads
+                record.apply(obclient)
             try:
-                with console.status("Configuring extended connection..."):
-                    await self.do_extend_connection(shell, argv)
-                    loop = asyncio.get_event_loop()
-                    loop.create_task(self.schedule_extend_connection(shell))
-            except (OSError, exc.BleakError):
-                print_info("Could not connect fully to device, reconnecting...")
-                return await self.do_connect(shell, argv)
+                with console.status("Updating device cache..."):
+                    await shell.device_cache.learn(obclient)
+                    shell.device_cache.save()
+            except (OSError, exc.BleakError, StructException) as err:
+                print_warn(f"Could not update device cache: {err}")
             return True
 
-    @requires_connection
-    async def get_char(self, shell, argv):
-        name = argv.name
-        obclient: OralBClient = shell.obclient
-        if name in name2characteristic:
+    async def do_reconnect(self, shell) -> bool:
+        supervisor: ConnectionSupervisor = shell.supervisor
+        if supervisor is None:
+            return False
+
+        with console.status("Reconnecting to device..."):
+            if await supervisor.reconnect():
+                return True
+
+        print_err(f"Could not reconnect: {supervisor.last_error}")
+        return False
+
+    async def show_connection(self, shell, argv):
+        supervisor: ConnectionSupervisor = shell.supervisor
+        if supervisor is None:
+            print_warn("Not connected to any device.")
+            return
+
+        metrics = supervisor.metrics
+        print_info(f"Connection to {supervisor.client.address!r}:\n")
+        table = Table()
+        table.add_column("Metric")
+        table.add_column("Value", justify="right")
+        table.add_row("state", supervisor.state.value)
+        for field in dataclasses.fields(metrics):
+            table.add_row(field.name, str(getattr(metrics, field.name)))
+        table.add_row("mean_reconnect_time", str(metrics.mean_reconnect_time))
+        print(table)
+
+    def resolve_property(self, obclient, name: str, raw=False) -> OralBProperty:
+        if name in name2characteristic and not raw:
             try:
-                obproperty = getattr(obclient, name)
+                return getattr(obclient, name)
             except AttributeError:
                 print_err(
                     (
@@ -337,16 +825,179 @@ class DeviceManagerCommand(Command):
                     )
                 )
                 return
+
         # The name specifies a uuid or short uuid
+        uuid = name
+        model = F(Bytes(...))
+        if name in name2characteristic:
+            uuid = name2uuid[name]
+        elif name in cid2characteristic or len(name) == 4:
+            uuid = make_uuid(name)
+
+        if not raw:
+            model = __characteristics__.get(uuid, model)
+        return OralBProperty(obclient, uuid, model)
+
+    @requires_connection
+    async def watch(self, shell, argv):
+        obclient: OralBClient = shell.obclient
+        obproperty = self.resolve_property(obclient, argv.name, argv.raw)
+        if obproperty is None:
+            return
+
+        if argv.name in shell.watches:
+            print_warn(f"Already watching {argv.name!r}")
+            return
+
+        if argv.poll:
+            poller = Poller()
+            poller.add(obproperty, argv.poll)
+            task = asyncio.create_task(self._print_watch(argv.name, poller))
+            shell.watches[argv.name] = (poller, task)
+            print_ok(f"Polling {obproperty.name!r}, use 'dm unwatch' to stop.")
+            return
+
+        try:
+            subscription = await obclient.hub.subscribe(obproperty)
+        except (exc.BleakError, OSError) as err:
+            print_err(f"Could not subscribe to {obproperty.name!r}: {err}")
         else:
-            uuid = name
-            model = F(Bytes(...))
-            if name in cid2characteristic or len(name) == 4:
-                uuid = make_uuid(name)
-
-            if not argv.raw:
-                model = __characteristics__.get(uuid, model)
-            obproperty = OralBProperty(obclient, uuid, model)
+            task = asyncio.create_task(self._print_watch(argv.name, subscription))
+            shell.watches[argv.name] = (subscription, task)
+            print_ok(f"Watching {obproperty.name!r}, use 'dm unwatch' to stop.")
+
+    async def _print_watch(self, name: str, source) -> None:
+        # notifications and polled changes both carry the new value
+        async for item in source:
+            print(rf"\[  [bold magenta]Watch[/] ] {name}: {item.value}")
+
+    async def unwatch(self, shell, argv):
+        names = [argv.name] if argv.name else list(shell.watches)
+        for name in names:
+            subscription, _ = shell.watches.pop(name, (None, None))
+            if subscription is None:
+                print_warn(f"Not watching {name!r}")
+                continue
+            if isinstance(subscription, Poller):
+                subscription.close()
+                print_ok(f"Stopped polling {name!r}")
+                continue
+            try:
+                await subscription.close()
+            except (exc.BleakError, OSError) as err:
+                print_err(f"Could not unsubscribe from {name!r}: {err}")
+            else:
+                print_ok(f"Stopped watching {subscription.characteristic!r}")
+
+    async def show_queue(self, shell, argv):
+        scheduler = shell.obclient.scheduler if shell.obclient else None
+        if scheduler is None:
+            print_warn("No GATT scheduler in use, connect to a device first.")
+            return
+
+        table = Table(title=f"GATT queue ({scheduler.running} running)")
+        table.add_column("Priority")
+        table.add_column("Queued", justify="center")
+        table.add_column("Max", justify="center")
+        table.add_column("Started", justify="center")
+        table.add_column("Mean wait", justify="center")
+        table.add_column("Max wait", justify="center")
+        for priority, stats in scheduler.stats.items():
+            table.add_row(
+                priority.name.lower(),
+                str(stats.depth),
+                str(stats.max_depth),
+                str(stats.started),
+                f"{stats.mean_wait * 1000:.1f}ms",
+                f"{stats.max_wait * 1000:.1f}ms",
+            )
+        print(table)
+
+    async def show_stats(self, shell, argv):
+        if argv.enable:
+            shell.metrics = shell.metrics or StatsSink()
+            update_sink(shell)
+            print_ok("Enabled operation statistics")
+            return
+
+        if argv.disable:
+            shell.metrics = None
+            update_sink(shell)
+            print_ok("Disabled operation statistics")
+            return
+
+        stats: StatsSink = shell.metrics
+        if stats is None:
+            print_warn("Statistics are disabled, use 'dm stats --enable'.")
+            return
+
+        if argv.prometheus:
+            export_prometheus(stats, argv.prometheus)
+            print_ok(f"Exported statistics to {argv.prometheus!r}")
+
+        table = Table(title="Operation latency (ms)")
+        for column in ("Operation", "Device", "Target"):
+            table.add_column(column)
+        for column in ("Count", "Mean", "Min", "p50", "p95", "Max"):
+            table.add_column(column, justify="right")
+        for (op, device, target), histogram in sorted(stats.histograms.items()):
+            values = (
+                histogram.mean,
+                histogram.min,
+                histogram.quantile(0.5),
+                histogram.quantile(0.95),
+                histogram.max,
+            )
+            table.add_row(
+                op,
+                device,
+                target,
+                str(histogram.count),
+                *(f"{value * 1000:.2f}" for value in values),
+            )
+        print(table)
+
+        if stats.counters:
+            table = Table(title="Events")
+            for column in ("Event", "Device", "Target", "Count", "Rate (1/s)"):
+                table.add_column(column)
+            for key, count in sorted(stats.counters.items()):
+                rate = stats.rate(key)
+                table.add_row(
+                    *key, str(count), f"{rate:.1f}" if rate is not None else "-"
+                )
+            print(table)
+
+        if argv.reset:
+            stats.reset()
+
+    async def trace_start(self, shell, argv):
+        shell.tracer = shell.tracer or TraceSink()
+        update_sink(shell)
+        print_ok("Tracing all BLE operations, use 'dm trace stop FILE' to save.")
+
+    async def trace_stop(self, shell, argv):
+        tracer: TraceSink = shell.tracer
+        if tracer is None:
+            print_warn("Tracing is not active.")
+            return
+
+        shell.tracer = None
+        update_sink(shell)
+        if argv.file:
+            try:
+                tracer.save(argv.file, argv.format)
+            except OSError as err:
+                print_err(f"Could not save trace: {err}")
+                return
+            print_ok(f"Saved {len(tracer.spans)} spans to {argv.file!r}")
+
+    @requires_connection
+    async def get_char(self, shell, argv, retry=True):
+        obclient: OralBClient = shell.obclient
+        obproperty = self.resolve_property(obclient, argv.name, argv.raw)
+        if obproperty is None:
+            return
         try:
             with console.status("Reading value..."):
                 value = await obproperty._get()
@@ -354,24 +1005,17 @@ class DeviceManagerCommand(Command):
             print_err("Timeout error during get_char!")
         except StructException as err:
             print_err(f"Could not parse input: {str(err)}")
-        except exc.BleakError as be:
-            if str(be).endswith("Unreachable"):
-                print_info("Device disconnected (unreachable)!")
-                await obclient.unpair()
-                if await self.do_connect(shell, argv):
-                    return await self.get_char(shell, argv)
-            print_err(str(be))
-        except OSError as err:
-            if err.errno == errno.EINVAL:
-                # windows closed connection
-                if len(err.args) == 5 and list(err.args)[3] == -0x7FFFFFED:
-                    print_info("Device disconnected (object closed)!")
-                    await obclient.unpair()
-                    if await self.do_connect(shell, argv):
-                        return await self.get_char(shell, argv)
-            else:
+        except (exc.BleakError, OSError) as err:
+            if is_disconnect_error(err) and retry:
+                print_info("Device disconnected!")
+                # only one retry, the supervisor already backs off
+                if await self.do_reconnect(shell):
+                    return await self.get_char(shell, argv, retry=False)
+            elif isinstance(err, OSError):
                 print({"no": err.errno, "args": err.args, "str": err.strerror})
                 print_err(f"[bold]OSError: [/] {err}")
+            else:
+                print_err(str(err))
         except Exception as err:
             print_err(f"{type(err).__name__}: {err}")
             traceback.print_exc()
@@ -507,6 +1151,73 @@ class DeviceManagerCommand(Command):
             shell, argv, Control.DataRead, Control.read_data, data_models()
         )
 
+    @requires_connection
+    async def download_dashboard(self, shell, argv):
+        divider = DashboardConfig.Divider[f"{argv.divider.upper()}_RESOLUTION"]
+        try:
+            with console.status("Downloading session..."):
+                session = await download_dashboard(
+                    shell.obclient, argv.session_id, divider
+                )
+        except DashboardError as err:
+            print_err(str(err))
+            return
+        except TimeoutError:
+            print_err("Transfer stalled, no package received in time!")
+            return
+        except exc.BleakError as err:
+            print_err(str(err))
+            return
+
+        print_ok(
+            f"Received {len(session.records)} records of session {session.session_id} "
+            f"({session.missing} missing in {len(session.gaps)} gaps)"
+        )
+        if argv.output:
+            try:
+                import numpy as np
+
+                np.save(argv.output, session.to_numpy())
+            except (ImportError, OSError) as err:
+                print_err(f"Could not save records: {err}")
+            else:
+                print_ok(f"Saved records to {argv.output!r}")
+
+    @requires_connection
+    async def control_harvest(self, shell, argv):
+        obclient: OralBClient = shell.obclient
+        cache = None if argv.no_cache else shell.device_cache
+        try:
+            with console.status("Reading metadata and service data..."):
+                report = await harvest(obclient, cache)
+                if cache is not None:
+                    cache.save()
+        except TimeoutError:
+            print_err("Timeout error while reading the device ID!")
+            return
+        except exc.BleakError as err:
+            print_err(str(err))
+            return
+
+        table = Table(title=f"Device {report.device_id}")
+        table.add_column("Item")
+        table.add_column("Value")
+        table.add_column("Cached", justify="center")
+        for key in all_items():
+            kind, value = key
+            mapping = Control.METADATA if kind == "meta" else Control.DataRead
+            if key in report.errors:
+                text = f"[red]{report.errors[key]}[/]"
+            else:
+                text = repr(report.values.get(key))
+            table.add_row(
+                f"{kind}:{mapping(value).name.lower()}",
+                text,
+                str(key in report.cached),
+            )
+        print_ok(f"Harvested {len(report.values)} items:\n")
+        print(table)
+
     async def read_data(self, shell, argv, mapping, factory, models) -> None:
         obclient: OralBClient = shell.obclient
         name = argv.name
@@ -520,9 +1231,10 @@ class DeviceManagerCommand(Command):
                 print_err(f"Unknown metadata selected: {name!r}")
                 return
         try:
-            data: bytes = await obclient.write_read_on(
-                CH_CONTROL, factory(value), CH_SESSION_DATA
-            )
+            with console.status("Reading value..."):
+                data: bytes = await obclient.control.request(factory(value))
+        except TimeoutError:
+            print_err("Timeout error while waiting for a response!")
         except exc.BleakError as err:
             msg = str(err)
             # if err.endswith("Access Denied"):
@@ -0,0 +1,136 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import sys
+import json
+import concurrent.futures
+
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, TextIO
+
+from oralb.blesdk.advertise import ProtocolVersion
+from oralb.blesdk.cache import DeviceCache
+from oralb.blesdk.capture import Decoded, HciParser, decode_capture
+from oralb.blesdk.capture import resolve_characteristic
+from oralb.blesdk.serialize import to_json
+
+#: reads from stdin
+STDIN = "-"
+
+
+class DecodeOptions(NamedTuple):
+    """Settings shared by all decoded files (passed to the workers)."""
+
+    protocol: Optional[int] = None
+    #: attribute handle to UUID mapping of all connections
+    handles: Optional[Dict[int, str]] = None
+    #: handle mappings per device address (e.g. from the device cache)
+    devices: Optional[Dict[str, Dict[int, str]]] = None
+
+    def parser(self) -> HciParser:
+        return HciParser(self.handles, self.devices)
+
+
+def to_record(source: str, decoded: Decoded) -> dict:
+    """Converts a decoded payload into a JSON object."""
+    payload = decoded.payload
+    return {
+        "source": source,
+        "timestamp": payload.timestamp,
+        "address": payload.address,
+        "kind": payload.kind,
+        "handle": payload.handle,
+        "uuid": payload.characteristic,
+        "name": decoded.name,
+        "data": payload.data.hex(),
+        "value": to_json(decoded.value),
+        "error": decoded.error,
+    }
+
+
+def decode_lines(stream, source: str, options: DecodeOptions) -> Iterator[str]:
+    """Decodes a binary stream into JSON lines.
+
+    Errors that stop the file (e.g. an unsupported link type or a
+    malformed line) are reported as a final line with an ``error`` field.
+    """
+    protocol = None
+    if options.protocol is not None:
+        protocol = ProtocolVersion(options.protocol)
+    try:
+        for decoded in decode_capture(stream, protocol, options.parser()):
+            yield json.dumps(to_record(source, decoded))
+    except (ValueError, OSError) as err:
+        error = f"{type(err).__name__}: {err}"
+        yield json.dumps({"source": source, "error": error})
+
+
+def iter_file(path: str, options: DecodeOptions) -> Iterator[str]:
+    """Decodes a file (or stdin) into JSON lines."""
+    if path == STDIN:
+        yield from decode_lines(sys.stdin.buffer, "<stdin>", options)
+        return
+    try:
+        stream = open(path, "rb")
+    except OSError as err:
+        yield json.dumps({"source": path, "error": f"{type(err).__name__}: {err}"})
+        return
+    with stream:
+        yield from decode_lines(stream, path, options)
+
+
+def decode_file(path: str, options: DecodeOptions) -> List[str]:
+    """Decodes a whole file (runs in a worker process)."""
+    return list(iter_file(path, options))
+
+
+def cache_handles(cache: DeviceCache) -> Dict[str, Dict[int, str]]:
+    """Returns the handle mappings of all cached devices."""
+    devices = {}
+    for address, record in cache.records.items():
+        devices[address] = {
+            handle: resolve_characteristic(uuid)
+            for uuid, handle in record.handles.items()
+        }
+    return devices
+
+
+def decode_files(
+    paths: Sequence[str],
+    options: DecodeOptions,
+    jobs: Optional[int] = None,
+    out: Optional[TextIO] = None,
+) -> None:
+    """Decodes files and writes one JSON object per payload.
+
+    Files are decoded in parallel by a process pool of *jobs* workers (all
+    cores by default). The output of every file is written as a block, in
+    the order of *paths*. A single file or stdin (``-``) is decoded in
+    this process and streamed line by line.
+    """
+    out = out or sys.stdout
+    jobs = jobs or os.cpu_count() or 1
+    if len(paths) == 1 or jobs == 1 or STDIN in paths:
+        for path in paths:
+            for line in iter_file(path, options):
+                out.write(line + "\n")
+            out.flush()
+        return
+
+    workers = min(jobs, len(paths))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        results = executor.map(decode_file, paths, [options] * len(paths))
+        for lines in results:
+            out.writelines(line + "\n" for line in lines)
+            out.flush()
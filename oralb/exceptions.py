@@ -20,3 +20,13 @@ class InvalidChecksum(Exception):
 
 class CLIStop(Exception):
     pass
+
+
+class DashboardError(Exception):
+    pass
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
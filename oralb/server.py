@@ -0,0 +1,508 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import stat
+import socket
+import ipaddress
+import json
+import asyncio
+import inspect
+import itertools
+import dataclasses
+import tempfile
+
+from typing import Dict, Optional, Set, Tuple
+
+from bleak import exc
+from caterpillar.exception import StructException
+
+from oralb.exceptions import RPCError
+from oralb.blesdk.model import __characteristics__, make_uuid, Control
+from oralb.blesdk.client import OralBClient, OralBProperty
+from oralb.blesdk.cache import DeviceCache
+from oralb.blesdk.scanner import discover_brushes
+from oralb.blesdk.supervisor import ConnectionSupervisor
+from oralb.blesdk.hub import DropPolicy, Subscription
+from oralb.blesdk.timesync import TimeSync
+from oralb.blesdk.gatt import GattScheduler
+from oralb.blesdk.serialize import to_json
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+#: errors reported by the device or the Bluetooth stack
+DEVICE_ERROR = -32000
+
+#: maximum size of a single request line (in bytes)
+REQUEST_LIMIT = 2**16
+
+
+def default_socket_path() -> str:
+    """Returns ``$XDG_RUNTIME_DIR/oralb.sock`` (or a per-user temp path)."""
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "oralb.sock")
+    return os.path.join(tempfile.gettempdir(), f"oralb-{os.getuid()}.sock")
+
+
+def resolve_uuid(name: str) -> str:
+    """Resolves a characteristic name (e.g. ``pressure``), short UUID
+    (``FF0B``) or full UUID."""
+    for uuid, model in __characteristics__.items():
+        if model.__cname__ == name:
+            return uuid
+    if len(name) == 4:
+        return make_uuid(name)
+    return name
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _remove_stale_socket(path: str) -> None:
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path!r} exists and is not a socket")
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # nobody is listening anymore
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f"Another gateway is listening on {path!r}")
+
+
+class _Session:
+    """A single API connection."""
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.subscriptions: Set[int] = set()
+
+    def send(self, message: dict) -> None:
+        if self.writer.is_closing():
+            return
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    async def notify(self, method: str, params: dict) -> None:
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+        await self.writer.drain()
+
+
+@dataclasses.dataclass
+class _Device:
+    client: OralBClient
+    supervisor: ConnectionSupervisor
+    #: held while connecting
+    lock: asyncio.Lock = dataclasses.field(default_factory=asyncio.Lock)
+
+
+class Gateway:
+    """Long-running owner of all brush connections.
+
+    Connections are kept warm by a :class:`ConnectionSupervisor` per
+    device, decoded values are cached by the clients. Requests are served
+    as newline-delimited JSON-RPC 2.0 messages over a Unix socket (or a
+    local TCP port).
+
+    Methods: ``scan``, ``devices``, ``connect``, ``disconnect``, ``read``,
+    ``write``, ``control``, ``subscribe``, ``unsubscribe`` and
+    ``subscriptions``. Subscribed values are pushed as ``notify``
+    notifications through the client's :class:`NotificationHub`, so
+    sessions that read slowly only lose their own notifications.
+
+    :param device_cache: persisted device identities
+    :param pair: whether new connections are paired
+    """
+
+    def __init__(
+        self, device_cache: Optional[DeviceCache] = None, pair: bool = True
+    ) -> None:
+        self.device_cache = device_cache or DeviceCache.load()
+        self.pair = pair
+        self.devices: Dict[str, _Device] = {}
+        self.advertisements = {}
+        self.sessions: Set[_Session] = set()
+        self.time_sync = TimeSync.load()
+
+        #: subscription id -> (session, address, subscription, forwarder)
+        self.subscriptions: Dict[
+            int, Tuple[_Session, str, Subscription, asyncio.Task]
+        ] = {}
+        self._subscription_ids = itertools.count(1)
+        self._methods = {
+            "scan": self.scan,
+            "devices": self.list_devices,
+            "connect": self.connect,
+            "disconnect": self.disconnect,
+            "read": self.read,
+            "write": self.write,
+            "control": self.control,
+            "subscribe": self.subscribe,
+            "unsubscribe": self.unsubscribe,
+            "subscriptions": self.list_subscriptions,
+            "sync_time": self.sync_time,
+        }
+
+    # -- transport -----------------------------------------------------------
+    async def serve_unix(self, path: Optional[str] = None) -> asyncio.Server:
+        """Listens on a Unix socket that only the current user can access.
+
+        :raises FileExistsError: if *path* exists and is not a stale socket
+        """
+        path = path or default_socket_path()
+        _remove_stale_socket(path)
+        # the socket must never be accessible to others, not even briefly
+        # between bind() and chmod()
+        umask = os.umask(0o177)
+        try:
+            return await asyncio.start_unix_server(
+                self._handle, path, limit=REQUEST_LIMIT
+            )
+        finally:
+            os.umask(umask)
+
+    async def serve_tcp(
+        self, host: str = "127.0.0.1", port: int = 8765, allow_remote: bool = False
+    ) -> asyncio.Server:
+        """Listens on a TCP port.
+
+        The API is not authenticated, so only loopback hosts are accepted
+        unless *allow_remote* is set.
+        """
+        if not allow_remote and not _is_loopback(host):
+            raise ValueError(
+                f"Refusing to serve on non-loopback host {host!r} "
+                "(use allow_remote to override)"
+            )
+        return await asyncio.start_server(self._handle, host, port, limit=REQUEST_LIMIT)
+
+    async def close(self) -> None:
+        for device in list(self.devices.values()):
+            await device.supervisor.stop()
+        self.devices.clear()
+        self.device_cache.save()
+        self.time_sync.save()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer) -> None:
+        session = _Session(writer)
+        self.sessions.add(session)
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                # requests are served concurrently, responses carry the id
+                task = asyncio.create_task(self._dispatch(session, line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except (ValueError, asyncio.LimitOverrunError):
+            # the rest of the line can't be skipped reliably
+            message = f"Request exceeds {REQUEST_LIMIT} bytes"
+            error = {"code": INVALID_REQUEST, "message": message}
+            session.send({"jsonrpc": "2.0", "id": None, "error": error})
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.sessions.discard(session)
+            for subscription in list(session.subscriptions):
+                await self._unsubscribe(subscription)
+            writer.close()
+
+    async def _dispatch(self, session: _Session, line: bytes) -> None:
+        # parse errors are answered with a null id
+        request, reply = None, True
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                raise RPCError(PARSE_ERROR, f"Parse error: {err}") from err
+            if not isinstance(request, dict) or "method" not in request:
+                raise RPCError(INVALID_REQUEST, "Invalid request")
+
+            # requests without id are notifications
+            reply = "id" in request
+            method = self._methods.get(request["method"])
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, f"Unknown method: {request['method']}")
+
+            params = request.get("params") or {}
+            args, kwargs = (params, {}) if isinstance(params, list) else ((), params)
+            try:
+                inspect.signature(method).bind(session, *args, **kwargs)
+            except TypeError as err:
+                raise RPCError(INVALID_PARAMS, str(err)) from err
+            response = {"result": to_json(await method(session, *args, **kwargs))}
+        except RPCError as err:
+            response = {"error": {"code": err.code, "message": str(err)}}
+        except (exc.BleakError, TimeoutError, OSError, StructException) as err:
+            message = f"{type(err).__name__}: {err}"
+            response = {"error": {"code": DEVICE_ERROR, "message": message}}
+        except Exception as err:
+            message = f"{type(err).__name__}: {err}"
+            response = {"error": {"code": INTERNAL_ERROR, "message": message}}
+
+        if reply:
+            request_id = request.get("id") if isinstance(request, dict) else None
+            session.send({"jsonrpc": "2.0", "id": request_id, **response})
+
+    # -- helpers -------------------------------------------------------------
+    def _device(self, address: str) -> _Device:
+        device = self.devices.get(address.upper())
+        if device is None:
+            raise RPCError(INVALID_PARAMS, f"Not connected to {address!r}")
+        return device
+
+    def _property(self, client: OralBClient, uuid: str) -> OralBProperty:
+        model = __characteristics__.get(uuid)
+        if model is not None:
+            return getattr(client, model.__cname__)
+        raise RPCError(INVALID_PARAMS, f"Unknown characteristic: {uuid!r}")
+
+    # -- methods -------------------------------------------------------------
+    async def scan(self, session, timeout: float = 5.0):
+        brushes = await discover_brushes(timeout)
+        result = []
+        for address, (device, advertisement) in brushes.items():
+            self.advertisements[address] = advertisement
+            self.device_cache.observe(address, advertisement)
+            result.append(
+                {
+                    "address": address,
+                    "name": device.name,
+                    "advertisement": advertisement,
+                }
+            )
+        return result
+
+    async def list_devices(self, session):
+        return [
+            {
+                "address": address,
+                "state": device.supervisor.state,
+                "protocol": device.client.protocol,
+                "brush_type": device.client.brush_type,
+            }
+            for address, device in self.devices.items()
+        ]
+
+    async def connect(self, session, address: str):
+        address = address.upper()
+        device = self.devices.get(address)
+        if device is not None and device.supervisor.is_connected:
+            return {"address": address, "state": device.supervisor.state}
+
+        created = device is None
+        if created:
+            client = OralBClient(address)
+            # all devices share the default adapter
+            client.scheduler = GattScheduler.for_adapter(client.adapter)
+            supervisor = ConnectionSupervisor(client, pair=self.pair)
+            device = self.devices[address] = _Device(client, supervisor)
+
+        # concurrent calls wait for the connect in progress
+        async with device.lock:
+            if self.devices.get(address) is not device:
+                # the call that created the device failed (or it was
+                # disconnected in the meantime)
+                return await self.connect(session, address)
+            if device.supervisor.is_connected:
+                return {"address": address, "state": device.supervisor.state}
+
+            if created:
+                try:
+                    await device.supervisor.start(
+                        address=address, advertisement=self.advertisements.get(address)
+                    )
+                except BaseException:
+                    self.devices.pop(address, None)
+                    raise
+            elif not await device.supervisor.reconnect():
+                # joins the reconnect of the supervisor, which keeps trying
+                error = device.supervisor.last_error
+                raise error or ConnectionError(f"Could not connect to {address!r}")
+
+            await self._learn(address, device)
+        return {"address": address, "state": device.supervisor.state}
+
+    async def _learn(self, address: str, device: _Device) -> None:
+        advertisement = device.client.advertisement
+        if advertisement is not None:
+            self.device_cache.observe(address, advertisement)
+        record = self.device_cache.get_record(address)
+        if record is not None:
+            record.apply(device.client)
+        await self.device_cache.learn(device.client)
+        self.device_cache.save()
+
+    async def disconnect(self, session, address: str):
+        device = self._device(address)
+        for subscription, (_, sub_address, *_) in list(self.subscriptions.items()):
+            if sub_address == address.upper():
+                await self._unsubscribe(subscription)
+        await device.supervisor.stop()
+        del self.devices[address.upper()]
+        return True
+
+    async def read(self, session, address: str, characteristic: str, refresh=False):
+        device = self._device(address)
+        prop = self._property(device.client, resolve_uuid(characteristic))
+        if refresh:
+            prop._value = None
+        return await prop
+
+    async def write(
+        self, session, address: str, characteristic: str, data: str, response=False
+    ):
+        device = self._device(address)
+        uuid = resolve_uuid(characteristic)
+        await device.client.write(uuid, bytes.fromhex(data), response=response)
+        model = __characteristics__.get(uuid)
+        if model is not None:
+            # the cached value is outdated now
+            getattr(device.client, model.__cname__)._value = None
+        return True
+
+    async def control(
+        self, session, address: str, command: int, parameter: int = 0, timeout=None
+    ):
+        device = self._device(address)
+        return await device.client.control.request(Control(command, parameter), timeout)
+
+    async def sync_time(self, session, addresses=None, force: bool = False):
+        """Synchronizes the clocks of the given (or all connected) devices."""
+        if addresses:
+            devices = [self._device(address) for address in addresses]
+        else:
+            devices = [
+                device
+                for device in self.devices.values()
+                if device.supervisor.is_connected
+            ]
+        return await self.time_sync.sync_all(
+            (device.client for device in devices), force
+        )
+
+    async def subscribe(
+        self,
+        session: _Session,
+        address: str,
+        characteristic: str,
+        maxsize: int = 64,
+        policy: str = DropPolicy.DROP_OLDEST.value,
+    ):
+        device = self._device(address)
+        try:
+            policy = DropPolicy(policy)
+        except ValueError as err:
+            raise RPCError(INVALID_PARAMS, str(err)) from err
+
+        uuid = resolve_uuid(characteristic)
+        subscription = await device.client.hub.subscribe(uuid, maxsize, policy)
+        subscription_id = next(self._subscription_ids)
+        forwarder = asyncio.create_task(
+            self._forward(session, subscription_id, subscription)
+        )
+        address = device.client.address.upper()
+        self.subscriptions[subscription_id] = (
+            session,
+            address,
+            subscription,
+            forwarder,
+        )
+        session.subscriptions.add(subscription_id)
+        return {"subscription": subscription_id}
+
+    async def unsubscribe(self, session: _Session, subscription: int):
+        if self.subscriptions.get(subscription, (None,))[0] is not session:
+            raise RPCError(INVALID_PARAMS, f"Unknown subscription: {subscription}")
+        await self._unsubscribe(subscription)
+        return True
+
+    async def list_subscriptions(self, session: _Session):
+        return [
+            {
+                "subscription": subscription_id,
+                "address": address,
+                "characteristic": subscription.characteristic,
+                "dropped": subscription.dropped,
+            }
+            for subscription_id, (owner, address, subscription, _) in (
+                self.subscriptions.items()
+            )
+            if owner is session
+        ]
+
+    async def _unsubscribe(self, subscription_id: int) -> None:
+        session, _, subscription, _ = self.subscriptions.pop(subscription_id)
+        session.subscriptions.discard(subscription_id)
+        try:
+            await subscription.close()
+        except exc.BleakError:
+            pass
+
+    async def _forward(
+        self, session: _Session, subscription_id: int, subscription: Subscription
+    ) -> None:
+        try:
+            async for notification in subscription:
+                params = {
+                    "subscription": subscription_id,
+                    "characteristic": notification.characteristic,
+                    "value": to_json(notification.value),
+                    "timestamp": notification.timestamp,
+                }
+                # waiting here lets the subscription queue drop notifications
+                await session.notify("notify", params)
+        except ConnectionError:
+            pass
+
+
+async def serve(
+    path: Optional[str] = None,
+    host: Optional[str] = None,
+    port: int = 8765,
+    allow_remote: bool = False,
+) -> None:
+    """Runs the gateway until cancelled."""
+    gateway = Gateway()
+    if host is not None:
+        server = await gateway.serve_tcp(host, port, allow_remote)
+    else:
+        server = await gateway.serve_unix(path)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await gateway.close()
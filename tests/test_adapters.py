@@ -0,0 +1,77 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+
+from bleak import AdvertisementData, BLEDevice
+
+from oralb.blesdk.adapters import FakeScanner, MultiAdapterScanner
+
+
+def _advertisement(address: str, rssi: int):
+    device = BLEDevice(address, "Oral-B Toothbrush", None)
+    adv = AdvertisementData(None, {}, {}, [], None, rssi, ())
+    return device, adv
+
+
+def _scan(sightings):
+    # emits (adapter, address, rssi) through fake scanners
+    registry = {}
+    scanner = MultiAdapterScanner(["hci0", "hci1"], FakeScanner.factory(registry))
+
+    async def run():
+        async with scanner:
+            for adapter, address, rssi in sightings:
+                registry[adapter].emit(*_advertisement(address, rssi))
+        # stopped scanners drop advertisements
+        registry["hci0"].emit(*_advertisement("AA:00:00:00:00:03", -10))
+
+    asyncio.run(run())
+    return scanner
+
+
+def test_best_adapter():
+    scanner = _scan(
+        [
+            ("hci0", "aa:00:00:00:00:01", -80),
+            ("hci1", "AA:00:00:00:00:01", -60),
+            ("hci0", "AA:00:00:00:00:02", -50),
+        ]
+    )
+
+    assert scanner.best("AA:00:00:00:00:01").adapter == "hci1"
+    assert scanner.best("aa:00:00:00:00:02").adapter == "hci0"
+    assert scanner.best("AA:00:00:00:00:03") is None
+    assert set(scanner.results()) == {"AA:00:00:00:00:01", "AA:00:00:00:00:02"}
+
+
+def test_connections_are_spread():
+    scanner = _scan(
+        [
+            ("hci0", "AA:00:00:00:00:01", -40),
+            ("hci1", "AA:00:00:00:00:01", -70),
+            ("hci0", "AA:00:00:00:00:02", -40),
+            ("hci1", "AA:00:00:00:00:02", -70),
+        ]
+    )
+
+    assert scanner.acquire("AA:00:00:00:00:01") == "hci0"
+    # hci0 is busy, the weaker adapter takes the second device
+    assert scanner.acquire("AA:00:00:00:00:02") == "hci1"
+    assert scanner.load() == {"hci0": 1, "hci1": 1}
+
+    scanner.release("AA:00:00:00:00:01")
+    assert scanner.load() == {"hci0": 0, "hci1": 1}
+    # devices that were not seen can use any adapter
+    assert scanner.acquire("AA:00:00:00:00:09") == "hci0"
@@ -0,0 +1,164 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import struct
+import uuid
+
+import pytest
+
+from caterpillar.shortcuts import unpack
+
+from oralb.blesdk.brush import BrushAdvertisement
+from oralb.blesdk.capture import (
+    ADVERTISE,
+    ADVERTISEMENT,
+    BTSNOOP_EPOCH,
+    BTSNOOP_MAGIC,
+    DLT_HCI_UNENCAPSULATED,
+    NOTIFY,
+    READ,
+    HciParser,
+    decode_capture,
+    parse_line,
+    read_btsnoop,
+)
+from oralb.blesdk.advertise import COMPANY_ID
+from oralb.blesdk.model import CH_PRESSURE, Pressure
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+CONNECTION = 0x0040
+PRESSURE_HANDLE = 0x002A
+PRESSURE = bytes.fromhex("01 1027 6400 1a27 6e00 05")
+ADVERTISEMENT_DATA = bytes([6, 1, 10, 3, 0, 1, 2, 1, 50, 1, 4])
+
+# btsnoop flags of unencapsulated HCI packets
+RECEIVED = 0x01
+EVENT = 0x02
+
+
+def _address(text: str) -> bytes:
+    return bytes(reversed(bytes.fromhex(text.replace(":", ""))))
+
+
+def _event(code: int, parameters: bytes) -> bytes:
+    return bytes([code, len(parameters)]) + parameters
+
+
+def _connection_complete() -> bytes:
+    parameters = struct.pack("<BBHBB", 0x01, 0x00, CONNECTION, 0x00, 0x00)
+    parameters += _address(ADDRESS) + bytes(7)
+    return _event(0x3E, parameters)
+
+
+def _advertising_report() -> bytes:
+    manufacturer = struct.pack("<H", COMPANY_ID) + ADVERTISEMENT_DATA
+    data = bytes([len(manufacturer) + 1, 0xFF]) + manufacturer
+    report = bytes([0x02, 0x01, 0x00, 0x00]) + _address(ADDRESS)
+    report += bytes([len(data)]) + data + bytes([0xC4])
+    return _event(0x3E, report)
+
+
+def _acl(pdu: bytes, split: int = 0):
+    # an L2CAP frame of the attribute protocol, optionally fragmented
+    frame = struct.pack("<HH", len(pdu), 0x0004) + pdu
+    fragments = [frame[:split], frame[split:]] if split else [frame]
+    for index, fragment in enumerate(fragments):
+        flags = 0x1 if index else 0x2
+        header = struct.pack("<HH", CONNECTION | flags << 12, len(fragment))
+        yield header + fragment
+
+
+def _discovery():
+    # read by type request for characteristic declarations and its response
+    yield from _acl(struct.pack("<BHHH", 0x08, 0x0001, 0xFFFF, 0x2803))
+    declaration = struct.pack("<HBH", PRESSURE_HANDLE - 1, 0x12, PRESSURE_HANDLE)
+    declaration += bytes(reversed(uuid.UUID(CH_PRESSURE).bytes))
+    yield from _acl(bytes([0x09, len(declaration)]) + declaration)
+
+
+@pytest.fixture
+def btsnoop() -> bytes:
+    packets = [
+        (_advertising_report(), EVENT | RECEIVED),
+        (_connection_complete(), EVENT | RECEIVED),
+        *((packet, RECEIVED) for packet in _discovery()),
+        # a read and a fragmented notification of the pressure value
+        *((packet, 0) for packet in _acl(struct.pack("<BH", 0x0A, PRESSURE_HANDLE))),
+        *((packet, RECEIVED) for packet in _acl(b"\x0b" + PRESSURE)),
+        *(
+            (packet, RECEIVED)
+            for packet in _acl(
+                struct.pack("<BH", 0x1B, PRESSURE_HANDLE) + PRESSURE, split=6
+            )
+        ),
+    ]
+
+    data = BTSNOOP_MAGIC + struct.pack(">II", 1, DLT_HCI_UNENCAPSULATED)
+    for index, (packet, flags) in enumerate(packets):
+        timestamp = BTSNOOP_EPOCH + index * 1_000_000
+        data += struct.pack(">IIIIq", len(packet), len(packet), flags, 0, timestamp)
+        data += packet
+    return data
+
+
+def test_btsnoop_payloads(btsnoop):
+    stream = io.BytesIO(btsnoop)
+    stream.read(len(BTSNOOP_MAGIC))
+    payloads = list(read_btsnoop(stream, HciParser(), BTSNOOP_MAGIC))
+
+    assert [payload.kind for payload in payloads] == [ADVERTISE, READ, NOTIFY]
+    advertisement, read, notification = payloads
+    assert advertisement.characteristic == ADVERTISEMENT
+    assert advertisement.address == ADDRESS
+    assert advertisement.data == ADVERTISEMENT_DATA
+    assert advertisement.timestamp == 0.0
+
+    for payload in (read, notification):
+        # resolved through the discovery in the capture
+        assert payload.characteristic == CH_PRESSURE
+        assert payload.handle == PRESSURE_HANDLE
+        assert payload.address == ADDRESS
+        assert payload.data == PRESSURE
+    # the time of the last fragment
+    assert notification.timestamp == 7.0
+
+
+def test_known_handles():
+    parser = HciParser(devices={ADDRESS: {PRESSURE_HANDLE: CH_PRESSURE}})
+    packets = [bytes([0x04]) + _connection_complete()]
+    packets += [
+        bytes([0x02]) + packet
+        for packet in _acl(struct.pack("<BH", 0x1B, PRESSURE_HANDLE) + PRESSURE)
+    ]
+    payloads = [payload for packet in packets for payload in parser.feed(packet)]
+    assert [payload.characteristic for payload in payloads] == [CH_PRESSURE]
+
+
+def test_decode_capture(btsnoop):
+    decoded = list(decode_capture(io.BytesIO(btsnoop)))
+
+    assert [item.error for item in decoded] == [None] * 3
+    assert decoded[0].value == unpack(BrushAdvertisement, ADVERTISEMENT_DATA)
+    assert decoded[1].name == decoded[2].name == "pressure"
+    assert decoded[2].value == unpack(Pressure, PRESSURE)
+
+
+def test_parse_line():
+    payload = parse_line("pressure 01:10:27 64 00  # comment")
+    assert payload.characteristic == CH_PRESSURE
+    assert payload.data == bytes.fromhex("01102764 00")
+    assert parse_line("   # only a comment") is None
+    with pytest.raises(ValueError):
+        parse_line("pressure")
@@ -0,0 +1,98 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from oralb.blesdk.model import Pressure
+from oralb.blesdk.pressure import PressureSeries, PressureStore
+
+
+def _notifications(start: int, count: int, step: int = 10, value: int = 100):
+    # every notification repeats the last sample of the previous one
+    for index in range(count):
+        timestamp = (start + index * step) & 0xFFFF
+        yield Pressure(
+            Pressure.State.NORMAL_PRESSURE,
+            timestamp,
+            value,
+            (timestamp + step) & 0xFFFF,
+            value,
+            0,
+        )
+
+
+def test_overlapping_samples_are_duplicates():
+    series = PressureSeries(resolutions=(100,))
+    added = sum(series.add(pressure) for pressure in _notifications(0, 50))
+
+    assert added == 51
+    assert series.duplicates == 49
+    assert series.resets == 0
+    assert series.summary.count == 51
+    assert series.summary.sum == 51 * 100
+
+
+def test_repeated_notification_is_dropped():
+    series = PressureSeries()
+    pressure = next(_notifications(1000, 1))
+    assert series.add(pressure) == 2
+    assert series.add(pressure) == 0
+    assert series.duplicates == 2
+
+
+def test_wrap_around():
+    series = PressureSeries(resolutions=(100,))
+    added = sum(series.add(pressure) for pressure in _notifications(65000, 100))
+
+    assert added == 101
+    assert series.resets == 0
+    windows = series.windows()
+    starts = [window.start for window in windows]
+    assert starts == sorted(starts)
+    # unwrapped timestamps continue beyond the uint16 range
+    assert windows[-1].start >= 0x10000
+
+
+def test_restarted_counter_starts_a_new_epoch():
+    series = PressureSeries(resolutions=(100,))
+    for pressure in _notifications(0, 100):
+        series.add(pressure)
+    count = series.summary.count
+
+    # a new session restarts the counter at a small value
+    added = sum(series.add(pressure) for pressure in _notifications(0, 20, value=7))
+
+    assert added == 21
+    assert series.resets == 1
+    assert series.summary.count == count + 21
+    starts = [window.start for window in series.windows()]
+    assert starts == sorted(starts)
+
+
+def test_high_pressure_events():
+    series = PressureSeries(resolutions=(10,), threshold=500)
+    for timestamp, value in enumerate([100, 600, 700, 100, 800]):
+        series.add_sample(timestamp, value)
+    assert series.summary.high_events == 2
+    assert series.summary.max == 800
+
+
+def test_store_keeps_one_series_per_address():
+    store = PressureStore(resolutions=(100,))
+    for pressure in _notifications(0, 5):
+        store.add("AA", pressure)
+        store.add("BB", pressure)
+    store.add("AA", next(_notifications(1000, 1)))
+
+    assert "AA" in store and "CC" not in store
+    assert store["AA"].summary.count == 8
+    assert store["BB"].summary.count == 6
@@ -0,0 +1,121 @@
+# Copyright (C) MatrixEditor 2023
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import random
+
+import pytest
+
+from caterpillar.shortcuts import unpack
+
+from oralb.blesdk import sensor
+from oralb.blesdk.brush import BrushAdvertisement
+from oralb.blesdk.layout import compile_layout, is_fixed
+from oralb.blesdk.model import DeviceName, Pressure
+from oralb.blesdk.sensor import (
+    FRAME_SIZE,
+    SPECIAL,
+    MODEL,
+    NAMEDTUPLE,
+    TUPLE,
+    SensorCodec,
+    default_frames,
+)
+
+FRAMES = default_frames()
+
+
+def _frames(count: int = 50):
+    rng = random.Random(0)
+    for model, records, type_byte in FRAMES:
+        for _ in range(count):
+            if type_byte is None:
+                # plain motion data must not end with the special marker
+                frame = bytearray(rng.randbytes(FRAME_SIZE))
+                frame[-1] = SPECIAL - 1
+            else:
+                frame = bytearray(rng.randbytes(FRAME_SIZE - 2))
+                frame += bytes([type_byte, SPECIAL])
+            yield model, records, type_byte, bytes(frame)
+
+
+def _reference(model, records, type_byte, frame):
+    # the generic parser, as used before the table-driven codec
+    if type_byte is not None and records == 1:
+        return unpack(model, frame)
+    return unpack(model[records], frame)
+
+
+@pytest.mark.parametrize("model", [model for model, *_ in FRAMES] + [Pressure])
+def test_layout_matches_parser(model):
+    layout = compile_layout(model)
+    data = random.Random(1).randbytes(FRAME_SIZE)
+    assert layout.decode(data) == unpack(model, data)
+    assert layout.unpack(data) == tuple(
+        int(getattr(layout.decode(data), name)) for name in layout.names
+    )
+
+
+def test_dynamic_models_are_not_fixed():
+    assert not is_fixed(BrushAdvertisement)
+    assert not is_fixed(DeviceName)
+    with pytest.raises(TypeError):
+        compile_layout(BrushAdvertisement)
+
+
+def test_model_records_match_parser():
+    codec = SensorCodec(FRAMES, MODEL)
+    for model, records, type_byte, frame in _frames():
+        decoded = codec.decode(frame)
+        assert decoded.model is model
+        assert decoded.records == _reference(model, records, type_byte, frame)
+
+
+@pytest.mark.parametrize("kind", [TUPLE, NAMEDTUPLE])
+def test_tuple_records_match_parser(kind):
+    codec = SensorCodec(FRAMES, kind)
+    for model, records, type_byte, frame in _frames():
+        expected = _reference(model, records, type_byte, frame)
+        decoded = codec.records(frame)
+        if type_byte is not None and records == 1:
+            expected, decoded = [expected], [decoded]
+
+        frame_codec = codec.codec(frame)
+        if kind == TUPLE:
+            # absolute fields (the dashboard status) come last
+            layout = frame_codec.layout
+            names = layout.names + tuple(layout.absolute)
+        else:
+            names = frame_codec.record._fields
+        for record, reference in zip(decoded, expected, strict=True):
+            assert record == tuple(getattr(reference, name) for name in names)
+
+
+def test_encode_round_trip():
+    codec = SensorCodec(FRAMES, MODEL)
+    for *_, frame in _frames(10):
+        records = codec.decode(frame).records
+        assert codec.decode(codec.encode(records)).records == records
+
+
+def test_parser_fallback(monkeypatch):
+    def no_layout(model):
+        raise TypeError(f"{model!r} has no layout")
+
+    fast = SensorCodec(FRAMES, MODEL)
+    monkeypatch.setattr(sensor, "compile_layout", no_layout)
+    slow = SensorCodec(FRAMES, MODEL)
+    for *_, frame in _frames(10):
+        records = fast.decode(frame).records
+        assert slow.decode(frame).records == records
+        assert slow.encode(records) == fast.encode(records)